@@ -1,22 +1,26 @@
-import time
-import jwt
 import sqlite3
 import os
-import hashlib
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
 import glob
 import io
-import csv
+import tempfile
 import json
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import (
+    Blueprint, Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+)
 
 # ==========================================
 # CARGA DE VARIABLES DE ENTORNO (Fase 4)
 # ==========================================
-from dotenv import load_dotenv
-load_dotenv()  # Carga variables desde .env
+# Solo al ejecutar `python app.py`: importar el módulo no lee .env. Los
+# lanzadores (servidor.py, gunicorn.conf.py, asgi.py) lo cargan antes de
+# importar la aplicación, ya que los módulos de utils leen su configuración
+# al importarse.
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # ==========================================
 # MÓDULO DE SEGURIDAD (Fase 1)
@@ -25,7 +29,7 @@ from utils.seguridad import (
     TIMEZONE_CHILE, obtener_fecha_hora_chile, obtener_timestamp_chile,
     formatear_fecha_display, hashear_password, verificar_password,
     validar_politica_password, validar_rut_chileno, normalizar_rut,
-    enmascarar_rut, hashear_rut, cifrar_rut, descifrar_rut,
+    parsear_rut, enmascarar_rut, hashear_rut, cifrar_rut, descifrar_rut,
     generar_cip, validar_cip
 )
 
@@ -34,84 +38,85 @@ from utils.seguridad import (
 # ==========================================
 from utils.aprobaciones import (
     requiere_aprobacion, es_admin_maestro, puede_aprobar,
-    crear_solicitud, obtener_solicitudes_pendientes,
+    crear_solicitud, crear_solicitudes_lote, obtener_solicitudes_pendientes,
     obtener_solicitudes_usuario, contar_solicitudes_pendientes,
-    aprobar_solicitud, rechazar_solicitud
+    contar_solicitudes_pendientes_por_tipo, aprobar_solicitud, rechazar_solicitud,
+    resolver_solicitudes_lote
 )
 
 # ==========================================
 # MÓDULOS DE DATOS Y RESPALDOS (Refactorizado)
 # ==========================================
-from utils.database import get_db_connection, init_db, DB_PATH
+from utils.database import DB_PATH, asegurar_db, es_base_en_memoria, get_db_connection
 from utils.backups_logic import (
-    crear_respaldo, listar_respaldos, iniciar_hilo_respaldos, BACKUP_DIR
+    crear_respaldo, listar_respaldos, version_respaldos, BACKUP_DIR
+)
+from utils.auditoria import registrar_auditoria, registrar_auditoria_lote, obtener_auditoria
+from utils.pacientes import obtener_o_registrar_paciente
+from utils.referencias import (
+    obtener_lugar, obtener_lugares, obtener_usuarios, invalidar_referencias, version_referencias
 )
-from utils.auditoria import registrar_auditoria, obtener_auditoria
+from utils.fragmentos import fragmento, json_condicional
+from utils.consultas import archivar_consulta, obtener_estado_consulta, obtener_pacientes_espera
+from utils.estadisticas import obtener_resumen_medico_hoy
+from utils.analitica import obtener_analitica
+from utils.exportacion import (
+    consultar_historial_exportable, escribir_csv_historial,
+    escribir_parquet_historial, parquet_disponible
+)
+from utils.mantenimiento import LATIDO_INTERVALO_SEGUNDOS
+from utils.procesos import iniciar_tareas_segundo_plano
+from utils.importacion import leer_csv_pacientes, importar_pacientes
+from utils.metricas import limite_consultas, medir_fase, registrar_metricas
+from utils.sesiones import configurar_sesiones, revocar_sesiones_usuarios
 
 # ==========================================
 # CONFIGURACIÓN DE LA APLICACIÓN
 # ==========================================
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'clave_por_defecto_solo_desarrollo')
-
-# Verificar seguridad en producción
-if os.environ.get('FLASK_ENV') == 'production' and app.secret_key == 'clave_por_defecto_solo_desarrollo':
-    raise ValueError("ERROR: SECRET_KEY no configurada para produccion.")
-
-# Inicializar base de datos
-init_db()
+# Las rutas se registran en un blueprint y la aplicación se crea con
+# create_app() (al final del archivo): importar este módulo no abre la
+# base de datos ni crea carpetas; create_app() la inicializa.
+principal = Blueprint('principal', __name__)
 
 # ==========================================
 # PROTECCIÓN CSRF (Fase 3)
 # ==========================================
 from flask_wtf.csrf import CSRFProtect, CSRFError
-csrf = CSRFProtect(app)
+csrf = CSRFProtect()
 
-@app.errorhandler(CSRFError)
+@principal.app_errorhandler(CSRFError)
 def handle_csrf_error(e):
     flash('Error de seguridad: Token CSRF invalido. Por favor, recarga la pagina.')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 # ==========================================
-# CONFIGURACIÓN DEL SERVIDOR DE TELEMEDICINA
+# MÉTRICAS Y PERFILADO
 # ==========================================
-JITSI_HOST = os.environ.get('JITSI_HOST', '100.102.175.23:8443')
-JITSI_APP_ID = os.environ.get('JITSI_APP_ID', 'telemedicina_utalca')
-JITSI_APP_SECRET = os.environ.get('JITSI_APP_SECRET', 'ClaveSecretaHenry2026')
-
+# Latencia por ruta y desglose por fase en /metrics (utils/metricas.py),
+# registradas por create_app()
+render_template = medir_fase('plantilla')(render_template)
 
 # ==========================================
 # SEGURIDAD JITSI (JWT)
 # ==========================================
-
-def generar_token_jitsi(nombre_usuario, sala):
-    ahora = int(time.time())
-    payload = {
-        "iss": JITSI_APP_ID, 
-        "aud": JITSI_APP_ID, 
-        "sub": JITSI_HOST, 
-        "room": sala,
-        "iat": ahora, 
-        "exp": ahora + 3600,
-        "context": {"user": {"name": nombre_usuario}}
-    }
-    return jwt.encode(payload, JITSI_APP_SECRET, algorithm="HS256")
+# Tokens con caché por (usuario, sala): ver utils/jitsi.py
+from utils.jitsi import JITSI_TOKEN_MARGEN, obtener_token_jitsi
 
 # ==========================================
 # RUTAS DE LOGIN Y DASHBOARDS
 # ==========================================
 
-@app.route('/')
+@principal.route('/')
 def index():
     if 'rol' in session:
         rol = session['rol']
         # admin_maestro usa el mismo dashboard que admin
         if rol == 'admin_maestro':
-            return redirect(url_for('dashboard_admin'))
-        return redirect(url_for(f"dashboard_{rol}"))
+            return redirect(url_for('.dashboard_admin'))
+        return redirect(url_for(f".dashboard_{rol}"))
     return render_template('login_unico.html')
 
-@app.route('/login', methods=['POST'])
+@principal.route('/login', methods=['POST'])
 def login():
     correo = request.form.get('correo', '').strip().lower()
     password = request.form.get('password', '')
@@ -137,7 +142,7 @@ def login():
         )
         conn.close()
         flash('Credenciales incorrectas')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     # Verificar si está bloqueado
     if user['bloqueado_hasta']:
@@ -146,7 +151,7 @@ def login():
             if obtener_fecha_hora_chile().replace(tzinfo=None) < bloqueado_hasta:
                 conn.close()
                 flash('Cuenta bloqueada temporalmente. Intente más tarde.')
-                return redirect(url_for('index'))
+                return redirect(url_for('.index'))
         except:
             pass
     
@@ -199,8 +204,8 @@ def login():
         conn.close()
         # Redirigir al dashboard correcto (admin_maestro usa dashboard_admin)
         if user['rol'] == 'admin_maestro':
-            return redirect(url_for('dashboard_admin'))
-        return redirect(url_for(f"dashboard_{user['rol']}"))
+            return redirect(url_for('.dashboard_admin'))
+        return redirect(url_for(f".dashboard_{user['rol']}"))
     else:
         # Login fallido - incrementar intentos
         intentos = (user['intentos_fallidos'] or 0) + 1
@@ -237,31 +242,43 @@ def login():
             flash('Cuenta bloqueada por 30 minutos debido a múltiples intentos fallidos.')
         else:
             flash('Credenciales incorrectas')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
-@app.route('/dashboard_admin_maestro')
+@principal.route('/dashboard_admin_maestro')
 def dashboard_admin_maestro():
     """Alias para el dashboard de admin maestro - usa el mismo template"""
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/dashboard_admin')
+@principal.route('/dashboard_admin')
 def dashboard_admin():
     rol = session.get('rol')
     # Permitir acceso a admin y admin_maestro
     if rol not in ['admin', 'admin_maestro']: 
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     conn = get_db_connection()
-    usuarios = conn.execute('SELECT * FROM usuarios').fetchall()
-    lugares = conn.execute('SELECT * FROM lugares').fetchall()
-    historial = conn.execute('SELECT * FROM historial_consultas ORDER BY fecha_fin DESC').fetchall()
+    # Fragmentos cacheados por base, rol, usuario y versión de los datos:
+    # las consultas de cada tabla solo se ejecutan al renderizarla
+    clave = (conn.ruta, rol, session.get('user_id'))
+    tabla_usuarios = fragmento('admin_usuarios', clave + (version_referencias(conn, 'usuarios'),),
+                               lambda: render_template('fragmentos/admin_usuarios.html',
+                                                       usuarios=obtener_usuarios(conn)))
+    tabla_lugares = fragmento('admin_lugares', clave + (version_referencias(conn, 'lugares'),),
+                              lambda: render_template('fragmentos/admin_lugares.html',
+                                                      lugares=obtener_lugares(conn)))
+    # El historial solo recibe inserciones: el último id identifica su contenido
+    ultimo_historial = conn.execute('SELECT MAX(id) FROM historial_consultas').fetchone()[0]
+    tabla_historial = fragmento('admin_historial', clave + (ultimo_historial,),
+                                lambda: render_template('fragmentos/admin_historial.html', historial=conn.execute(
+                                    'SELECT * FROM historial_consultas ORDER BY fecha_fin DESC').fetchall()))
     
     # Obtener solicitudes pendientes (solo para admin_maestro)
     solicitudes_pendientes = []
-    total_pendientes = 0
+    pendientes_por_tipo = {}
     if es_admin_maestro(rol):
         solicitudes_pendientes = obtener_solicitudes_pendientes(conn)
-        total_pendientes = len(solicitudes_pendientes)
+        pendientes_por_tipo = contar_solicitudes_pendientes_por_tipo(conn)
+    total_pendientes = sum(pendientes_por_tipo.values())
     
     # Obtener mis solicitudes (para admin regular)
     mis_solicitudes = []
@@ -269,22 +286,25 @@ def dashboard_admin():
         mis_solicitudes = obtener_solicitudes_usuario(conn, session.get('user_id'))
     
     conn.close()
-    respaldos = listar_respaldos()
+    lista_respaldos = fragmento('admin_respaldos', clave + (version_respaldos(),),
+                                lambda: render_template('fragmentos/admin_respaldos.html',
+                                                        respaldos=listar_respaldos()))
     
     return render_template('dashboard_admin.html', 
                           saludo="Admin Maestro" if es_admin_maestro(rol) else "Admin",
-                          usuarios=usuarios, 
-                          lugares=lugares, 
-                          historial=historial, 
-                          respaldos=respaldos,
+                          tabla_usuarios=tabla_usuarios,
+                          tabla_lugares=tabla_lugares,
+                          tabla_historial=tabla_historial,
+                          lista_respaldos=lista_respaldos,
                           es_admin_maestro=es_admin_maestro(rol),
                           solicitudes_pendientes=solicitudes_pendientes,
                           total_pendientes=total_pendientes,
+                          pendientes_por_tipo=pendientes_por_tipo,
                           mis_solicitudes=mis_solicitudes)
 
-@app.route('/dashboard_medico')
+@principal.route('/dashboard_medico')
 def dashboard_medico():
-    if session.get('rol') != 'medico': return redirect(url_for('index'))
+    if session.get('rol') != 'medico': return redirect(url_for('.index'))
     conn = get_db_connection()
     nombre_medico = session.get('nombre', '')
     
@@ -294,17 +314,15 @@ def dashboard_medico():
         JOIN lugares l ON c.lugar_id = l.id WHERE c.estado = 'esperando'
     ''').fetchall()
     
-    # Consultas finalizadas hoy por este médico
-    consultas_finalizadas = conn.execute('''
-        SELECT COUNT(*) as total FROM historial_consultas 
-        WHERE nombre_medico = ? AND DATE(fecha_fin) = DATE('now', 'localtime')
-    ''', (nombre_medico,)).fetchone()['total']
+    # Consultas finalizadas hoy por este médico (tabla resumen)
+    consultas_finalizadas = obtener_resumen_medico_hoy(conn, nombre_medico)['total']
     
     # Historial de consultas finalizadas hoy (para el desplegable)
+    # fecha_fin está en UTC: se compara contra el inicio del día local en UTC
     historial_hoy = conn.execute('''
         SELECT codigo_consulta, cip, tens_nombre, nombre_posta, fecha_inicio, fecha_fin 
         FROM historial_consultas 
-        WHERE nombre_medico = ? AND DATE(fecha_fin) = DATE('now', 'localtime')
+        WHERE nombre_medico = ? AND fecha_fin >= datetime('now', 'localtime', 'start of day', 'utc')
         ORDER BY fecha_fin DESC
         LIMIT 20
     ''', (nombre_medico,)).fetchall()
@@ -324,41 +342,25 @@ def dashboard_medico():
                            historial_hoy=historial_hoy,
                            consultas_pendientes=consultas_pendientes)
 
-@app.route('/api/pacientes-espera')
+@principal.route('/api/pacientes-espera')
 def api_pacientes_espera():
     """API para obtener pacientes en espera (AJAX) sin recargar toda la página"""
     if session.get('rol') != 'medico':
         return jsonify({'error': 'No autorizado'}), 403
     
     conn = get_db_connection()
-    consultas = conn.execute('''
-        SELECT c.id, c.cip, c.fecha, l.nombre_posta, c.tens_nombre 
-        FROM consultas c 
-        JOIN lugares l ON c.lugar_id = l.id 
-        WHERE c.estado = 'esperando'
-        ORDER BY c.fecha ASC
-    ''').fetchall()
+    pacientes = obtener_pacientes_espera(conn)
     conn.close()
     
-    # Convertir a lista de diccionarios
-    pacientes = []
-    for c in consultas:
-        pacientes.append({
-            'id': c['id'],
-            'cip': c['cip'],
-            'nombre_posta': c['nombre_posta'],
-            'tens_nombre': c['tens_nombre'],
-            'tens_inicial': c['tens_nombre'][0] if c['tens_nombre'] else '?'
-        })
-    
-    return jsonify({'pacientes': pacientes, 'total': len(pacientes)})
+    # Los sondeos sin cambios reciben 304 sin cuerpo
+    return json_condicional({'pacientes': pacientes, 'total': len(pacientes)})
 
 
-@app.route('/dashboard_tens')
+@principal.route('/dashboard_tens')
 def dashboard_tens():
-    if session.get('rol') != 'tens': return redirect(url_for('index'))
+    if session.get('rol') != 'tens': return redirect(url_for('.index'))
     conn = get_db_connection()
-    lugares = conn.execute('SELECT * FROM lugares').fetchall()
+    lugares = obtener_lugares(conn)
     conn.close()
     return render_template('dashboard_tens.html', saludo=f"TENS {session['nombre']}", lugares=lugares)
 
@@ -366,11 +368,11 @@ def dashboard_tens():
 # ACCIONES DE ADMINISTRACIÓN
 # ==========================================
 
-@app.route('/admin/registrar-usuario', methods=['POST'])
+@principal.route('/admin/registrar-usuario', methods=['POST'])
 def registrar_usuario():
     rol_sesion = session.get('rol')
     if rol_sesion not in ['admin', 'admin_maestro']: 
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     nombre = request.form.get('nombre', '').strip()
     rut = request.form.get('rut', '').strip()
@@ -378,20 +380,18 @@ def registrar_usuario():
     rol = request.form.get('rol', '').lower().strip()
     password = request.form.get('password', '')
     
-    # Validar RUT chileno
-    rut_valido, rut_numero, rut_dv, rut_mensaje = validar_rut_chileno(rut)
-    if not rut_valido:
-        flash(f'❌ RUT inválido: {rut_mensaje}')
-        return redirect(url_for('dashboard_admin'))
-    
-    # Normalizar RUT (formato: 12345678-9)
-    rut_normalizado = normalizar_rut(rut)
+    # Validar y normalizar RUT chileno (formato: 12345678-9) en un solo paso
+    rut_parseado = parsear_rut(rut)
+    if not rut_parseado:
+        flash(f'❌ RUT inválido: {validar_rut_chileno(rut)[3]}')
+        return redirect(url_for('.dashboard_admin'))
+    rut_normalizado = rut_parseado.normalizado
     
     # Validar política de contraseña
     password_valida, password_mensaje = validar_politica_password(password)
     if not password_valida:
         flash(f'❌ Contraseña inválida: {password_mensaje}')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     # Hashear contraseña
     password_hash = hashear_password(password)
@@ -402,6 +402,7 @@ def registrar_usuario():
             INSERT INTO usuarios (nombre, rut, correo, rol, password, password_hash, fecha_creacion, activo) 
             VALUES (?, ?, ?, ?, ?, ?, ?, 1)
         ''', (nombre, rut_normalizado, correo, rol, password, password_hash, obtener_timestamp_chile()))
+        invalidar_referencias(conn, 'usuarios')
         
         # Registrar auditoría
         registrar_auditoria(
@@ -413,7 +414,7 @@ def registrar_usuario():
             categoria='usuarios',
             entidad_tipo='usuario',
             entidad_id=str(conn.execute('SELECT last_insert_rowid()').fetchone()[0]),
-            datos_despues=json.dumps({'nombre': nombre, 'rut_masked': enmascarar_rut(rut_normalizado), 'rol': rol}),
+            datos_despues=json.dumps({'nombre': nombre, 'rut_masked': rut_parseado.enmascarado, 'rol': rol}),
             resultado='exito',
             mensaje=f'Usuario {nombre} ({rol}) creado',
             ip_origen=request.remote_addr
@@ -433,27 +434,38 @@ def registrar_usuario():
     finally:
         conn.close()
     
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/eliminar-usuarios', methods=['POST'])
+@principal.route('/admin/eliminar-usuarios', methods=['POST'])
+@limite_consultas(10)
 def eliminar_usuarios():
     rol = session.get('rol')
     if rol not in ['admin', 'admin_maestro']: 
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
-    ids = request.form.getlist('usuarios_seleccionados')
+    ids = _ids_seleccionados('usuarios_seleccionados')
     if not ids:
         flash('No se seleccionaron usuarios.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     conn = get_db_connection()
     
+    # Validación en bloque: una sola lectura de los usuarios seleccionados
+    encontrados = {u['id']: u for u in conn.execute(
+        f"SELECT id, nombre, rol, es_plantilla, rut FROM usuarios WHERE id IN ({','.join('?' * len(ids))})",
+        ids
+    ).fetchall()}
+    total_admins = conn.execute(
+        "SELECT COUNT(*) FROM usuarios WHERE rol IN ('admin', 'admin_maestro')"
+    ).fetchone()[0]
+    
+    # Admins eliminables sin dejar el sistema sin Administrador
+    # (la solicitud de un admin regular no elimina: solo exige que haya otro)
+    admins_disponibles = total_admins - 1
+    
+    seleccionados = []
     for uid in ids:
-        usuario = conn.execute(
-            "SELECT id, nombre, rol, es_plantilla, rut FROM usuarios WHERE id = ?", 
-            (uid,)
-        ).fetchone()
-        
+        usuario = encontrados.get(uid)
         if not usuario:
             continue
         
@@ -469,79 +481,91 @@ def eliminar_usuarios():
         
         # Verificar que no sea el único admin
         if usuario['rol'] in ['admin', 'admin_maestro']:
-            total_admins = conn.execute(
-                "SELECT COUNT(*) FROM usuarios WHERE rol IN ('admin', 'admin_maestro')"
-            ).fetchone()[0]
-            if total_admins <= 1:
+            if admins_disponibles <= 0:
                 flash("No puedes eliminar al unico Administrador.")
                 continue
+            if es_admin_maestro(rol):
+                admins_disponibles -= 1
         
-        # Si es admin_maestro, ejecutar directamente
-        if es_admin_maestro(rol):
-            conn.execute('DELETE FROM usuarios WHERE id = ?', (uid,))
-            registrar_auditoria(
-                conn=conn,
-                usuario_id=session.get('user_id'),
-                usuario_nombre=session.get('nombre'),
-                usuario_rol=rol,
-                accion='usuario_eliminado',
-                categoria='usuarios',
-                entidad_tipo='usuario',
-                entidad_id=str(uid),
-                datos_antes=json.dumps({'nombre': usuario['nombre'], 'rol': usuario['rol']}),
-                resultado='exito',
-                mensaje=f"Usuario {usuario['nombre']} eliminado por Admin Maestro",
-                ip_origen=request.remote_addr
-            )
-            flash(f"Usuario '{usuario['nombre']}' eliminado.")
+        seleccionados.append(usuario)
+    
+    if seleccionados and es_admin_maestro(rol):
+        # Si es admin_maestro, ejecutar directamente (DELETE único, con las
+        # mismas protecciones como condición)
+        conn.execute(f"""
+            DELETE FROM usuarios
+            WHERE id IN ({','.join('?' * len(seleccionados))})
+              AND COALESCE(es_plantilla, 0) = 0 AND rol != 'admin_maestro'
+        """, [u['id'] for u in seleccionados])
+        invalidar_referencias(conn, 'usuarios')
+        # Los eliminados pierden sus sesiones abiertas en el acto
+        revocar_sesiones_usuarios(conn, [u['id'] for u in seleccionados])
+        registrar_auditoria_lote(conn, [{
+            'usuario_id': session.get('user_id'),
+            'usuario_nombre': session.get('nombre'),
+            'usuario_rol': rol,
+            'accion': 'usuario_eliminado',
+            'categoria': 'usuarios',
+            'entidad_tipo': 'usuario',
+            'entidad_id': str(u['id']),
+            'datos_antes': json.dumps({'nombre': u['nombre'], 'rol': u['rol']}),
+            'resultado': 'exito',
+            'mensaje': f"Usuario {u['nombre']} eliminado por Admin Maestro",
+            'ip_origen': request.remote_addr,
+        } for u in seleccionados])
+        flash(_resumen_nombres("Usuario eliminado", "usuarios eliminados",
+                               [u['nombre'] for u in seleccionados]))
+    elif seleccionados:
+        # Admin regular: crear solicitudes de aprobacion
+        solicitudes = crear_solicitudes_lote(
+            conn=conn,
+            tipo_accion='eliminar_usuario',
+            entidad_tipo='usuario',
+            entidades=[
+                (u['id'], {'nombre': u['nombre'], 'rol': u['rol'], 'rut_masked': enmascarar_rut(u['rut'])})
+                for u in seleccionados
+            ],
+            solicitante_id=session.get('user_id'),
+            solicitante_nombre=session.get('nombre'),
+            solicitante_rol=rol,
+            justificacion=request.form.get('justificacion', '')
+        )
+        
+        if solicitudes:
+            registrar_auditoria_lote(conn, [{
+                'usuario_id': session.get('user_id'),
+                'usuario_nombre': session.get('nombre'),
+                'usuario_rol': rol,
+                'accion': 'solicitud_eliminacion_usuario',
+                'categoria': 'usuarios',
+                'entidad_tipo': 'solicitud',
+                'entidad_id': str(solicitud_id),
+                'resultado': 'pendiente',
+                'mensaje': f"Solicitud para eliminar usuario {u['nombre']}",
+                'ip_origen': request.remote_addr,
+            } for solicitud_id, u in zip(solicitudes, seleccionados)])
+            flash(_resumen_nombres("Solicitud de eliminacion enviada al Admin Maestro",
+                                   "solicitudes de eliminacion enviadas al Admin Maestro",
+                                   [u['nombre'] for u in seleccionados]))
         else:
-            # Admin regular: crear solicitud de aprobacion
-            solicitud_id = crear_solicitud(
-                conn=conn,
-                tipo_accion='eliminar_usuario',
-                entidad_tipo='usuario',
-                entidad_id=str(uid),
-                solicitante_id=session.get('user_id'),
-                solicitante_nombre=session.get('nombre'),
-                solicitante_rol=rol,
-                datos_originales={'nombre': usuario['nombre'], 'rol': usuario['rol'], 'rut_masked': enmascarar_rut(usuario['rut'])},
-                justificacion=request.form.get('justificacion', '')
-            )
-            
-            if solicitud_id:
-                registrar_auditoria(
-                    conn=conn,
-                    usuario_id=session.get('user_id'),
-                    usuario_nombre=session.get('nombre'),
-                    usuario_rol=rol,
-                    accion='solicitud_eliminacion_usuario',
-                    categoria='usuarios',
-                    entidad_tipo='solicitud',
-                    entidad_id=str(solicitud_id),
-                    resultado='pendiente',
-                    mensaje=f"Solicitud para eliminar usuario {usuario['nombre']}",
-                    ip_origen=request.remote_addr
-                )
-                flash(f"Solicitud de eliminacion de '{usuario['nombre']}' enviada al Admin Maestro.")
-            else:
-                flash(f"Error al crear solicitud para {usuario['nombre']}.")
+            flash("Error al crear las solicitudes de eliminacion.")
     
     conn.commit()
     conn.close()
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/registrar-lugar', methods=['POST'])
+@principal.route('/admin/registrar-lugar', methods=['POST'])
 def registrar_lugar():
     rol = session.get('rol')
     if rol not in ['admin', 'admin_maestro']: 
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     nombre = request.form.get('nombre_posta', '').strip()
     direccion = request.form.get('direccion', '').strip()
     
     if not nombre or not direccion:
         flash('Nombre y direccion son requeridos.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     conn = get_db_connection()
     try:
@@ -549,6 +573,7 @@ def registrar_lugar():
             INSERT INTO lugares (nombre_posta, direccion, fecha_creacion, activo) 
             VALUES (?, ?, ?, 1)
         ''', (nombre, direccion, obtener_timestamp_chile()))
+        invalidar_referencias(conn, 'lugares')
         
         registrar_auditoria(
             conn=conn,
@@ -572,27 +597,31 @@ def registrar_lugar():
     finally:
         conn.close()
     
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/eliminar-lugares', methods=['POST'])
+@principal.route('/admin/eliminar-lugares', methods=['POST'])
+@limite_consultas(10)
 def eliminar_lugares():
     rol = session.get('rol')
     if rol not in ['admin', 'admin_maestro']: 
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
-    ids = request.form.getlist('lugares_seleccionados')
+    ids = _ids_seleccionados('lugares_seleccionados')
     if not ids:
         flash('No se seleccionaron lugares.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     conn = get_db_connection()
     
+    # Validación en bloque: una sola lectura de los lugares seleccionados
+    encontrados = {l['id']: l for l in conn.execute(
+        f"SELECT id, nombre_posta, direccion, es_plantilla FROM lugares WHERE id IN ({','.join('?' * len(ids))})",
+        ids
+    ).fetchall()}
+    
+    seleccionados = []
     for lid in ids:
-        lugar = conn.execute(
-            "SELECT id, nombre_posta, direccion, es_plantilla FROM lugares WHERE id = ?", 
-            (lid,)
-        ).fetchone()
-        
+        lugar = encontrados.get(lid)
         if not lugar:
             continue
         
@@ -601,58 +630,84 @@ def eliminar_lugares():
             flash(f"La posta '{lugar['nombre_posta']}' es una plantilla protegida.")
             continue
         
+        seleccionados.append(lugar)
+    
+    if seleccionados and es_admin_maestro(rol):
         # Si es admin_maestro, ejecutar directamente
-        if es_admin_maestro(rol):
-            conn.execute('DELETE FROM lugares WHERE id = ?', (lid,))
-            registrar_auditoria(
-                conn=conn,
-                usuario_id=session.get('user_id'),
-                usuario_nombre=session.get('nombre'),
-                usuario_rol=rol,
-                accion='lugar_eliminado',
-                categoria='lugares',
-                entidad_tipo='lugar',
-                entidad_id=str(lid),
-                datos_antes=json.dumps({'nombre': lugar['nombre_posta']}),
-                resultado='exito',
-                mensaje=f"Lugar {lugar['nombre_posta']} eliminado por Admin Maestro",
-                ip_origen=request.remote_addr
-            )
-            flash(f"Lugar '{lugar['nombre_posta']}' eliminado.")
+        conn.execute(f"""
+            DELETE FROM lugares
+            WHERE id IN ({','.join('?' * len(seleccionados))}) AND COALESCE(es_plantilla, 0) = 0
+        """, [l['id'] for l in seleccionados])
+        invalidar_referencias(conn, 'lugares')
+        registrar_auditoria_lote(conn, [{
+            'usuario_id': session.get('user_id'),
+            'usuario_nombre': session.get('nombre'),
+            'usuario_rol': rol,
+            'accion': 'lugar_eliminado',
+            'categoria': 'lugares',
+            'entidad_tipo': 'lugar',
+            'entidad_id': str(l['id']),
+            'datos_antes': json.dumps({'nombre': l['nombre_posta']}),
+            'resultado': 'exito',
+            'mensaje': f"Lugar {l['nombre_posta']} eliminado por Admin Maestro",
+            'ip_origen': request.remote_addr,
+        } for l in seleccionados])
+        flash(_resumen_nombres("Lugar eliminado", "lugares eliminados",
+                               [l['nombre_posta'] for l in seleccionados]))
+    elif seleccionados:
+        # Admin regular: crear solicitudes de aprobacion
+        solicitudes = crear_solicitudes_lote(
+            conn=conn,
+            tipo_accion='eliminar_lugar',
+            entidad_tipo='lugar',
+            entidades=[
+                (l['id'], {'nombre': l['nombre_posta'], 'direccion': l['direccion']})
+                for l in seleccionados
+            ],
+            solicitante_id=session.get('user_id'),
+            solicitante_nombre=session.get('nombre'),
+            solicitante_rol=rol,
+            justificacion=request.form.get('justificacion', '')
+        )
+        
+        if solicitudes:
+            flash(_resumen_nombres("Solicitud de eliminacion enviada al Admin Maestro",
+                                   "solicitudes de eliminacion enviadas al Admin Maestro",
+                                   [l['nombre_posta'] for l in seleccionados]))
         else:
-            # Admin regular: crear solicitud de aprobacion
-            solicitud_id = crear_solicitud(
-                conn=conn,
-                tipo_accion='eliminar_lugar',
-                entidad_tipo='lugar',
-                entidad_id=str(lid),
-                solicitante_id=session.get('user_id'),
-                solicitante_nombre=session.get('nombre'),
-                solicitante_rol=rol,
-                datos_originales={'nombre': lugar['nombre_posta'], 'direccion': lugar['direccion']},
-                justificacion=request.form.get('justificacion', '')
-            )
-            
-            if solicitud_id:
-                flash(f"Solicitud de eliminacion de '{lugar['nombre_posta']}' enviada al Admin Maestro.")
-            else:
-                flash(f"Error al crear solicitud para {lugar['nombre_posta']}.")
+            flash("Error al crear las solicitudes de eliminacion.")
     
     conn.commit()
     conn.close()
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
+
+def _ids_seleccionados(campo):
+    """IDs enteros (sin repetir, en orden) marcados en un formulario de selección múltiple."""
+    ids = []
+    for valor in request.form.getlist(campo):
+        if valor.isdigit() and int(valor) not in ids:
+            ids.append(int(valor))
+    return ids
+
+def _resumen_nombres(singular, plural, nombres, maximo=5):
+    """Un solo mensaje flash para una operación en bloque."""
+    if len(nombres) == 1:
+        return f"{singular}: '{nombres[0]}'."
+    if len(nombres) <= maximo:
+        return f"{len(nombres)} {plural}: " + ', '.join(f"'{n}'" for n in nombres) + "."
+    return f"{len(nombres)} {plural}."
 
 # ==========================================
 # GESTIÓN DE APROBACIONES (Solo Admin Maestro)
 # ==========================================
 
-@app.route('/admin/aprobar-solicitud/<int:solicitud_id>', methods=['POST'])
+@principal.route('/admin/aprobar-solicitud/<int:solicitud_id>', methods=['POST'])
 def aprobar_solicitud_route(solicitud_id):
     """Aprueba una solicitud pendiente"""
     rol = session.get('rol')
     if not es_admin_maestro(rol):
         flash('Solo el Admin Maestro puede aprobar solicitudes.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     motivo = request.form.get('motivo', 'Aprobada')
     
@@ -685,20 +740,20 @@ def aprobar_solicitud_route(solicitud_id):
     
     conn.commit()
     conn.close()
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/rechazar-solicitud/<int:solicitud_id>', methods=['POST'])
+@principal.route('/admin/rechazar-solicitud/<int:solicitud_id>', methods=['POST'])
 def rechazar_solicitud_route(solicitud_id):
     """Rechaza una solicitud pendiente"""
     rol = session.get('rol')
     if not es_admin_maestro(rol):
         flash('Solo el Admin Maestro puede rechazar solicitudes.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     motivo = request.form.get('motivo', '')
     if not motivo:
         flash('Debe proporcionar un motivo para rechazar.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     conn = get_db_connection()
     exito, mensaje = rechazar_solicitud(
@@ -729,71 +784,106 @@ def rechazar_solicitud_route(solicitud_id):
     
     conn.commit()
     conn.close()
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
+
+@principal.route('/admin/resolver-solicitudes', methods=['POST'])
+def resolver_solicitudes_route():
+    """Aprueba o rechaza en bloque las solicitudes seleccionadas"""
+    rol = session.get('rol')
+    if not es_admin_maestro(rol):
+        flash('Solo el Admin Maestro puede resolver solicitudes.')
+        return redirect(url_for('.dashboard_admin'))
+    
+    ids = _ids_seleccionados('solicitudes_seleccionadas')
+    if not ids:
+        flash('No se seleccionaron solicitudes.')
+        return redirect(url_for('.dashboard_admin'))
+    
+    aprobar = request.form.get('decision') == 'aprobar'
+    motivo = request.form.get('motivo', '').strip()
+    if not aprobar and not motivo:
+        flash('Debe proporcionar un motivo para rechazar.')
+        return redirect(url_for('.dashboard_admin'))
+    
+    conn = get_db_connection()
+    try:
+        # Todas las acciones y su auditoría en una sola transacción
+        conn.execute('BEGIN IMMEDIATE')
+        resultados = resolver_solicitudes_lote(
+            conn=conn,
+            solicitud_ids=ids,
+            aprobar=aprobar,
+            aprobador_id=session.get('user_id'),
+            aprobador_nombre=session.get('nombre'),
+            motivo=motivo or 'Aprobada'
+        )
+        registrar_auditoria_lote(conn, [{
+            'usuario_id': session.get('user_id'),
+            'usuario_nombre': session.get('nombre'),
+            'usuario_rol': rol,
+            'accion': 'solicitud_aprobada' if aprobar else 'solicitud_rechazada',
+            'categoria': 'sistema',
+            'entidad_tipo': 'solicitud',
+            'entidad_id': str(r['id']),
+            'resultado': 'exito',
+            'mensaje': r['mensaje'] if aprobar else f"Rechazada: {motivo}",
+            'ip_origen': request.remote_addr,
+        } for r in resultados if r['exito']])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        flash(f'Error al resolver solicitudes: {str(e)}')
+        return redirect(url_for('.dashboard_admin'))
+    finally:
+        conn.close()
+    
+    exitosas = sum(1 for r in resultados if r['exito'])
+    flash(f"{exitosas} de {len(resultados)} solicitudes {'aprobadas' if aprobar else 'rechazadas'}.")
+    for r in [r for r in resultados if not r['exito']][:5]:
+        flash(f"Solicitud #{r['id']}: {r['mensaje']}")
+    
+    return redirect(url_for('.dashboard_admin'))
 
 # ==========================================
 # ACCIONES DE CONSULTA
 # ==========================================
 
-@app.route('/tens/crear-consulta', methods=['POST'])
+@principal.route('/tens/crear-consulta', methods=['POST'])
 def crear_consulta():
-    if session.get('rol') != 'tens': return redirect(url_for('index'))
+    if session.get('rol') != 'tens': return redirect(url_for('.index'))
     if request.form.get('consentimiento') != 'aceptado':
         flash('Atencion: El paciente debe aceptar el consentimiento.')
-        return redirect(url_for('dashboard_tens'))
+        return redirect(url_for('.dashboard_tens'))
 
     rut_paciente = request.form.get('rut_paciente', '').strip()
     lugar_id = request.form.get('lugar_id')
     
-    # Validar RUT del paciente
-    rut_valido, rut_numero, rut_dv, rut_mensaje = validar_rut_chileno(rut_paciente)
-    if not rut_valido:
-        flash(f'RUT invalido: {rut_mensaje}')
-        return redirect(url_for('dashboard_tens'))
-    
-    # Normalizar RUT (formato: 12345678-9)
-    rut_normalizado = normalizar_rut(rut_paciente)
+    # Validar RUT del paciente (se parsea una sola vez: número, DV,
+    # forma normalizada, enmascarada y hash)
+    rut = parsear_rut(rut_paciente)
+    if not rut:
+        flash(f'RUT invalido: {validar_rut_chileno(rut_paciente)[3]}')
+        return redirect(url_for('.dashboard_tens'))
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Obtener nombre de la posta para generar CIP
-    lugar = cursor.execute('SELECT nombre_posta FROM lugares WHERE id = ?', (lugar_id,)).fetchone()
+    lugar = obtener_lugar(conn, lugar_id)
     nombre_posta = lugar['nombre_posta'] if lugar else 'GEN'
     
     # ==========================================
-    # PRIVACY BY DESIGN: Generar identificadores pseudoanónimos
+    # PRIVACY BY DESIGN: Identificador pseudoanónimo
     # ==========================================
-    
-    # 1. Generar CIP único (Código de Identificación de Paciente)
-    cip = generar_cip(nombre_posta)
-    
-    # Verificar que el CIP sea único (regenerar si ya existe)
-    while cursor.execute('SELECT id FROM mapeo_pacientes WHERE cip = ?', (cip,)).fetchone():
-        cip = generar_cip(nombre_posta)
-    
-    # 2. Cifrar RUT con AES-256-GCM (Ley 19.628 / Marco Ciberseguridad)
-    rut_cifrado = cifrar_rut(rut_normalizado)
-    if not rut_cifrado:
+    # Un paciente que vuelve reutiliza su CIP (búsqueda por rut_hash);
+    # solo un paciente nuevo genera CIP y cifra su RUT con AES-256-GCM.
+    cip, rut_hash, _ = obtener_o_registrar_paciente(
+        conn, rut, nombre_posta, session.get('user_id')
+    )
+    if not cip:
         flash('Error de seguridad al procesar datos del paciente.')
         conn.close()
-        return redirect(url_for('dashboard_tens'))
-    
-    # 3. Hash del RUT para búsquedas (sin exponer el RUT)
-    rut_hash = hashear_rut(rut_normalizado)
-    
-    # 4. RUT enmascarado para display mínimo si es necesario
-    rut_masked = enmascarar_rut(rut_normalizado)
-    
-    # ==========================================
-    # ALMACENAMIENTO SEGURO
-    # ==========================================
-    
-    # Guardar mapeo CIP ↔ RUT cifrado (solo para trazabilidad interna)
-    cursor.execute('''
-        INSERT INTO mapeo_pacientes (cip, rut_cifrado, rut_hash, rut_enmascarado, creado_por_id)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (cip, rut_cifrado, rut_hash, rut_masked, session.get('user_id')))
+        return redirect(url_for('.dashboard_tens'))
     
     # Crear consulta con CIP (SIN RUT visible)
     cursor.execute('''
@@ -806,14 +896,71 @@ def crear_consulta():
     conn.close()
     
     # Usar CIP como identificador de sala (NO el RUT)
-    token = generar_token_jitsi(session['nombre'], cip)
-    return render_template('consulta.html', jitsi_token=token, sala=cip, 
+    token, token_exp = obtener_token_jitsi(session['nombre'], cip)
+    return render_template('consulta.html', jitsi_token=token, jitsi_token_exp=token_exp,
+                           jitsi_token_margen=JITSI_TOKEN_MARGEN, sala=cip, 
                            nombre_usuario=f"TENS: {session['nombre']}", 
                            consulta_id=consulta_id, es_medico=False)
 
-@app.route('/iniciar-consulta', methods=['POST'])
+@principal.route('/tens/importar-pacientes', methods=['POST'])
+@limite_consultas(0)  # Crece con el archivo: unas pocas consultas por lote
+def importar_pacientes_csv():
+    """Pre-registro masivo de pacientes desde un CSV (columna 'rut', opcional 'lugar_id')"""
+    rol = session.get('rol')
+    if rol not in ['tens', 'admin', 'admin_maestro']:
+        return redirect(url_for('.index'))
+    destino = '.dashboard_tens' if rol == 'tens' else '.dashboard_admin'
+    
+    archivo = request.files.get('archivo_csv')
+    lugar_id = request.form.get('lugar_id')
+    if not archivo or not archivo.filename:
+        flash('Debe seleccionar un archivo CSV.')
+        return redirect(url_for(destino))
+    
+    conn = get_db_connection()
+    try:
+        # Lectura en streaming: el CSV nunca se carga completo en memoria
+        texto = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+        resumen = importar_pacientes(
+            conn, leer_csv_pacientes(texto),
+            lugar_id_defecto=lugar_id,
+            creado_por_id=session.get('user_id')
+        )
+    except Exception as e:
+        conn.close()
+        flash(f'Error al importar pacientes: {str(e)}')
+        return redirect(url_for(destino))
+    
+    registrar_auditoria(
+        conn=conn,
+        usuario_id=session.get('user_id'),
+        usuario_nombre=session.get('nombre'),
+        usuario_rol=rol,
+        accion='pacientes_importados',
+        categoria='consultas',
+        entidad_tipo='mapeo_pacientes',
+        datos_despues=json.dumps({k: v for k, v in resumen.items() if k != 'errores'}),
+        resultado='exito' if not resumen['errores'] else 'error',
+        mensaje=f"Importacion CSV: {resumen['registradas']} pacientes registrados, "
+                f"{len(resumen['errores'])} errores",
+        ip_origen=request.remote_addr
+    )
+    conn.commit()
+    conn.close()
+    
+    flash(f"Importacion completada: {resumen['registradas']} nuevos, "
+          f"{resumen['existentes']} ya registrados, {resumen['duplicadas']} repetidos en el archivo, "
+          f"{len(resumen['errores'])} con error.")
+    for error in resumen['errores'][:10]:
+        flash(f"Fila {error['fila']}: {error['error']}")
+    if len(resumen['errores']) > 10:
+        flash(f"... y {len(resumen['errores']) - 10} errores mas.")
+    
+    return redirect(url_for(destino))
+
+@principal.route('/iniciar-consulta', methods=['POST'])
 def iniciar_consulta():
-    if not session.get('user_id'): return redirect(url_for('index'))
+    if not session.get('user_id'): return redirect(url_for('.index'))
     # Ahora recibimos CIP en lugar de RUT
     cip = request.form.get('cip') or request.form.get('nombre_paciente')  # Compatibilidad
     consulta_id = request.form.get('consulta_id')
@@ -822,23 +969,72 @@ def iniciar_consulta():
     if consulta_id and session.get('rol') == 'medico':
         conn = get_db_connection()
         conn.execute('''
-            UPDATE consultas SET estado = 'atendiendo', nombre_medico = ? 
+            UPDATE consultas SET estado = 'atendiendo', nombre_medico = ?, 
+                   ultimo_latido = CURRENT_TIMESTAMP,
+                   fecha_atencion = COALESCE(fecha_atencion, CURRENT_TIMESTAMP)
             WHERE id = ?
         ''', (session['nombre'], consulta_id))
         conn.commit()
         conn.close()
     
     # Usar CIP como identificador de sala (Privacy by Design)
-    token = generar_token_jitsi(session['nombre'], cip)
-    return render_template('consulta.html', jitsi_token=token, sala=cip, 
+    token, token_exp = obtener_token_jitsi(session['nombre'], cip)
+    return render_template('consulta.html', jitsi_token=token, jitsi_token_exp=token_exp,
+                           jitsi_token_margen=JITSI_TOKEN_MARGEN, sala=cip, 
                            nombre_usuario=f"Doctor: {session['nombre']}", 
-                           consulta_id=consulta_id, es_medico=True)
+                           consulta_id=consulta_id, es_medico=True,
+                           latido_intervalo=LATIDO_INTERVALO_SEGUNDOS)
+
+@principal.route('/api/latido-consulta/<int:consulta_id>', methods=['POST'])
+def latido_consulta(consulta_id):
+    """El médico en la sala avisa que sigue conectado (ver utils/mantenimiento.py)"""
+    if session.get('rol') != 'medico':
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE consultas SET ultimo_latido = CURRENT_TIMESTAMP 
+        WHERE id = ? AND estado = 'atendiendo' AND nombre_medico = ?
+    ''', (consulta_id, session['nombre']))
+    conn.commit()
+    conn.close()
+    
+    if cursor.rowcount == 0:
+        # Finalizada, reencolada por inactividad o de otro médico
+        return jsonify({'activa': False}), 409
+    return jsonify({'activa': True})
+
+@principal.route('/api/jitsi-token/<cip>')
+def api_jitsi_token(cip):
+    """Renueva el token JWT de la sala sin recargar consulta.html (sesiones largas)"""
+    rol = session.get('rol')
+    if rol not in ['tens', 'medico']:
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    if not validar_cip(cip):
+        return jsonify({'error': 'CIP invalido'}), 400
+    
+    # Solo participantes de una consulta en curso de esa sala
+    campo = 'tens_nombre' if rol == 'tens' else 'nombre_medico'
+    conn = get_db_connection()
+    consulta = conn.execute(f'''
+        SELECT 1 FROM consultas 
+        WHERE cip = ? AND estado IN ('esperando', 'activa', 'atendiendo') AND {campo} = ?
+        LIMIT 1
+    ''', (cip, session['nombre'])).fetchone()
+    conn.close()
+    
+    if not consulta:
+        return jsonify({'error': 'No hay una consulta activa para esta sala'}), 404
+    
+    token, token_exp = obtener_token_jitsi(session['nombre'], cip)
+    return jsonify({'token': token, 'exp': token_exp})
 
 # ==========================================
 # CONTROL DE CONSULTA (MÉDICO CONTROLA)
 # ==========================================
 
-@app.route('/finalizar-consulta', methods=['POST'])
+@principal.route('/finalizar-consulta', methods=['POST'])
 def finalizar_consulta():
     """Solo el médico puede finalizar la consulta y se guarda en historial"""
     
@@ -854,135 +1050,79 @@ def finalizar_consulta():
         return jsonify({'error': 'ID de consulta no proporcionado'}), 400
         
     conn = get_db_connection()
-    
-    # Verificar que la consulta existe y está activa o atendiendo
-    consulta = conn.execute('''
-        SELECT c.*, l.nombre_posta 
-        FROM consultas c 
-        JOIN lugares l ON c.lugar_id = l.id 
-        WHERE c.id = ? AND c.estado IN ('activa', 'atendiendo')
-    ''', (consulta_id,)).fetchone()
-    
-    if not consulta:
+    try:
+        # Archivar y finalizar en una sola transacción (ver utils/consultas.py);
+        # para auto_close sin sesión se usa el médico asignado a la consulta
+        codigo_consulta = archivar_consulta(conn, consulta_id, session.get('nombre'))
+    finally:
         conn.close()
+    
+    if codigo_consulta is None:
         # Si ya está finalizada, retornar éxito silencioso
         return jsonify({'success': True, 'message': 'Consulta ya finalizada'})
     
-    # Usar CIP existente como código de consulta (Privacy by Design)
-    cip = consulta['cip']
-    
-    # Generar código único para el historial (basado en CIP + timestamp)
-    codigo_consulta = f"{cip}-{int(time.time()) % 10000}"
-    
-    # Generar token de seguridad hasheado (SHA256) - sin usar RUT
-    # Para auto_close, usar el nombre del médico de la consulta
-    nombre_medico = session.get('nombre', consulta['nombre_medico'] if consulta['nombre_medico'] else 'Médico')
-    data_to_hash = f"{codigo_consulta}{cip}{nombre_medico}{time.time()}"
-    token_seguridad = hashlib.sha256(data_to_hash.encode()).hexdigest()[:16]
-    
-    # Obtener RUT cifrado desde tabla de mapeo (para trazabilidad)
-    mapeo = conn.execute('''
-        SELECT rut_cifrado, rut_hash FROM mapeo_pacientes WHERE cip = ?
-    ''', (cip,)).fetchone()
-    
-    if mapeo:
-        rut_cifrado = mapeo['rut_cifrado']
-        rut_hash = mapeo['rut_hash']
-    else:
-        # Fallback si no hay mapeo (datos antiguos)
-        rut_cifrado = ''
-        try:
-            rut_hash = consulta['rut_paciente_hash'] if consulta['rut_paciente_hash'] else ''
-        except (KeyError, IndexError):
-            rut_hash = ''
-    
-    # Guardar en historial con datos cifrados (SIN RUT en texto plano)
-    try:
-        conn.execute('''
-            INSERT INTO historial_consultas 
-            (codigo_consulta, token_seguridad, cip, rut_paciente_cifrado, rut_paciente_hash, 
-             nombre_medico, tens_nombre, nombre_posta, fecha_inicio)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (codigo_consulta, token_seguridad, cip, rut_cifrado, rut_hash,
-              nombre_medico, consulta['tens_nombre'], consulta['nombre_posta'], consulta['fecha']))
-    except sqlite3.IntegrityError:
-        # Si el código ya existe, agregar timestamp adicional
-        codigo_consulta = f"{cip}-{int(time.time())}"
-        conn.execute('''
-            INSERT INTO historial_consultas 
-            (codigo_consulta, token_seguridad, cip, rut_paciente_cifrado, rut_paciente_hash,
-             nombre_medico, tens_nombre, nombre_posta, fecha_inicio)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (codigo_consulta, token_seguridad, cip, rut_cifrado, rut_hash,
-              nombre_medico, consulta['tens_nombre'], consulta['nombre_posta'], consulta['fecha']))
-    
-    # Actualizar estado de la consulta
-    conn.execute('UPDATE consultas SET estado = ? WHERE id = ?', ('finalizada', consulta_id))
-    conn.commit()
-    conn.close()
-    
     # Log para depuración
     if es_auto_close:
         print(f"[AUTO-CLOSE] Consulta {consulta_id} finalizada automáticamente (navegación hacia atrás)")
     
     return jsonify({'success': True, 'message': 'Consulta finalizada', 'codigo': codigo_consulta})
 
-@app.route('/verificar-estado-consulta/<int:consulta_id>')
+@principal.route('/verificar-estado-consulta/<int:consulta_id>')
 def verificar_estado_consulta(consulta_id):
     """El TENS verifica si la consulta fue finalizada por el médico"""
     conn = get_db_connection()
-    consulta = conn.execute('SELECT estado FROM consultas WHERE id = ?', (consulta_id,)).fetchone()
+    estado = obtener_estado_consulta(conn, consulta_id)
     conn.close()
     
-    if consulta:
-        return jsonify({'estado': consulta['estado']})
+    if estado:
+        return json_condicional({'estado': estado})
     return jsonify({'error': 'Consulta no encontrada'}), 404
 
-@app.route('/logout')
+@principal.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 # ==========================================
 # RUTAS DE RESPALDOS (Solo Admin)
 # ==========================================
 
-@app.route('/admin/crear-respaldo', methods=['POST'])
+@principal.route('/admin/crear-respaldo', methods=['POST'])
 def admin_crear_respaldo():
     """Crear respaldo manual de la base de datos"""
     if session.get('rol') not in ['admin', 'admin_maestro']:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     nombre = crear_respaldo(manual=True)
     if nombre:
         flash(f'✅ Respaldo creado exitosamente: {nombre}')
     else:
         flash('❌ Error al crear respaldo')
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/descargar-respaldo/<nombre>')
+@principal.route('/admin/descargar-respaldo/<nombre>')
 def admin_descargar_respaldo(nombre):
     """Descargar un archivo de respaldo"""
     if session.get('rol') not in ['admin', 'admin_maestro']:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     # Validar que el nombre sea seguro (solo backup_*.db)
     if not nombre.startswith('backup_') or not nombre.endswith('.db'):
         flash('❌ Archivo no válido')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     backup_path = os.path.join(BACKUP_DIR, nombre)
     if os.path.exists(backup_path):
         return send_file(backup_path, as_attachment=True, download_name=nombre)
     
     flash('❌ Respaldo no encontrado')
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/eliminar-respaldos', methods=['POST'])
+@principal.route('/admin/eliminar-respaldos', methods=['POST'])
 def admin_eliminar_respaldos():
     """Eliminar respaldos seleccionados (requiere verificación de contraseña)"""
     if session.get('rol') not in ['admin', 'admin_maestro']:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     # Verificar contraseña del admin
     password = request.form.get('password_confirmacion')
@@ -994,7 +1134,7 @@ def admin_eliminar_respaldos():
     if not admin or admin['password'] != password:
         conn.close()
         flash('❌ Contraseña incorrecta. No se eliminaron los respaldos.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     # Obtener respaldos seleccionados
     respaldos_seleccionados = request.form.getlist('respaldos_seleccionados')
@@ -1002,7 +1142,7 @@ def admin_eliminar_respaldos():
     if not respaldos_seleccionados:
         conn.close()
         flash('⚠️ No se seleccionaron respaldos para eliminar.')
-        return redirect(url_for('dashboard_admin'))
+        return redirect(url_for('.dashboard_admin'))
     
     eliminados = 0
     errores = 0
@@ -1039,66 +1179,51 @@ def admin_eliminar_respaldos():
     if errores > 0:
         flash(f'⚠️ Hubo {errores} error(es) al eliminar algunos respaldos.')
     
-    return redirect(url_for('dashboard_admin'))
+    return redirect(url_for('.dashboard_admin'))
 
-@app.route('/admin/exportar-historial')
-def admin_exportar_historial():
-    """Exportar historial de consultas a CSV (sin datos sensibles) con filtro por fechas"""
+@principal.route('/api/analitica')
+def api_analitica():
+    """Métricas operacionales (volumen por posta/hora, espera, duración, carga por médico)"""
     rol = session.get('rol')
     if rol not in ['admin', 'admin_maestro']:
-        return redirect(url_for('index'))
+        return jsonify({'error': 'No autorizado'}), 403
     
-    # Obtener filtros de fecha (opcional)
-    fecha_desde = request.args.get('fecha_desde', '')
-    fecha_hasta = request.args.get('fecha_hasta', '')
+    # Rango por defecto: últimos 30 días
+    hoy = datetime.now().date()
+    try:
+        desde = datetime.strptime(request.args.get('desde') or str(hoy - timedelta(days=29)), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args.get('hasta') or str(hoy), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Fechas invalidas, use AAAA-MM-DD'}), 400
     
+    # Solo lectura: los agregados los refresca el hilo de mantenimiento
     conn = get_db_connection()
+    try:
+        resultado = obtener_analitica(conn, str(desde), str(hasta), request.args.get('posta') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
     
-    # Construir query con filtros opcionales
-    query = 'SELECT * FROM historial_consultas WHERE 1=1'
-    params = []
-    
-    if fecha_desde:
-        query += ' AND DATE(fecha_fin) >= ?'
-        params.append(fecha_desde)
-    
-    if fecha_hasta:
-        query += ' AND DATE(fecha_fin) <= ?'
-        params.append(fecha_hasta)
-    
-    query += ' ORDER BY fecha_fin DESC'
-    
-    historial = conn.execute(query, params).fetchall()
-    conn.close()
+    return jsonify(resultado)
+
+@principal.route('/admin/exportar-historial')
+def admin_exportar_historial():
+    """Exportar historial de consultas (sin datos sensibles) con filtro por fechas.
+    Formatos: csv (por defecto) o parquet (ZIP particionado por mes)"""
+    rol = session.get('rol')
+    if rol not in ['admin', 'admin_maestro']:
+        return redirect(url_for('.index'))
     
-    # Crear CSV en memoria
-    output = io.StringIO()
-    writer = csv.writer(output)
+    # Obtener filtros de fecha (opcional)
+    fecha_desde = request.args.get('fecha_desde', '')
+    fecha_hasta = request.args.get('fecha_hasta', '')
+    formato = request.args.get('formato', 'csv')
     
-    # Encabezados (SIN RUT - Privacy by Design)
-    writer.writerow(['Código', 'Token Seguridad', 'CIP (Código Atención)', 'Médico', 'TENS', 'Posta', 'Fecha Inicio', 'Fecha Fin'])
+    if formato == 'parquet' and not parquet_disponible():
+        flash('La exportación Parquet requiere instalar pyarrow (pip install pyarrow)', 'error')
+        return redirect(url_for('.dashboard_admin'))
     
-    # Datos
-    for h in historial:
-        # Manejar CIP que podría no existir en registros antiguos
-        try:
-            cip = h['cip'] if h['cip'] else '(migración)'
-        except (KeyError, IndexError):
-            cip = '(migración)'
-        
-        writer.writerow([
-            h['codigo_consulta'],
-            h['token_seguridad'],
-            cip,  # CIP en lugar de RUT
-            h['nombre_medico'],
-            h['tens_nombre'],
-            h['nombre_posta'],
-            h['fecha_inicio'],
-            h['fecha_fin']
-        ])
-    
-    # Preparar respuesta con nombre descriptivo
-    output.seek(0)
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M')
     
     # Nombre del archivo incluye rango de fechas si se filtró
@@ -1107,6 +1232,29 @@ def admin_exportar_historial():
     else:
         rango = "_completo"
     
+    conn = get_db_connection()
+    try:
+        if formato == 'parquet':
+            cursor = consultar_historial_exportable(conn, fecha_desde, fecha_hasta, orden='ASC')
+            archivo = tempfile.TemporaryFile()
+            escribir_parquet_historial(cursor, archivo)
+            archivo.seek(0)
+            return send_file(
+                archivo,
+                mimetype='application/zip',
+                as_attachment=True,
+                download_name=f'historial_consultas{rango}_{timestamp}_parquet.zip'
+            )
+        
+        # Crear CSV en memoria (SIN RUT - Privacy by Design)
+        output = io.StringIO()
+        escribir_csv_historial(consultar_historial_exportable(conn, fecha_desde, fecha_hasta), output)
+    except ValueError:
+        flash('Fechas inválidas para exportar', 'error')
+        return redirect(url_for('.dashboard_admin'))
+    finally:
+        conn.close()
+    
     return send_file(
         io.BytesIO(output.getvalue().encode('utf-8-sig')),
         mimetype='text/csv',
@@ -1114,6 +1262,50 @@ def admin_exportar_historial():
         download_name=f'historial_consultas{rango}_{timestamp}.csv'
     )
 
+# ==========================================
+# PUNTO DE ENTRADA WSGI
+# ==========================================
+
+def create_app(config=None):
+    """
+    Crea la aplicación e inicializa su base con asegurar_db(): init_db()
+    corre una vez por proceso y base (o antes, en el proceso maestro de
+    gunicorn: gunicorn.conf.py), nunca dentro de un request, de modo que
+    no cuenta en el límite de consultas SQL de la primera ruta.
+
+    Servidores WSGI: gunicorn 'app:create_app()' o waitress (servidor.py).
+    Las tareas en segundo plano no se inician aquí: el lanzador llama a
+    iniciar_tareas_segundo_plano() en cada worker y solo uno las ejecuta.
+
+    Args:
+        config: dict opcional que se aplica sobre app.config. DATABASE
+            permite usar otra base, p. ej. una en memoria por prueba:
+            create_app({'DATABASE': base_en_memoria('prueba_1'), 'TESTING': True})
+            SESIONES_BACKEND elige el almacén de sesiones (utils/sesiones.py).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'clave_por_defecto_solo_desarrollo')
+    app.config['DATABASE'] = DB_PATH
+    app.config.update(config or {})
+
+    # Verificar seguridad en producción
+    if os.environ.get('FLASK_ENV') == 'production' and app.secret_key == 'clave_por_defecto_solo_desarrollo':
+        raise ValueError("ERROR: SECRET_KEY no configurada para produccion.")
+
+    if es_base_en_memoria(app.config['DATABASE']):
+        # La base en memoria existe mientras tenga una conexión abierta
+        app.extensions['telemedicina_db'] = get_db_connection(app.config['DATABASE'])
+    # Antes que las sesiones: open_session() lee la tabla sesiones antes de
+    # cualquier hook before_request
+    asegurar_db(app.config['DATABASE'])
+
+    csrf.init_app(app)
+    configurar_sesiones(app)
+    registrar_metricas(app)
+    app.register_blueprint(principal)
+    return app
+
 if __name__ == '__main__':
-    iniciar_hilo_respaldos()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Servidor de desarrollo; en producción: python servidor.py
+    iniciar_tareas_segundo_plano()
+    create_app().run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,318 @@
+"""
+TELEMEDICINA - Aplicación ASGI
+Uso: uvicorn asgi:app   (o hypercorn asgi:app)
+
+Las APIs de alta frecuencia se atienden en asyncio, sin ocupar un
+hilo por conexión abierta:
+- GET  /api/pacientes-espera
+- GET  /verificar-estado-consulta/<id>
+- POST /finalizar-consulta
+El acceso a SQLite pasa por utils/db_async.py (hilo escritor + pool
+de lectores). Con ?esperar=<segundos> y el ETag anterior en
+If-None-Match, las dos primeras quedan en espera (long-poll) hasta que
+los datos cambien, sin costo de hilo mientras esperan.
+
+La sesión, el CSRF y las respuestas JSON son los de la aplicación Flask
+(create_app), que además atiende todas las demás rutas en un pool de
+ASYNC_HILOS_WSGI hilos. Un solo proceso: las tareas en segundo plano se
+inician al arrancar (lifespan).
+"""
+import asyncio
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from dotenv import load_dotenv
+load_dotenv()  # Antes de importar la aplicación: utils lee su configuración al importarse
+
+from flask import jsonify, request, session
+from flask_wtf.csrf import CSRFError
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie, parse_etags
+
+from app import create_app, csrf
+from utils.consultas import archivar_consulta, obtener_estado_consulta, obtener_pacientes_espera
+from utils.db_async import BaseAsincrona
+from utils.fragmentos import json_condicional
+from utils.metricas import registrar_request
+from utils.procesos import detener_tareas_segundo_plano, iniciar_tareas_segundo_plano
+
+ASYNC_HILOS_WSGI = int(os.environ.get('ASYNC_HILOS_WSGI', 16))
+# Máximo de segundos que un long-poll queda abierto y cada cuánto revisa la base
+ASYNC_ESPERA_MAX = float(os.environ.get('ASYNC_ESPERA_MAX', 25))
+ASYNC_INTERVALO_ESPERA = float(os.environ.get('ASYNC_INTERVALO_ESPERA', 1))
+
+_RUTA_ESTADO = re.compile(r'^/verificar-estado-consulta/(\d+)$')
+
+
+def _environ(scope, cuerpo):
+    """Entorno WSGI equivalente al request ASGI (para Flask y werkzeug)."""
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(cuerpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(cuerpo)),
+    }
+    for nombre, valor in scope['headers']:
+        nombre = nombre.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nombre == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = valor
+        elif nombre != 'CONTENT_LENGTH':
+            clave = f'HTTP_{nombre}'
+            environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+    return environ
+
+
+async def _leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body'):
+            return b''.join(partes)
+
+
+def _encabezados(headers):
+    return [(nombre.lower().encode('latin-1'), valor.encode('latin-1')) for nombre, valor in headers]
+
+
+class AplicacionASGI:
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.db = None
+        # (funcion, args) -> (inicio, tarea): lectura compartida por los long-poll
+        self._lecturas = {}
+        self._hilos_wsgi = ThreadPoolExecutor(ASYNC_HILOS_WSGI, thread_name_prefix='wsgi')
+        self._rutas = {
+            ('GET', '/api/pacientes-espera'): ('asgi.api_pacientes_espera', self._pacientes_espera),
+            ('POST', '/finalizar-consulta'): ('asgi.finalizar_consulta', self._finalizar_consulta),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        environ = _environ(scope, await _leer_cuerpo(receive))
+        ruta = self._rutas.get((scope['method'], scope['path']))
+        argumentos = ()
+        if ruta is None and scope['method'] == 'GET':
+            coincidencia = _RUTA_ESTADO.match(scope['path'])
+            if coincidencia:
+                ruta = ('asgi.verificar_estado_consulta', self._verificar_estado)
+                argumentos = (int(coincidencia.group(1)),)
+        if ruta is None:
+            return await self._wsgi(environ, send)
+
+        if self.db is None:
+            self.db = BaseAsincrona(self.flask.config['DATABASE'])
+        endpoint, manejador = ruta
+        inicio = time.perf_counter()
+        await self._precargar_sesion(environ)
+        respuesta = await manejador(environ, *argumentos)
+        registrar_request(endpoint, scope['method'], respuesta.status_code, time.perf_counter() - inicio)
+        await send({'type': 'http.response.start', 'status': respuesta.status_code,
+                    'headers': _encabezados(respuesta.headers.items())})
+        # get_app_iter omite el cuerpo en 304 y HEAD
+        await send({'type': 'http.response.body', 'body': b''.join(respuesta.get_app_iter(environ))})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                self.db = BaseAsincrona(self.flask.config['DATABASE'])
+                await asyncio.get_running_loop().run_in_executor(None, iniciar_tareas_segundo_plano)
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, detener_tareas_segundo_plano)
+                if self.db is not None:
+                    await loop.run_in_executor(None, self.db.cerrar)
+                self._hilos_wsgi.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _precargar_sesion(self, environ):
+        """
+        Lee la sesión en un hilo lector (utils/sesiones.py): al abrir el
+        contexto de request en el bucle de eventos ya está en la caché local.
+        """
+        interfaz = self.flask.session_interface
+        if not hasattr(interfaz, 'precargar'):
+            return
+        sid = parse_cookie(environ).get(interfaz.get_cookie_name(self.flask))
+        if sid:
+            await self.db.leer(interfaz.precargar, sid)
+
+    def _responder(self, environ, generar):
+        """
+        Ejecuta generar() en el contexto de request de Flask (sesión, CSRF,
+        jsonify) y devuelve su respuesta con los hooks after_request
+        aplicados (p. ej. la cookie de sesión), o None si generar() no
+        respondió nada. Corre en el bucle de eventos: la sesión ya se leyó
+        en _precargar_sesion() y el último acceso lo escribe otro hilo; solo
+        una sesión creada, modificada o cerrada se escribe aquí.
+        """
+        with self.flask.request_context(environ):
+            try:
+                resultado = generar()
+            except CSRFError as e:
+                resultado = self.flask.handle_user_exception(e)
+            if resultado is None:
+                return None
+            return self.flask.process_response(self.flask.make_response(resultado))
+
+    async def _leer(self, leer, cuerpo):
+        """
+        Ejecuta la lectura y arma el cuerpo JSON con su ETag (el mismo que
+        calcula json_condicional), para comparar sin abrir la sesión.
+
+        Returns:
+            tuple: (cuerpo, estado HTTP, etag o None si no es 200)
+        """
+        datos, estado = cuerpo(await self.db.leer(*leer))
+        if estado != 200:
+            return datos, estado, None
+        with self.flask.app_context():
+            respuesta = jsonify(datos)
+            respuesta.add_etag()
+        return datos, estado, respuesta.get_etag()[0]
+
+    async def _leer_compartido(self, leer, cuerpo):
+        """
+        Los clientes que esperan la misma consulta comparten una lectura por
+        ASYNC_INTERVALO_ESPERA: miles de long-poll no multiplican las
+        consultas a la base. Los datos pueden tener hasta un intervalo de
+        antigüedad, como con el sondeo periódico.
+        """
+        ahora = time.monotonic()
+        lectura = self._lecturas.get(leer)
+        if lectura is None or ahora - lectura[0] >= ASYNC_INTERVALO_ESPERA:
+            if len(self._lecturas) > 1000:
+                self._lecturas = {clave: valor for clave, valor in self._lecturas.items()
+                                  if ahora - valor[0] < ASYNC_INTERVALO_ESPERA}
+            lectura = self._lecturas[leer] = (ahora, asyncio.ensure_future(self._leer(leer, cuerpo)))
+        # shield: si este cliente se desconecta, la lectura sigue para los demás
+        return await asyncio.shield(lectura[1])
+
+    async def _esperar_cambios(self, environ, leer, cuerpo):
+        """
+        Responde como json_condicional. Con ?esperar=<segundos>, mientras el
+        ETag coincida con If-None-Match vuelve a leer cada
+        ASYNC_INTERVALO_ESPERA segundos (long-poll) y responde 304 solo al
+        cumplirse el plazo.
+
+        Args:
+            leer: (funcion, *args) para BaseAsincrona.leer
+            cuerpo: función datos -> (dict JSON, estado HTTP)
+        """
+        etags_cliente = parse_etags(environ.get('HTTP_IF_NONE_MATCH'))
+        espera = min(MultiDict(parse_qsl(environ['QUERY_STRING'])).get('esperar', 0, type=float),
+                     ASYNC_ESPERA_MAX)
+        limite = time.monotonic() + espera
+
+        # La primera lectura es propia: refleja las escrituras ya confirmadas
+        datos, estado, etag = await self._leer(leer, cuerpo)
+        while etag and etags_cliente.contains(etag) and time.monotonic() < limite:
+            await asyncio.sleep(ASYNC_INTERVALO_ESPERA)
+            datos, estado, etag = await self._leer_compartido(leer, cuerpo)
+
+        if estado != 200:
+            return self._responder(environ, lambda: (jsonify(datos), estado))
+        return self._responder(environ, lambda: json_condicional(datos))
+
+    async def _pacientes_espera(self, environ):
+        def autorizar():
+            if session.get('rol') != 'medico':
+                return jsonify({'error': 'No autorizado'}), 403
+
+        error = self._responder(environ, autorizar)
+        if error is not None:
+            return error
+        return await self._esperar_cambios(
+            environ, (obtener_pacientes_espera,),
+            lambda pacientes: ({'pacientes': pacientes, 'total': len(pacientes)}, 200))
+
+    async def _verificar_estado(self, environ, consulta_id):
+        def cuerpo(estado):
+            if estado:
+                return {'estado': estado}, 200
+            return {'error': 'Consulta no encontrada'}, 404
+
+        return await self._esperar_cambios(environ, (obtener_estado_consulta, consulta_id), cuerpo)
+
+    async def _finalizar_consulta(self, environ):
+        datos = {}
+
+        def validar():
+            # Mismas reglas que la ruta síncrona de app.py
+            if self.flask.config.get('WTF_CSRF_ENABLED', True):
+                csrf.protect()
+            datos['auto_close'] = request.form.get('auto_close') == 'true'
+            if not datos['auto_close'] and session.get('rol') != 'medico':
+                return jsonify({'error': 'No autorizado'}), 403
+            datos['consulta_id'] = request.form.get('consulta_id')
+            if not datos['consulta_id']:
+                return jsonify({'error': 'ID de consulta no proporcionado'}), 400
+            datos['nombre'] = session.get('nombre')
+
+        error = self._responder(environ, validar)
+        if error is not None:
+            return error
+
+        # La escritura va al hilo escritor: el bucle sigue atendiendo mientras tanto
+        codigo = await self.db.escribir(archivar_consulta, datos['consulta_id'], datos['nombre'])
+        self._lecturas.clear()
+        if codigo is None:
+            return self._responder(environ, lambda: jsonify({'success': True, 'message': 'Consulta ya finalizada'}))
+        if datos['auto_close']:
+            print(f"[AUTO-CLOSE] Consulta {datos['consulta_id']} finalizada automáticamente (navegación hacia atrás)")
+        return self._responder(environ, lambda: jsonify(
+            {'success': True, 'message': 'Consulta finalizada', 'codigo': codigo}))
+
+    async def _wsgi(self, environ, send):
+        """Atiende el request con la aplicación Flask en el pool de hilos."""
+        loop = asyncio.get_running_loop()
+        inicio = {}
+
+        def start_response(estado, headers, exc_info=None):
+            inicio['estado'] = int(estado.split(' ', 1)[0])
+            inicio['headers'] = headers
+
+        resultado = await loop.run_in_executor(self._hilos_wsgi, self.flask, environ, start_response)
+        iterador = iter(resultado)
+        try:
+            # El cuerpo se lee por partes en el pool (send_file lee del disco)
+            parte = await loop.run_in_executor(self._hilos_wsgi, next, iterador, None)
+            await send({'type': 'http.response.start', 'status': inicio['estado'],
+                        'headers': _encabezados(inicio['headers'])})
+            while parte is not None:
+                await send({'type': 'http.response.body', 'body': parte, 'more_body': True})
+                parte = await loop.run_in_executor(self._hilos_wsgi, next, iterador, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(resultado, 'close'):
+                await loop.run_in_executor(self._hilos_wsgi, resultado.close)
+
+
+app = AplicacionASGI(create_app())
@@ -0,0 +1,195 @@
+"""
+TELEMEDICINA - Benchmark de concurrencia: WSGI vs ASGI
+
+Abre N clientes simultáneos (médicos con la sala de espera abierta)
+contra un servidor ya levantado y mide cuántos sostiene sin errores:
+
+- Síncrono (servidor.py / gunicorn): cada cliente consulta
+  /api/pacientes-espera cada --intervalo segundos, como el dashboard
+- Asíncrono (uvicorn asgi:app): cada cliente mantiene un long-poll
+  abierto (?esperar=S + If-None-Match) y lo renueva al responder
+
+Por nivel de concurrencia reporta clientes conectados, respuestas,
+errores (conexión rechazada, timeouts, 5xx) y latencia p50/p95/p99.
+Solo usa la biblioteca estándar. Requiere un usuario médico activo.
+
+Uso:
+    python servidor.py                               # puerto 5000
+    uvicorn asgi:app --port 8000                     # otra terminal
+    python benchmarks/bench_asgi.py --correo medico@demo.cl --password ... \\
+        --url-sincrona http://127.0.0.1:5000 --url-asincrona http://127.0.0.1:8000
+    python benchmarks/bench_asgi.py ... --niveles 500,2000,5000 --duracion 60
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import re
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+RUTA = '/api/pacientes-espera'
+
+
+def iniciar_sesion(url, correo, password):
+    """Login por formulario (con token CSRF); devuelve el encabezado Cookie."""
+    cookies = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+    html = opener.open(url + '/', timeout=10).read().decode('utf-8', 'replace')
+    token = re.search(r'name="csrf_token" value="([^"]+)"', html)
+    if not token:
+        raise RuntimeError(f"{url}: no se encontró csrf_token en la página de login")
+    datos = urllib.parse.urlencode({
+        'csrf_token': token.group(1), 'correo': correo, 'password': password
+    }).encode()
+    opener.open(url + '/login', datos, timeout=10).read()
+    cookie = '; '.join(f"{c.name}={c.value}" for c in cookies)
+    # Con sesión válida /api/pacientes-espera responde JSON y no redirige al login
+    solicitud = urllib.request.Request(url + RUTA, headers={'Cookie': cookie})
+    respuesta = opener.open(solicitud, timeout=10)
+    if 'json' not in respuesta.headers.get('Content-Type', ''):
+        raise RuntimeError(f"{url}: login fallido para {correo} (¿usuario médico activo?)")
+    return cookie
+
+
+async def leer_respuesta(lector):
+    """Lee una respuesta HTTP/1.1 con Content-Length; devuelve (estado, encabezados)."""
+    linea = await lector.readline()
+    if not linea:
+        raise ConnectionError('conexión cerrada por el servidor')
+    estado = int(linea.split()[1])
+    encabezados = {}
+    while True:
+        linea = await lector.readline()
+        if linea in (b'\r\n', b'\n', b''):
+            break
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        encabezados[nombre.strip().lower()] = valor.strip()
+    largo = int(encabezados.get('content-length', 0))
+    if largo:
+        await lector.readexactly(largo)
+    return estado, encabezados
+
+
+async def cliente(host, puerto, cookie, fin, esperar, intervalo, resultados):
+    """Un médico con el dashboard abierto hasta `fin` (reloj monotónico)."""
+    try:
+        lector, escritor = await asyncio.wait_for(asyncio.open_connection(host, puerto), 10)
+    except (OSError, asyncio.TimeoutError) as e:
+        resultados['errores'].append(type(e).__name__)
+        return
+    resultados['conectados'] += 1
+    etag = None
+    try:
+        while time.monotonic() < fin:
+            ruta = f"{RUTA}?esperar={esperar}" if esperar else RUTA
+            solicitud = f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n"
+            if etag:
+                solicitud += f"If-None-Match: {etag}\r\n"
+            inicio = time.perf_counter()
+            escritor.write((solicitud + '\r\n').encode())
+            await escritor.drain()
+            estado, encabezados = await asyncio.wait_for(leer_respuesta(lector), esperar + 30)
+            resultados['latencias'].append(time.perf_counter() - inicio)
+            if estado >= 500 or estado in (401, 403):
+                resultados['errores'].append(f"HTTP {estado}")
+                return
+            etag = encabezados.get('etag', etag)
+            if encabezados.get('connection', '').lower() == 'close':
+                escritor.close()
+                lector, escritor = await asyncio.open_connection(host, puerto)
+            if intervalo:
+                await asyncio.sleep(max(0, min(intervalo, fin - time.monotonic())))
+    except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+        resultados['errores'].append(type(e).__name__)
+    finally:
+        escritor.close()
+
+
+async def nivel(url, cookie, clientes, duracion, esperar, intervalo):
+    partes = urllib.parse.urlsplit(url)
+    resultados = {'conectados': 0, 'latencias': [], 'errores': []}
+    fin = time.monotonic() + duracion
+    inicio = time.perf_counter()
+    await asyncio.gather(*[
+        cliente(partes.hostname, partes.port or 80, cookie, fin, esperar, intervalo, resultados)
+        for _ in range(clientes)
+    ])
+    resultados['duracion'] = time.perf_counter() - inicio
+    return resultados
+
+
+def imprimir(nombre, clientes, r):
+    latencias = sorted(r['latencias'])
+    def percentil(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000 if latencias else 0
+
+    tipos = {}
+    for error in r['errores']:
+        tipos[error] = tipos.get(error, 0) + 1
+    detalle = ', '.join(f"{k}={v}" for k, v in sorted(tipos.items()))
+    print(f"  [{nombre}] {clientes:>6,} clientes: conectados={r['conectados']:,} "
+          f"respuestas={len(latencias):,} ({len(latencias) / r['duracion']:,.0f}/s) "
+          f"errores={len(r['errores']):,}{f' ({detalle})' if detalle else ''}")
+    print(f"  {'':>{len(nombre) + 2}} latencia ms: p50={percentil(0.50):.1f} "
+          f"p95={percentil(0.95):.1f} p99={percentil(0.99):.1f}")
+
+
+def subir_limite_archivos():
+    """Cada cliente es un socket: sube el límite blando de descriptores al máximo."""
+    try:
+        import resource
+    except ImportError:
+        return
+    blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if duro == resource.RLIM_INFINITY or duro > blando:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (duro if duro != resource.RLIM_INFINITY else 65536, duro))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de concurrencia WSGI vs ASGI')
+    parser.add_argument('--url-sincrona', help='p. ej. http://127.0.0.1:5000 (servidor.py)')
+    parser.add_argument('--url-asincrona', help='p. ej. http://127.0.0.1:8000 (uvicorn asgi:app)')
+    parser.add_argument('--correo', required=True, help='usuario con rol medico')
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--niveles', default='100,500,1000,2000',
+                        help='clientes simultáneos por nivel, separados por coma')
+    parser.add_argument('--duracion', type=float, default=30, help='segundos por nivel')
+    parser.add_argument('--intervalo', type=float, default=3,
+                        help='segundos entre consultas del cliente síncrono (como el dashboard)')
+    parser.add_argument('--esperar', type=int, default=25, help='segundos de cada long-poll asíncrono')
+    args = parser.parse_args()
+    if not (args.url_sincrona or args.url_asincrona):
+        parser.error('indique --url-sincrona y/o --url-asincrona')
+
+    subir_limite_archivos()
+    niveles = [int(n) for n in args.niveles.split(',')]
+    objetivos = []
+    if args.url_sincrona:
+        objetivos.append(('SINCRONO', args.url_sincrona.rstrip('/'), 0, args.intervalo))
+    if args.url_asincrona:
+        objetivos.append(('ASINCRONO', args.url_asincrona.rstrip('/'), args.esperar, 0))
+
+    print("=" * 60)
+    print("BENCHMARK CONCURRENCIA WSGI vs ASGI")
+    print("=" * 60)
+
+    sostenidos = {}
+    for nombre, url, esperar, intervalo in objetivos:
+        cookie = iniciar_sesion(url, args.correo, args.password)
+        print(f"\n[{nombre}] {url} ({f'long-poll {esperar} s' if esperar else f'polling cada {intervalo:g} s'})")
+        for clientes in niveles:
+            r = asyncio.run(nivel(url, cookie, clientes, args.duracion, esperar, intervalo))
+            imprimir(nombre, clientes, r)
+            if not r['errores']:
+                sostenidos[nombre] = clientes
+
+    print("\n[RESUMEN] Máximo de clientes simultáneos sin errores")
+    for nombre, _, _, _ in objetivos:
+        print(f"  {nombre}: {sostenidos.get(nombre, 0):,}")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+"""
+TELEMEDICINA - Prueba de carga con tráfico simulado
+
+Inicia sesión con usuarios sintéticos de cada rol (token CSRF leído
+del formulario de login, como un navegador) y repite sus flujos
+habituales contra una instancia local:
+
+- TENS: ingreso del paciente -> espera consultando el estado de la
+  consulta hasta que el médico la finaliza
+- Médico: sala de espera por polling -> toma un paciente -> latidos
+  -> finaliza
+- Admin: dashboard, analítica, exportación del historial y respaldos
+
+Reporta throughput, latencia p50/p95/p99 y errores por ruta, y los
+errores "database is locked". Sin --url levanta una instancia
+temporal (base y respaldos en un directorio temporal) con los
+usuarios ya creados.
+
+Como compuerta de regresión termina con código 1 si hay errores,
+bloqueos de la base, una ruta supera --max-p95-ms o empeora más de
+--tolerancia respecto de una corrida anterior guardada con --json.
+
+Uso:
+    python benchmarks/bench_carga.py
+    python benchmarks/bench_carga.py --tens 8 --medicos 4 --duracion 60 --json carga.json
+    python benchmarks/bench_carga.py --base carga.json --tolerancia 0.5
+    python benchmarks/bench_carga.py --url http://127.0.0.1:5000 \\
+        --usuario tens:tens@demo.cl:clave --usuario medico:medico@demo.cl:clave \\
+        --usuario admin:admin@demo.cl:clave
+"""
+import argparse
+import base64
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+PASSWORD_SINTETICA = 'Carga2026!'
+# /verificar-estado-consulta/15 y /verificar-estado-consulta/16 se agrupan en una ruta
+_ID_EN_RUTA = re.compile(r'/\d+')
+MUESTRAS_MIN_COMPARACION = 20
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    """Cada redirección se mide como respuesta de su propia ruta."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def rut_aleatorio(rng):
+    """RUT chileno con dígito verificador válido."""
+    numero = rng.randint(5_000_000, 25_000_000)
+    suma, factor = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    dv = 11 - suma % 11
+    return f"{numero}-{'0' if dv == 11 else 'K' if dv == 10 else dv}"
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000 if valores else 0
+
+
+class Cliente:
+    """Un usuario sintético con su propia sesión (cookies) y sus mediciones."""
+
+    def __init__(self, base, rol, correo, password, timeout):
+        self.base = base
+        self.rol = rol
+        self.correo = correo
+        self.password = password
+        self.timeout = timeout
+        self.csrf = None
+        self.contadores = {'creadas': 0, 'finalizadas': 0}
+        self.mediciones = {}    # ruta -> {'latencias': [...], 'estados': {codigo: n}, 'errores': n}
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SinRedirecciones
+        )
+
+    def pedir(self, metodo, ruta, datos=None, encabezados=None):
+        """Devuelve (estado, cuerpo); estado 0 si la conexión falló."""
+        etiqueta = f"{metodo} {_ID_EN_RUTA.sub('/<id>', ruta.split('?')[0])}"
+        cuerpo_envio = urllib.parse.urlencode(datos).encode() if datos is not None else None
+        solicitud = urllib.request.Request(self.base + ruta, data=cuerpo_envio, method=metodo,
+                                           headers=encabezados or {})
+        inicio = time.perf_counter()
+        try:
+            with self._opener.open(solicitud, timeout=self.timeout) as respuesta:
+                estado, cuerpo = respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as e:
+            estado, cuerpo = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            estado, cuerpo = 0, b''
+        duracion = time.perf_counter() - inicio
+
+        medicion = self.mediciones.setdefault(etiqueta, {'latencias': [], 'estados': {}, 'errores': 0})
+        medicion['latencias'].append(duracion)
+        medicion['estados'][estado] = medicion['estados'].get(estado, 0) + 1
+        if estado == 0 or estado >= 500:
+            medicion['errores'] += 1
+        return estado, cuerpo
+
+    def formulario(self, ruta, datos):
+        return self.pedir('POST', ruta, dict(datos, csrf_token=self.csrf))
+
+    def iniciar_sesion(self):
+        _, html = self.pedir('GET', '/')
+        token = re.search(rb'name="csrf_token" value="([^"]+)"', html)
+        if not token:
+            raise RuntimeError(f"{self.base}: no se encontró csrf_token en la página de login")
+        self.csrf = token.group(1).decode()
+        estado, _ = self.formulario('/login', {'correo': self.correo, 'password': self.password})
+        if estado != 302:
+            raise RuntimeError(f"Login de {self.correo} respondió {estado}")
+        return self.dashboard()
+
+    def dashboard(self):
+        ruta = '/dashboard_admin' if self.rol in ('admin', 'admin_maestro') else f'/dashboard_{self.rol}'
+        estado, html = self.pedir('GET', ruta)
+        if estado != 200:
+            raise RuntimeError(f"Login de {self.correo} fallido ({ruta} respondió {estado})")
+        token = re.search(rb'name="csrf-token" content="([^"]+)"', html)
+        if token:
+            self.csrf = token.group(1).decode()
+        return html
+
+
+def flujo_tens(cliente, fin, args, rng):
+    html = cliente.iniciar_sesion()
+    lugares = re.findall(rb'<option value="(\d+)"', html) or [b'1']
+    while time.monotonic() < fin:
+        estado, html = cliente.formulario('/tens/crear-consulta', {
+            'consentimiento': 'aceptado',
+            'rut_paciente': rut_aleatorio(rng),
+            'lugar_id': rng.choice(lugares).decode(),
+        })
+        consulta = re.search(rb'const consultaId = "(\d+)"', html)
+        if estado != 200 or not consulta:
+            time.sleep(args.pausa)
+            continue
+        cliente.contadores['creadas'] += 1
+        limite = time.monotonic() + args.espera_max
+        while time.monotonic() < min(fin, limite):
+            time.sleep(args.intervalo)
+            estado, cuerpo = cliente.pedir('GET', f"/verificar-estado-consulta/{consulta.group(1).decode()}")
+            if estado == 200 and json.loads(cuerpo).get('estado') == 'finalizada':
+                break
+        time.sleep(args.pausa)
+        cliente.dashboard()
+
+
+def flujo_medico(cliente, fin, args, rng):
+    cliente.iniciar_sesion()
+    while time.monotonic() < fin:
+        estado, cuerpo = cliente.pedir('GET', '/api/pacientes-espera')
+        pacientes = json.loads(cuerpo).get('pacientes', []) if estado == 200 else []
+        if not pacientes:
+            time.sleep(args.intervalo)
+            continue
+        # Varios médicos compiten por los primeros de la fila, como en la sala real
+        paciente = rng.choice(pacientes[:3])
+        consulta_id = str(paciente['id'])
+        cliente.formulario('/iniciar-consulta', {'consulta_id': consulta_id, 'cip': paciente['cip']})
+        for _ in range(args.latidos):
+            time.sleep(args.intervalo)
+            cliente.pedir('POST', f"/api/latido-consulta/{consulta_id}",
+                          encabezados={'X-CSRFToken': cliente.csrf})
+        estado, cuerpo = cliente.formulario('/finalizar-consulta', {'consulta_id': consulta_id})
+        if estado == 200 and json.loads(cuerpo).get('codigo'):
+            cliente.contadores['finalizadas'] += 1
+        time.sleep(args.pausa)
+        cliente.dashboard()
+
+
+def flujo_admin(cliente, fin, args, rng):
+    cliente.iniciar_sesion()
+    ciclo = 0
+    ultimo_respaldo = time.monotonic()
+    while time.monotonic() < fin:
+        ciclo += 1
+        cliente.dashboard()
+        cliente.pedir('GET', '/api/analitica')
+        if ciclo % args.exportar_cada == 0:
+            cliente.pedir('GET', '/admin/exportar-historial?formato=csv')
+        if args.respaldo_cada and time.monotonic() - ultimo_respaldo >= args.respaldo_cada:
+            cliente.formulario('/admin/crear-respaldo', {})
+            ultimo_respaldo = time.monotonic()
+        time.sleep(args.intervalo * 4)
+
+
+FLUJOS = {'tens': flujo_tens, 'medico': flujo_medico, 'admin': flujo_admin, 'admin_maestro': flujo_admin}
+
+
+def iniciar_instancia_local(args):
+    """
+    Levanta create_app() en un servidor con hilos sobre una base temporal.
+
+    Returns:
+        tuple: (url, usuarios, bloqueos) - bloqueos es una lista que acumula
+        los errores "database is locked" de los requests
+    """
+    tmp = tempfile.mkdtemp(prefix='bench_carga_')
+    # Base temporal: debe configurarse antes de importar app/utils
+    os.environ['DB_PATH'] = os.path.join(tmp, 'carga.db')
+    os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+    os.environ.setdefault('RUT_HASH_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+    os.environ.setdefault('SECRET_KEY', secrets.token_hex(32))
+    os.environ['TAREAS_SEGUNDO_PLANO'] = '0'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import sqlite3
+    from flask import got_request_exception
+    from werkzeug.serving import make_server
+
+    import app as aplicacion
+    from utils import backups_logic
+    from utils.database import get_db_connection, init_db
+    from utils.seguridad import hashear_password
+
+    # Los respaldos de la prueba no se mezclan con los reales
+    backups_logic.BACKUP_DIR = aplicacion.BACKUP_DIR = os.path.join(tmp, 'backups')
+
+    init_db()
+    conn = get_db_connection()
+    conn.executemany("INSERT INTO lugares (nombre_posta, direccion) VALUES (?, 'Maule')",
+                     [(f"Posta Carga {i}",) for i in range(1, 6)])
+    password_hash = hashear_password(PASSWORD_SINTETICA)
+    usuarios = []
+    for rol, cantidad in (('tens', args.tens), ('medico', args.medicos), ('admin', args.admins)):
+        for i in range(1, cantidad + 1):
+            correo = f"{rol}{i}@carga.cl"
+            conn.execute(
+                "INSERT INTO usuarios (nombre, rut, correo, rol, password, password_hash, activo) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1)",
+                (f"{rol.capitalize()} Carga {i}", f"{rol}-{i}", correo, rol, PASSWORD_SINTETICA, password_hash)
+            )
+            usuarios.append((rol, correo, PASSWORD_SINTETICA))
+    conn.commit()
+    conn.close()
+
+    flask_app = aplicacion.create_app()
+    bloqueos = []
+
+    def _registrar_bloqueo(sender, exception, **extra):
+        if isinstance(exception, sqlite3.OperationalError) and 'locked' in str(exception):
+            bloqueos.append(str(exception))
+
+    got_request_exception.connect(_registrar_bloqueo, flask_app, weak=False)
+    # Sin una línea de log por request: el reporte queda legible
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    servidor = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    print(f"[INSTANCIA] http://127.0.0.1:{servidor.server_port} (base {os.environ['DB_PATH']})")
+    return f"http://127.0.0.1:{servidor.server_port}", usuarios, bloqueos
+
+
+def ejecutar(url, usuarios, args):
+    fin = time.monotonic() + args.duracion
+    clientes, fallos = [], []
+
+    def correr(cliente, semilla):
+        try:
+            FLUJOS[cliente.rol](cliente, fin, args, random.Random(semilla))
+        except Exception as e:
+            fallos.append(f"{cliente.correo}: {e}")
+
+    hilos = []
+    for i, (rol, correo, password) in enumerate(usuarios):
+        cliente = Cliente(url, rol, correo, password, args.timeout)
+        clientes.append(cliente)
+        hilos.append(threading.Thread(target=correr, args=(cliente, args.semilla + i)))
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    rutas = {}
+    for cliente in clientes:
+        for etiqueta, medicion in cliente.mediciones.items():
+            total = rutas.setdefault(etiqueta, {'latencias': [], 'estados': {}, 'errores': 0})
+            total['latencias'].extend(medicion['latencias'])
+            total['errores'] += medicion['errores']
+            for estado, n in medicion['estados'].items():
+                total['estados'][estado] = total['estados'].get(estado, 0) + n
+
+    resultado = {
+        'duracion': duracion, 'rutas': {}, 'fallos': fallos,
+        'creadas': sum(c.contadores['creadas'] for c in clientes),
+        'finalizadas': sum(c.contadores['finalizadas'] for c in clientes),
+    }
+    for etiqueta, total in sorted(rutas.items()):
+        latencias = sorted(total['latencias'])
+        resultado['rutas'][etiqueta] = {
+            'requests': len(latencias),
+            'rps': len(latencias) / duracion,
+            'p50': percentil(latencias, 0.50),
+            'p95': percentil(latencias, 0.95),
+            'p99': percentil(latencias, 0.99),
+            'errores': total['errores'],
+            'estados': {str(k): v for k, v in sorted(total['estados'].items())},
+        }
+    resultado['requests'] = sum(r['requests'] for r in resultado['rutas'].values())
+    resultado['rps'] = resultado['requests'] / duracion
+    resultado['errores'] = sum(r['errores'] for r in resultado['rutas'].values())
+    return resultado
+
+
+def imprimir(r):
+    print(f"\n{'RUTA':<38} {'REQ':>7} {'REQ/S':>7} {'P50':>8} {'P95':>8} {'P99':>8} {'ERR':>5}")
+    for etiqueta, ruta in r['rutas'].items():
+        print(f"{etiqueta:<38} {ruta['requests']:>7,} {ruta['rps']:>7.1f} {ruta['p50']:>8.1f} "
+              f"{ruta['p95']:>8.1f} {ruta['p99']:>8.1f} {ruta['errores']:>5}")
+    print(f"\n[TOTAL] {r['requests']:,} requests en {r['duracion']:.1f} s -> {r['rps']:,.1f} req/s "
+          f"(latencias en ms)")
+    print(f"  consultas creadas={r['creadas']:,} finalizadas={r['finalizadas']:,} "
+          f"errores={r['errores']:,} bloqueos_db={r['bloqueos_db']}")
+    for fallo in r['fallos']:
+        print(f"  ! flujo interrumpido: {fallo}")
+
+
+def verificar(r, args):
+    """Compuerta de regresión: lista de motivos de fallo (vacía si pasa)."""
+    motivos = []
+    if r['errores'] > args.max_errores:
+        motivos.append(f"{r['errores']} errores (máximo {args.max_errores})")
+    if r['bloqueos_db']:
+        motivos.append(f"{r['bloqueos_db']} errores 'database is locked'")
+    if r['fallos']:
+        motivos.append(f"{len(r['fallos'])} flujos interrumpidos")
+    if args.max_p95_ms:
+        for etiqueta, ruta in r['rutas'].items():
+            if ruta['p95'] > args.max_p95_ms:
+                motivos.append(f"{etiqueta}: p95 {ruta['p95']:.1f} ms > {args.max_p95_ms:.0f} ms")
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        for etiqueta, ruta in r['rutas'].items():
+            anterior = base.get('rutas', {}).get(etiqueta)
+            # Con pocas muestras el p95 es ruido; margen de 2 ms para rutas muy rápidas
+            if not anterior or min(ruta['requests'], anterior['requests']) < MUESTRAS_MIN_COMPARACION:
+                continue
+            if ruta['p95'] > anterior['p95'] * (1 + args.tolerancia) + 2:
+                motivos.append(f"{etiqueta}: p95 {ruta['p95']:.1f} ms vs {anterior['p95']:.1f} ms en la base")
+    return motivos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga con TENS, medicos y admin sinteticos')
+    parser.add_argument('--url', help='instancia ya levantada (por defecto: instancia local temporal)')
+    parser.add_argument('--usuario', action='append', default=[], metavar='ROL:CORREO:PASSWORD',
+                        help='credenciales para --url; se repite una vez por usuario sintético')
+    parser.add_argument('--tens', type=int, default=6)
+    parser.add_argument('--medicos', type=int, default=3)
+    parser.add_argument('--admins', type=int, default=1)
+    parser.add_argument('--duracion', type=float, default=30, help='segundos de carga')
+    parser.add_argument('--intervalo', type=float, default=0.5, help='segundos entre consultas de polling')
+    parser.add_argument('--pausa', type=float, default=0.2, help='segundos entre un flujo y el siguiente')
+    parser.add_argument('--latidos', type=int, default=2, help='latidos del médico por consulta')
+    parser.add_argument('--espera-max', type=float, default=20,
+                        help='segundos que el TENS espera el cierre antes de ingresar otro paciente')
+    parser.add_argument('--exportar-cada', type=int, default=5, help='ciclos del admin entre exportaciones')
+    parser.add_argument('--respaldo-cada', type=float, default=10, help='segundos entre respaldos (0 = nunca)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--semilla', type=int, default=2026)
+    parser.add_argument('--json', help='guardar el resultado (sirve como --base de otra corrida)')
+    parser.add_argument('--base', help='resultado anterior (--json) contra el cual comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.5, help='aumento máximo de p95 vs --base')
+    parser.add_argument('--max-p95-ms', type=float, help='p95 máximo por ruta')
+    parser.add_argument('--max-errores', type=int, default=0)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("PRUEBA DE CARGA TELEMEDICINA")
+    print("=" * 60)
+
+    bloqueos = []
+    if args.url:
+        if not args.usuario:
+            parser.error('--url requiere al menos un --usuario ROL:CORREO:PASSWORD')
+        usuarios = []
+        for valor in args.usuario:
+            rol, _, resto = valor.partition(':')
+            correo, _, password = resto.partition(':')
+            if rol not in FLUJOS or not password:
+                parser.error(f"--usuario invalido: {valor}")
+            usuarios.append((rol, correo, password))
+        url = args.url.rstrip('/')
+    else:
+        url, usuarios, bloqueos = iniciar_instancia_local(args)
+
+    roles = {}
+    for rol, _, _ in usuarios:
+        roles[rol] = roles.get(rol, 0) + 1
+    print(f"[CARGA] {', '.join(f'{n} {rol}' for rol, n in roles.items())} durante {args.duracion:g} s")
+
+    resultado = ejecutar(url, usuarios, args)
+    # Solo detectables en la instancia local; contra --url aparecen como errores 500
+    resultado['bloqueos_db'] = len(bloqueos)
+    imprimir(resultado)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({k: v for k, v in resultado.items() if k != 'fallos'}, f, indent=2, ensure_ascii=False)
+        print(f"\n[JSON] Resultado guardado en {args.json}")
+
+    motivos = verificar(resultado, args)
+    print(f"\n[VERIFICACION] {'FALLO' if motivos else 'OK'}")
+    for motivo in motivos:
+        print(f"  X {motivo}")
+    sys.exit(1 if motivos else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+TELEMEDICINA - Benchmark de exportación del historial
+
+Compara la exportación CSV de /admin/exportar-historial con la
+exportación Parquet particionada por mes (utils/exportacion.py) sobre
+un historial sintético: tamaño del archivo, tiempo de escritura y
+tiempo de lectura (csv.reader vs pyarrow).
+
+Requiere pyarrow.
+
+Uso:
+    python benchmarks/bench_exportacion.py                 # 300.000 filas
+    python benchmarks/bench_exportacion.py --filas 50000
+"""
+import argparse
+import base64
+import csv
+import io
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+import zipfile
+
+# Base de datos temporal: debe configurarse antes de importar utils
+_TMP = tempfile.mkdtemp(prefix='bench_exportacion_')
+os.environ['DB_PATH'] = os.path.join(_TMP, 'bench.db')
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+os.environ.setdefault('RUT_HASH_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import get_db_connection, init_db
+from utils.exportacion import (
+    consultar_historial_exportable, escribir_csv_historial,
+    escribir_parquet_historial, parquet_disponible
+)
+
+POSTAS = ['Curepto', 'Pencahue', 'Empedrado', 'Vichuquen']
+
+
+def poblar_historial(filas, semilla=2026):
+    init_db()
+    conn = get_db_connection()
+    rnd = random.Random(semilla)
+    lote = []
+    for i in range(filas):
+        posta = rnd.choice(POSTAS)
+        cip = f"{posta[:3].upper()}-{rnd.randrange(100000):05d}"
+        lote.append((
+            f"{cip}-{i + 1:06d}", secrets.token_hex(8), cip,
+            f"Dr. Medico {rnd.randrange(40)}", f"TENS {rnd.randrange(80)}", posta,
+            rnd.randrange(730), rnd.randrange(86400), rnd.randrange(60, 3600),
+        ))
+        if len(lote) == 10000 or i == filas - 1:
+            conn.executemany('''
+                INSERT INTO historial_consultas
+                (codigo_consulta, token_seguridad, cip, rut_paciente_cifrado, rut_paciente_hash,
+                 nombre_medico, tens_nombre, nombre_posta, fecha_inicio, fecha_fin)
+                SELECT ?, ?, ?, '', '', ?, ?, ?, inicio, datetime(inicio, '+' || ? || ' seconds')
+                FROM (SELECT datetime('2024-11-01', '+' || ? || ' days', '+' || ? || ' seconds') AS inicio)
+            ''', [(a, b, c, d, e, f, dur, dia, seg) for a, b, c, d, e, f, dia, seg, dur in lote])
+            lote = []
+    conn.commit()
+    return conn
+
+
+def bench_csv(conn):
+    inicio = time.perf_counter()
+    salida = io.StringIO()
+    escribir_csv_historial(consultar_historial_exportable(conn), salida)
+    datos = salida.getvalue().encode('utf-8-sig')
+    escritura = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    filas = sum(1 for _ in csv.reader(io.StringIO(datos.decode('utf-8-sig')))) - 1
+    lectura = time.perf_counter() - inicio
+    return len(datos), escritura, lectura, filas
+
+
+def bench_parquet(conn):
+    import pyarrow.parquet as pq
+
+    inicio = time.perf_counter()
+    archivo = io.BytesIO()
+    particiones = escribir_parquet_historial(consultar_historial_exportable(conn, orden='ASC'), archivo)
+    escritura = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    filas = 0
+    with zipfile.ZipFile(archivo) as zf:
+        for nombre in zf.namelist():
+            filas += pq.read_table(io.BytesIO(zf.read(nombre))).num_rows
+    lectura = time.perf_counter() - inicio
+    return archivo.getbuffer().nbytes, escritura, lectura, filas, len(particiones)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de exportacion del historial')
+    parser.add_argument('--filas', type=int, default=300_000)
+    args = parser.parse_args()
+
+    if not parquet_disponible():
+        print("[ERROR] Instale pyarrow para ejecutar este benchmark")
+        sys.exit(1)
+
+    print("=" * 60)
+    print("BENCHMARK EXPORTACION DEL HISTORIAL")
+    print("=" * 60)
+
+    conn = poblar_historial(args.filas)
+
+    tam_csv, esc_csv, lec_csv, filas_csv = bench_csv(conn)
+    print(f"\n[CSV]     {tam_csv / 1e6:8.1f} MB  escritura {esc_csv:6.2f} s  "
+          f"lectura {lec_csv:6.2f} s  ({filas_csv:,} filas)")
+
+    tam_pq, esc_pq, lec_pq, filas_pq, meses = bench_parquet(conn)
+    print(f"[PARQUET] {tam_pq / 1e6:8.1f} MB  escritura {esc_pq:6.2f} s  "
+          f"lectura {lec_pq:6.2f} s  ({filas_pq:,} filas, {meses} particiones)")
+
+    print(f"\n[RESULTADO] tamano x{tam_csv / tam_pq:.1f} menor, escritura x{esc_csv / esc_pq:.1f}, "
+          f"lectura x{lec_csv / lec_pq:.1f}")
+    conn.close()
+
+    if filas_csv != filas_pq:
+        print("[ERROR] Las exportaciones no tienen la misma cantidad de filas")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
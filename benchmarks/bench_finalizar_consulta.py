@@ -0,0 +1,200 @@
+"""
+TELEMEDICINA - Benchmark de finalización de consultas
+
+Finaliza consultas en 'atendiendo' desde varios hilos a la vez, cada una
+dos veces (botón del médico + sendBeacon al salir), y compara el camino
+anterior de /finalizar-consulta (SELECT, INSERT y UPDATE por separado)
+con archivar_consulta (utils/consultas.py).
+
+Reporta latencia por cierre y verifica que cada consulta finalizada
+tenga exactamente una fila en historial_consultas.
+
+Uso:
+    python benchmarks/bench_finalizar_consulta.py
+    python benchmarks/bench_finalizar_consulta.py --consultas 5000 --hilos 16
+"""
+import argparse
+import base64
+import os
+import queue
+import random
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Base de datos temporal: debe configurarse antes de importar utils
+_TMP = tempfile.mkdtemp(prefix='bench_finalizar_')
+os.environ['DB_PATH'] = os.path.join(_TMP, 'bench.db')
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+os.environ.setdefault('RUT_HASH_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.consultas import archivar_consulta
+from utils.database import get_db_connection, init_db
+
+
+def finalizar_legado(conn, consulta_id, nombre_medico):
+    """Camino anterior de /finalizar-consulta, sin transacción explícita."""
+    consulta = conn.execute('''
+        SELECT c.*, l.nombre_posta FROM consultas c
+        JOIN lugares l ON c.lugar_id = l.id
+        WHERE c.id = ? AND c.estado IN ('activa', 'atendiendo')
+    ''', (consulta_id,)).fetchone()
+    if not consulta:
+        return None
+
+    cip = consulta['cip']
+    codigo = f"{cip}-{int(time.time()) % 10000}"
+    mapeo = conn.execute(
+        'SELECT rut_cifrado, rut_hash FROM mapeo_pacientes WHERE cip = ?', (cip,)
+    ).fetchone()
+    valores = [cip, mapeo['rut_cifrado'], mapeo['rut_hash'], nombre_medico,
+               consulta['tens_nombre'], consulta['nombre_posta'], consulta['fecha']]
+    insertar = '''
+        INSERT INTO historial_consultas
+        (codigo_consulta, token_seguridad, cip, rut_paciente_cifrado, rut_paciente_hash,
+         nombre_medico, tens_nombre, nombre_posta, fecha_inicio)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    try:
+        conn.execute(insertar, [codigo, secrets.token_hex(8)] + valores)
+    except sqlite3.IntegrityError:
+        codigo = f"{cip}-{int(time.time())}"
+        conn.execute(insertar, [codigo, secrets.token_hex(8)] + valores)
+    conn.execute("UPDATE consultas SET estado = 'finalizada' WHERE id = ?", (consulta_id,))
+    conn.commit()
+    return codigo
+
+
+def preparar_bd(cantidad):
+    if os.path.exists(os.environ['DB_PATH']):
+        os.remove(os.environ['DB_PATH'])
+    init_db()
+    conn = get_db_connection()
+    conn.execute("INSERT INTO lugares (id, nombre_posta, direccion) VALUES (1, 'Curepto', 'Maule')")
+    conn.executemany(
+        "INSERT INTO mapeo_pacientes (cip, rut_cifrado, rut_hash, rut_enmascarado) "
+        "VALUES (?, 'cifrado', ?, '12.***.***-K')",
+        [(f"CUR-{i:05d}", f"hash{i}") for i in range(cantidad)]
+    )
+    conn.executemany(
+        "INSERT INTO consultas (cip, rut_paciente_hash, nombre_medico, lugar_id, tens_nombre, estado) "
+        "VALUES (?, ?, 'Dr. Bench', 1, 'TENS Bench', 'atendiendo')",
+        [(f"CUR-{i:05d}", f"hash{i}") for i in range(cantidad)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def ejecutar(funcion, cantidad, hilos, semilla=2026):
+    """Cada consulta se finaliza dos veces, en orden aleatorio, desde `hilos` hilos."""
+    preparar_bd(cantidad)
+    ids = list(range(1, cantidad + 1)) * 2
+    random.Random(semilla).shuffle(ids)
+    trabajos = queue.Queue()
+    for consulta_id in ids:
+        trabajos.put(consulta_id)
+
+    latencias, errores = [], []
+    lock = threading.Lock()
+
+    def trabajador():
+        conn = get_db_connection()
+        propias = []
+        while True:
+            try:
+                consulta_id = trabajos.get_nowait()
+            except queue.Empty:
+                break
+            inicio = time.perf_counter()
+            try:
+                funcion(conn, consulta_id, 'Dr. Bench')
+            except sqlite3.Error as e:
+                conn.rollback()
+                with lock:
+                    errores.append(str(e))
+            propias.append(time.perf_counter() - inicio)
+        conn.close()
+        with lock:
+            latencias.extend(propias)
+
+    inicio = time.perf_counter()
+    hilos_activos = [threading.Thread(target=trabajador) for _ in range(hilos)]
+    for hilo in hilos_activos:
+        hilo.start()
+    for hilo in hilos_activos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    conn = get_db_connection()
+    finalizadas = conn.execute(
+        "SELECT COUNT(*) FROM consultas WHERE estado = 'finalizada'"
+    ).fetchone()[0]
+    filas_historial = conn.execute("SELECT COUNT(*) FROM historial_consultas").fetchone()[0]
+    # Sin consulta_id en el camino legado: se agrupa por CIP (uno por consulta aquí)
+    duplicadas = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT cip FROM historial_consultas GROUP BY cip HAVING COUNT(*) > 1
+        )
+    ''').fetchone()[0]
+    perdidas = conn.execute('''
+        SELECT COUNT(*) FROM consultas c
+        WHERE c.estado = 'finalizada'
+          AND NOT EXISTS (SELECT 1 FROM historial_consultas h WHERE h.cip = c.cip)
+    ''').fetchone()[0]
+    conn.close()
+
+    latencias.sort()
+    def percentil(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000
+
+    return {
+        'duracion': duracion,
+        'cierres_s': len(ids) / duracion,
+        'p50': percentil(0.50),
+        'p95': percentil(0.95),
+        'p99': percentil(0.99),
+        'finalizadas': finalizadas,
+        'historial': filas_historial,
+        'duplicadas': duplicadas,
+        'perdidas': perdidas,
+        'errores': len(errores),
+    }
+
+
+def imprimir(nombre, r, cantidad):
+    print(f"\n[{nombre}] {cantidad * 2:,} cierres en {r['duracion']:.2f} s -> {r['cierres_s']:,.0f} cierres/s")
+    print(f"  latencia ms: p50={r['p50']:.2f} p95={r['p95']:.2f} p99={r['p99']:.2f}")
+    print(f"  finalizadas={r['finalizadas']:,} historial={r['historial']:,} "
+          f"duplicadas={r['duplicadas']:,} perdidas={r['perdidas']:,} errores={r['errores']:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de finalizacion de consultas')
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--hilos', type=int, default=8)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("BENCHMARK FINALIZACION DE CONSULTAS")
+    print("=" * 60)
+
+    legado = ejecutar(finalizar_legado, args.consultas, args.hilos)
+    imprimir('LEGADO', legado, args.consultas)
+
+    nuevo = ejecutar(archivar_consulta, args.consultas, args.hilos)
+    imprimir('ARCHIVAR_CONSULTA', nuevo, args.consultas)
+
+    correcto = (nuevo['finalizadas'] == nuevo['historial'] == args.consultas
+                and nuevo['duplicadas'] == 0 and nuevo['perdidas'] == 0 and nuevo['errores'] == 0)
+    print(f"\n[VERIFICACION] {'OK' if correcto else 'FALLO'}: "
+          f"una fila de historial por consulta, sin perdidas ni duplicados")
+    sys.exit(0 if correcto else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+TELEMEDICINA - Benchmark de importación masiva de pacientes
+
+Compara el pre-registro masivo (utils/importacion.py) contra el camino
+fila a fila de /tens/crear-consulta (validar, asignar CIP, cifrar,
+insertar y commit por paciente) sobre una base de datos temporal.
+
+Uso:
+    python benchmarks/bench_importacion.py              # 100.000 filas
+    python benchmarks/bench_importacion.py --filas 20000
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+
+# Base de datos temporal: debe configurarse antes de importar utils
+_TMP = tempfile.mkdtemp(prefix='bench_importacion_')
+os.environ['DB_PATH'] = os.path.join(_TMP, 'bench.db')
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+os.environ.setdefault('RUT_HASH_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import get_db_connection, init_db
+from utils.importacion import leer_csv_pacientes, importar_pacientes
+from utils.pacientes import obtener_o_registrar_paciente
+from utils.seguridad import parsear_rut
+
+# Prefijos de CIP distintos: cada prefijo admite 100.000 pacientes
+POSTAS = ['Curepto', 'Pencahue', 'Empedrado', 'Vichuquen']
+
+
+def _dv(numero):
+    suma, multiplicador = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * multiplicador
+        multiplicador = multiplicador + 1 if multiplicador < 7 else 2
+    return '0K987654321'[suma % 11]
+
+
+def generar_csv(filas, semilla=2026, pct_invalidos=1, pct_repetidos=2):
+    """CSV en memoria con RUTs válidos, algunos inválidos y algunos repetidos."""
+    rnd = random.Random(semilla)
+    salida = io.StringIO()
+    salida.write('rut,lugar_id\n')
+    emitidos = []
+    for i in range(filas):
+        lugar_id = (i % len(POSTAS)) + 1
+        if emitidos and rnd.randrange(100) < pct_repetidos:
+            rut = rnd.choice(emitidos)
+        else:
+            numero = rnd.randint(1_000_000, 25_000_000)
+            dv = _dv(numero)
+            if rnd.randrange(100) < pct_invalidos:
+                dv = '0' if dv != '0' else '1'
+            rut = f"{numero:,}".replace(',', '.') + f"-{dv}"
+            emitidos.append(rut)
+        salida.write(f"{rut},{lugar_id}\n")
+    salida.seek(0)
+    return salida
+
+
+def preparar_bd():
+    init_db()
+    conn = get_db_connection()
+    conn.execute('DELETE FROM mapeo_pacientes')
+    conn.execute('DELETE FROM lugares')
+    conn.executemany(
+        "INSERT INTO lugares (id, nombre_posta, direccion) VALUES (?, ?, 'Maule')",
+        list(enumerate(POSTAS, start=1))
+    )
+    conn.commit()
+    return conn
+
+
+def bench_masivo(filas, lote, trabajadores):
+    conn = preparar_bd()
+    csv_texto = generar_csv(filas)
+    inicio = time.perf_counter()
+    resumen = importar_pacientes(conn, leer_csv_pacientes(csv_texto),
+                                 tamano_lote=lote, trabajadores=trabajadores)
+    duracion = time.perf_counter() - inicio
+    conn.close()
+    return duracion, resumen
+
+
+def bench_fila_a_fila(filas):
+    conn = preparar_bd()
+    csv_texto = generar_csv(filas)
+    registradas = 0
+    inicio = time.perf_counter()
+    for _, rut, lugar_id in leer_csv_pacientes(csv_texto):
+        rut_parseado = parsear_rut(rut)
+        if not rut_parseado:
+            continue
+        nombre_posta = conn.execute(
+            'SELECT nombre_posta FROM lugares WHERE id = ?', (lugar_id,)
+        ).fetchone()['nombre_posta']
+        cip, _, es_nuevo = obtener_o_registrar_paciente(conn, rut_parseado, nombre_posta)
+        conn.commit()
+        registradas += 1 if es_nuevo else 0
+    duracion = time.perf_counter() - inicio
+    conn.close()
+    return duracion, registradas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de importacion masiva')
+    parser.add_argument('--filas', type=int, default=100_000)
+    parser.add_argument('--muestra-fila-a-fila', type=int, default=5_000,
+                        help='Filas para medir el camino fila a fila (se extrapola)')
+    parser.add_argument('--lote', type=int, default=2000)
+    parser.add_argument('--trabajadores', type=int, default=4)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("BENCHMARK IMPORTACION DE PACIENTES")
+    print("=" * 60)
+
+    duracion, resumen = bench_masivo(args.filas, args.lote, args.trabajadores)
+    tasa_masiva = resumen['procesadas'] / duracion
+    print(f"\n[MASIVO] {resumen['procesadas']:,} filas en {duracion:.2f} s -> {tasa_masiva:,.0f} filas/s")
+    print(f"  registradas={resumen['registradas']:,} existentes={resumen['existentes']:,} "
+          f"duplicadas={resumen['duplicadas']:,} errores={len(resumen['errores']):,}")
+
+    duracion_fila, registradas = bench_fila_a_fila(args.muestra_fila_a_fila)
+    tasa_fila = args.muestra_fila_a_fila / duracion_fila
+    print(f"\n[FILA A FILA] {args.muestra_fila_a_fila:,} filas en {duracion_fila:.2f} s "
+          f"-> {tasa_fila:,.0f} filas/s (registradas={registradas:,})")
+    print(f"  Estimado para {args.filas:,} filas: {args.filas / tasa_fila:.1f} s")
+
+    print(f"\n[ACELERACION] x{tasa_masiva / tasa_fila:.1f}")
+
+
+if __name__ == '__main__':
+    main()
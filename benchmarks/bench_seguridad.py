@@ -0,0 +1,238 @@
+"""
+TELEMEDICINA - Micro-benchmarks de utils/seguridad.py
+
+Mide las primitivas que se ejecutan en cada request (validación y
+hash de RUT, cifrado AES-256-GCM, CIP, checksum de auditoría y
+contraseñas) y compara contra la base guardada en el repositorio
+(benchmarks/base_seguridad.json) o contra otra corrida.
+
+- Cada caso se repite hasta durar ~0,2 s y se toma el mínimo de
+  --repeticiones (el menos afectado por ruido del sistema); la base
+  del repo es el mínimo de varias corridas (--corridas)
+- Cada corrida mide también una carga de referencia en Python puro;
+  las comparaciones usan tiempo / referencia, de modo que la base
+  sirve en otra máquina (--absoluto compara nanosegundos)
+- Termina con código 1 si algún caso empeora más de --umbral %
+
+Uso:
+    python benchmarks/bench_seguridad.py                        # compara con la base del repo
+    python benchmarks/bench_seguridad.py --guardar-base --corridas 3   # actualiza la base (commitear)
+    python benchmarks/bench_seguridad.py --json $(git rev-parse --short HEAD).json
+    python benchmarks/bench_seguridad.py --comparar a1b2c3d.json e4f5a6b.json   # sin medir
+    python benchmarks/bench_seguridad.py --solo rut --umbral 10
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import platform
+import random
+import secrets
+import subprocess
+import sys
+import timeit
+from datetime import datetime
+
+# Claves temporales: deben configurarse antes de importar utils
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+os.environ.setdefault('RUT_HASH_KEY', base64.b64encode(secrets.token_bytes(32)).decode())
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from utils.seguridad import (
+    RUT_CACHE_SIZE, cifrar_rut, cifrar_ruts_lote, descifrar_rut, generar_checksum_registro,
+    generar_cip, hashear_password, hashear_rut, parsear_rut, validar_rut_chileno,
+    verificar_password
+)
+
+BASE_REPO = os.path.join(RAIZ, 'benchmarks', 'base_seguridad.json')
+DURACION_MINIMA = 0.2
+
+
+def ruts_validos(cantidad, semilla=2026):
+    """RUT distintos con dígito verificador correcto, con puntos y guión (como los digita el TENS)."""
+    rng = random.Random(semilla)
+    ruts = []
+    for numero in rng.sample(range(5_000_000, 26_000_000), cantidad):
+        suma, factor = 0, 2
+        for digito in reversed(str(numero)):
+            suma += int(digito) * factor
+            factor = 2 if factor == 7 else factor + 1
+        dv = 11 - suma % 11
+        ruts.append(f"{numero:,}".replace(',', '.') + f"-{'0' if dv == 11 else 'K' if dv == 10 else dv}")
+    return ruts
+
+
+def referencia():
+    """Carga fija en Python puro: normaliza entre máquinas e intérpretes."""
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+def casos():
+    """
+    Returns:
+        dict: nombre -> (función sin argumentos que ejecuta una operación, descripción)
+    """
+    # Más RUT distintos que RUT_CACHE_SIZE: cada llamada es un fallo de caché
+    distintos = ruts_validos(RUT_CACHE_SIZE * 4)
+    siguiente_rut = itertools.cycle(distintos).__next__
+    frecuente = distintos[0]
+    validar_rut_chileno(frecuente)
+    parseados = itertools.cycle([parsear_rut(r) for r in distintos[:1000]]).__next__
+    cifrados = itertools.cycle([cifrar_rut(r) for r in distintos[:1000]]).__next__
+    lote = [parsear_rut(r) for r in distintos[:100]]
+    registro = {
+        'usuario_id': 12, 'usuario_nombre': 'TENS Curepto', 'usuario_rol': 'tens',
+        'accion': 'login_exitoso', 'categoria': 'autenticacion', 'resultado': 'exito',
+        'fecha': '2026-01-27 11:15:30', 'mensaje': 'Inicio de sesión desde 10.0.0.1',
+        'entidad_tipo': None, 'entidad_id': None,
+    }
+    password_hash = hashear_password('Clave.Segura2026')
+
+    return {
+        'referencia': (referencia, 'carga de referencia (Python puro)'),
+        'rut_validar_cache': (lambda: validar_rut_chileno(frecuente), 'validar_rut_chileno, RUT repetido'),
+        'rut_validar': (lambda: validar_rut_chileno(siguiente_rut()), 'validar_rut_chileno, RUT distinto'),
+        'rut_hash': (lambda: hashear_rut(siguiente_rut()), 'hashear_rut (parseo + HMAC-SHA256)'),
+        'rut_cifrar': (lambda: cifrar_rut(parseados()), 'cifrar_rut (AES-256-GCM)'),
+        'rut_cifrar_lote_100': (lambda: cifrar_ruts_lote(lote), 'cifrar_ruts_lote, 100 RUT'),
+        'rut_descifrar': (lambda: descifrar_rut(cifrados()), 'descifrar_rut'),
+        'cip_generar': (lambda: generar_cip('Posta Curepto'), 'generar_cip'),
+        'checksum_registro': (lambda: generar_checksum_registro(registro), 'generar_checksum_registro'),
+        'password_hashear': (lambda: hashear_password('Clave.Segura2026'), 'hashear_password (PBKDF2 260k)'),
+        'password_verificar': (lambda: verificar_password('Clave.Segura2026', password_hash),
+                               'verificar_password'),
+    }
+
+
+def medir(funcion, repeticiones):
+    """Nanosegundos por operación: mínimo entre repeticiones de ~DURACION_MINIMA."""
+    temporizador = timeit.Timer(funcion)
+    numero = 1
+    while True:
+        if temporizador.timeit(numero) >= DURACION_MINIMA:
+            break
+        numero *= 2 if numero < 8 else 4
+    return min(temporizador.repeat(repeticiones, numero)) / numero * 1e9
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def ejecutar(filtro, repeticiones, corridas=1):
+    """Mide los casos `corridas` veces y conserva el mínimo de cada uno."""
+    todos = casos()
+    nombres = [n for n in todos if n != 'referencia' and (not filtro or filtro in n)]
+    mejores = {}
+    for _ in range(corridas):
+        # La referencia se mide antes y después de los casos: un cambio de carga
+        # de la máquina a mitad de la corrida no sesga todos los relativos
+        for nombre in ['referencia'] + nombres + ['referencia']:
+            ns = medir(todos[nombre][0], repeticiones)
+            mejores[nombre] = min(ns, mejores.get(nombre, ns))
+
+    resultado = {
+        'commit': commit_actual(),
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'casos': {},
+    }
+    for nombre in ['referencia'] + nombres:
+        ns = mejores[nombre]
+        resultado['casos'][nombre] = {
+            'ns': round(ns, 1),
+            'relativo': round(ns / mejores['referencia'], 5),
+            'descripcion': todos[nombre][1],
+        }
+        print(f"  {nombre:<22} {ns / 1000:>12,.2f} us/op   {todos[nombre][1]}")
+    return resultado
+
+
+def comparar(base, nuevo, umbral, absoluto):
+    """
+    Imprime el reporte y retorna los casos que empeoran más de `umbral` %.
+    """
+    campo = 'ns' if absoluto else 'relativo'
+    print(f"\n[COMPARACION] base {base.get('commit') or '?'} ({base.get('fecha', '?')}) "
+          f"-> {nuevo.get('commit') or '?'} ({nuevo.get('fecha', '?')}), "
+          f"{'ns absolutos' if absoluto else 'tiempo / referencia'}, umbral {umbral:g} %")
+    print(f"  {'CASO':<22} {'BASE us':>12} {'NUEVO us':>12} {'CAMBIO':>9}")
+    regresiones = []
+    for nombre, caso in nuevo['casos'].items():
+        anterior = base.get('casos', {}).get(nombre)
+        if nombre == 'referencia' or not anterior or campo not in anterior:
+            continue
+        cambio = (caso[campo] / anterior[campo] - 1) * 100
+        marca = ''
+        if cambio > umbral:
+            marca = '  REGRESION'
+            regresiones.append(nombre)
+        elif cambio < -umbral:
+            marca = '  mejora'
+        print(f"  {nombre:<22} {anterior['ns'] / 1000:>12,.2f} {caso['ns'] / 1000:>12,.2f} "
+              f"{cambio:>+8.1f}%{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de utils/seguridad.py')
+    parser.add_argument('--base', default=BASE_REPO, help='Resultado contra el cual comparar')
+    parser.add_argument('--guardar-base', action='store_true', help='Escribir el resultado en --base')
+    parser.add_argument('--json', help='Guardar el resultado de esta corrida')
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVO'),
+                        help='Comparar dos resultados guardados, sin medir')
+    parser.add_argument('--solo', help='Solo casos cuyo nombre contiene este texto')
+    parser.add_argument('--repeticiones', type=int, default=7)
+    parser.add_argument('--corridas', type=int, default=1,
+                        help='Repetir la suite y conservar el mínimo (use 3 o más con --guardar-base)')
+    parser.add_argument('--umbral', type=float, default=20, help='Empeoramiento máximo en %%')
+    parser.add_argument('--absoluto', action='store_true',
+                        help='Comparar nanosegundos (misma máquina) en vez de tiempo relativo')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("MICRO-BENCHMARKS UTILS/SEGURIDAD")
+    print("=" * 60)
+
+    if args.comparar:
+        with open(args.comparar[0], encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.comparar[1], encoding='utf-8') as f:
+            nuevo = json.load(f)
+    else:
+        nuevo = ejecutar(args.solo, args.repeticiones, args.corridas)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(nuevo, f, indent=2, ensure_ascii=False)
+            print(f"\n[JSON] Resultado guardado en {args.json}")
+        if args.guardar_base:
+            with open(args.base, 'w', encoding='utf-8') as f:
+                json.dump(nuevo, f, indent=2, ensure_ascii=False)
+                f.write('\n')
+            print(f"[BASE] Actualizada: {args.base}")
+            sys.exit(0)
+        if not os.path.exists(args.base):
+            print(f"\n[BASE] No existe {args.base}: ejecute con --guardar-base")
+            sys.exit(0)
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+
+    regresiones = comparar(base, nuevo, args.umbral, args.absoluto)
+    print(f"\n[VERIFICACION] {'FALLO' if regresiones else 'OK'}: "
+          f"{len(regresiones)} casos empeoran mas de {args.umbral:g} %")
+    sys.exit(1 if regresiones else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+"""
+TELEMEDICINA - Generador de datos sintéticos
+
+Crea una base con volumen realista para pruebas de rendimiento:
+postas, usuarios (admin, médicos, TENS), pacientes con RUT válido
+(dígito verificador correcto) cifrado con AES-256-GCM y su CIP por
+posta, historial de consultas, consultas en espera y auditoría con
+checksum de integridad.
+
+- Determinista: la misma --semilla y --hasta generan los mismos RUT,
+  CIP, fechas y asignaciones (solo los cifrados cambian: cada uno
+  lleva su nonce)
+- Inserción masiva: executemany por lotes con los índices secundarios
+  eliminados; init_db() los recrea al final
+- Consistente: hashes y cifrados con las claves de .env (la base solo
+  sirve con esas mismas claves), estadisticas_diarias y analítica
+  reconstruidas desde el historial
+
+Todos los usuarios usan la misma contraseña (--password).
+
+Uso:
+    python generar_datos_sinteticos.py --db /tmp/grande.db
+    python generar_datos_sinteticos.py --db /tmp/grande.db --historial 5000000 --auditoria 10000000
+    python generar_datos_sinteticos.py --db /tmp/chica.db --escala 0.01 --semilla 7
+"""
+import argparse
+import calendar
+import hashlib
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+# Cada lote de inserción supera el umbral de consulta lenta: no registrarlos
+os.environ.setdefault('SQL_LENTA_MS', '0')
+
+from utils.analitica import refrescar_analitica
+from utils.auditoria import _SQL_INSERTAR_AUDITORIA, _fila_auditoria
+from utils.database import get_db_connection, init_db
+from utils.estadisticas import reconstruir_estadisticas_diarias
+from utils.importacion import TRABAJADORES_CIFRADO, _cifrar_en_paralelo
+from utils.seguridad import RutParseado, _calcular_dv, generar_cip, hashear_password
+
+POSTAS_MAULE = [
+    'Curepto', 'Talca', 'Linares', 'Constitución', 'Cauquenes', 'Molina', 'Parral',
+    'San Javier', 'Pelarco', 'Pencahue', 'Empedrado', 'Chanco', 'Pelluhue', 'Retiro',
+    'Longaví', 'Colbún', 'Yerbas Buenas', 'Villa Alegre', 'San Clemente', 'Río Claro',
+    'Sagrada Familia', 'Hualañé', 'Licantén', 'Vichuquén', 'Rauco', 'Romeral', 'Teno',
+    'Gualleco', 'Duao', 'Putú',
+]
+NOMBRES = ['María', 'José', 'Camila', 'Juan', 'Valentina', 'Diego', 'Francisca', 'Felipe',
+           'Javiera', 'Matías', 'Constanza', 'Sebastián', 'Catalina', 'Nicolás', 'Fernanda',
+           'Cristóbal', 'Daniela', 'Tomás', 'Antonia', 'Benjamín']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva',
+             'Martínez', 'Sepúlveda', 'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández',
+             'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela']
+
+# (accion, categoria, resultado, peso): proporciones aproximadas de producción
+ACCIONES_AUDITORIA = [
+    ('login_exitoso', 'autenticacion', 'exito', 70),
+    ('login_fallido', 'autenticacion', 'error', 15),
+    ('pacientes_importados', 'consultas', 'exito', 5),
+    ('usuario_creado', 'usuarios', 'exito', 4),
+    ('lugar_creado', 'lugares', 'exito', 2),
+    ('solicitud_aprobada', 'sistema', 'exito', 2),
+    ('solicitud_rechazada', 'sistema', 'exito', 1),
+    ('eliminar_usuario', 'usuarios', 'exito', 1),
+]
+
+# Consultas entre 08:00 y 18:00 de Chile (UTC-3/-4): se guardan en UTC
+HORA_INICIO_UTC = 11 * 3600
+HORA_FIN_UTC = 21 * 3600
+
+# Marcador de la fecha dentro del JSON del checksum de auditoría
+_MARCA_FECHA = '__FECHA_SINTETICA__'
+
+_SQL_HISTORIAL = '''
+    INSERT INTO historial_consultas
+    (consulta_id, codigo_consulta, token_seguridad, cip, rut_paciente_cifrado, rut_paciente_hash,
+     nombre_medico, tens_nombre, nombre_posta, fecha_inicio, fecha_atencion, fecha_fin)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+            datetime(?, 'unixepoch'), datetime(?, 'unixepoch'), datetime(?, 'unixepoch'))
+'''
+
+
+def rut_desde_numero(numero):
+    numero = str(numero)
+    return RutParseado(numero, _calcular_dv(numero))
+
+
+def nombre_persona(rng):
+    return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+
+
+class Generador:
+    """Genera cada tabla por lotes y lleva el conteo de filas y tiempo por etapa."""
+
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+        self.rng = random.Random(args.semilla)
+        # El historial termina a las 00:00 UTC de --hasta: las fechas no dependen
+        # de la hora de ejecución. La sala de espera sí usa la hora actual.
+        self.hasta = calendar.timegm(time.strptime(args.hasta, '%Y-%m-%d'))
+        self.desde = self.hasta - args.dias * 86400
+        self.ahora = int(time.time())
+        self.etapas = []
+
+    def etapa(self, nombre, filas, inicio):
+        duracion = time.perf_counter() - inicio
+        self.etapas.append((nombre, filas, duracion))
+        tasa = f"{filas / duracion:>12,.0f} filas/s" if filas and duracion else ''
+        print(f"  {nombre:<26} {filas:>12,} filas {duracion:>8.2f} s {tasa}")
+
+    def insertar_por_lotes(self, sql, filas):
+        """
+        executemany por lotes de una transacción cada uno. Un hilo arma el
+        lote siguiente mientras SQLite inserta el actual (el módulo sqlite3
+        libera el GIL durante la inserción).
+        """
+        lote = self.args.lote
+        lotes = queue.Queue(maxsize=2)
+
+        def producir():
+            try:
+                while True:
+                    bloque = list(itertools.islice(filas, lote))
+                    lotes.put(bloque)
+                    if not bloque:
+                        return
+            except BaseException as e:
+                lotes.put(e)
+
+        threading.Thread(target=producir, daemon=True).start()
+        total = 0
+        while True:
+            bloque = lotes.get()
+            if isinstance(bloque, BaseException):
+                raise bloque
+            if not bloque:
+                return total
+            self.conn.executemany(sql, bloque)
+            self.conn.commit()
+            total += len(bloque)
+
+    def lugares(self):
+        inicio = time.perf_counter()
+        self.postas = []
+        for i in range(self.args.postas):
+            nombre = POSTAS_MAULE[i % len(POSTAS_MAULE)]
+            if i >= len(POSTAS_MAULE):
+                nombre = f"{nombre} {i // len(POSTAS_MAULE) + 1}"
+            self.postas.append(f"Posta {nombre}")
+        self.conn.executemany(
+            "INSERT INTO lugares (nombre_posta, direccion, fecha_creacion) "
+            "VALUES (?, ?, datetime(?, 'unixepoch'))",
+            [(nombre, f"{nombre[6:]}, Región del Maule", self.desde) for nombre in self.postas]
+        )
+        self.conn.commit()
+        self.lugar_ids = [f[0] for f in self.conn.execute(
+            'SELECT id FROM lugares WHERE nombre_posta IN (%s) ORDER BY id' % ','.join('?' * len(self.postas)),
+            self.postas
+        )]
+        self.etapa('lugares', len(self.postas), inicio)
+
+    def ruts(self):
+        """RUT únicos para usuarios y pacientes, sin repetir entre ellos."""
+        necesarios = self.args.medicos + self.args.tens + self.args.admins + self.args.pacientes
+        # Rango de RUT de personas vivas (~5 a ~26 millones)
+        return self.rng.sample(range(5_000_000, 26_000_000), necesarios)
+
+    def usuarios(self, numeros):
+        inicio = time.perf_counter()
+        password_hash = hashear_password(self.args.password)
+        filas, self.medicos, self.tens = [], [], []
+        roles = (['admin'] * self.args.admins + ['medico'] * self.args.medicos
+                 + ['tens'] * self.args.tens)
+        for i, (rol, numero) in enumerate(zip(roles, numeros), start=1):
+            nombre = nombre_persona(self.rng)
+            if rol == 'medico':
+                nombre = f"Dr. {nombre}"
+                self.medicos.append(nombre)
+            elif rol == 'tens':
+                self.tens.append(nombre)
+            filas.append((nombre, rut_desde_numero(numero).normalizado, f"{rol}{i}@sintetico.cl",
+                          rol, self.args.password, password_hash, self.desde))
+        self.conn.executemany(
+            "INSERT INTO usuarios (nombre, rut, correo, rol, password, password_hash, fecha_creacion, activo) "
+            "VALUES (?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'), 1)", filas
+        )
+        self.conn.commit()
+        self.tens_ids = [f[0] for f in self.conn.execute(
+            "SELECT id FROM usuarios WHERE correo LIKE 'tens%@sintetico.cl' ORDER BY id"
+        )]
+        # Cada TENS trabaja en una posta
+        self.tens_por_posta = [[] for _ in self.postas]
+        for i, nombre in enumerate(self.tens):
+            self.tens_por_posta[i % len(self.postas)].append(nombre)
+        self.etapa('usuarios', len(filas), inicio)
+
+    def pacientes(self, numeros):
+        """mapeo_pacientes: RUT cifrado, hash HMAC y CIP único por prefijo de posta."""
+        inicio = time.perf_counter()
+        rng = self.rng
+        # Postas de distinto tamaño: algunas concentran muchos más pacientes
+        pesos = [rng.uniform(0.3, 3.0) for _ in self.postas]
+        self.posta_paciente = rng.choices(range(len(self.postas)), weights=pesos, k=len(numeros))
+
+        # Varias postas pueden compartir prefijo (AAA-99999): el espacio de
+        # 100.000 CIP es por prefijo, no por posta
+        prefijos = [generar_cip(nombre)[:3] for nombre in self.postas]
+        por_prefijo = {}
+        for posta in self.posta_paciente:
+            por_prefijo[prefijos[posta]] = por_prefijo.get(prefijos[posta], 0) + 1
+        libres = {}
+        for prefijo, cantidad in sorted(por_prefijo.items()):
+            if cantidad > 100_000:
+                raise SystemExit(f"El prefijo {prefijo} necesita {cantidad:,} CIP (máximo 100.000): "
+                                 f"use más --postas o menos --pacientes")
+            libres[prefijo] = iter(rng.sample(range(100_000), cantidad))
+
+        self.cips, self.cifrados, self.hashes = [], [], []
+        creado_por = self.tens_ids or [None]
+        lote = self.args.lote
+        for desde in range(0, len(numeros), lote):
+            ruts = [rut_desde_numero(n) for n in numeros[desde:desde + lote]]
+            cifrados = _cifrar_en_paralelo(ruts, self.args.trabajadores)
+            filas = []
+            for j, (rut, cifrado) in enumerate(zip(ruts, cifrados)):
+                prefijo = prefijos[self.posta_paciente[desde + j]]
+                cip = f"{prefijo}-{next(libres[prefijo]):05d}"
+                self.cips.append(cip)
+                self.cifrados.append(cifrado)
+                self.hashes.append(rut.hash)
+                filas.append((cip, cifrado, rut.hash, rut.enmascarado,
+                              rng.randrange(self.desde, self.hasta), rng.choice(creado_por)))
+            self.conn.executemany(
+                "INSERT INTO mapeo_pacientes (cip, rut_cifrado, rut_hash, rut_enmascarado, "
+                "fecha_creacion, creado_por_id) VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'), ?)", filas
+            )
+            self.conn.commit()
+        self.etapa('mapeo_pacientes', len(numeros), inicio)
+
+    def _filas_historial(self):
+        rng = self.rng
+        aleatorio = rng.random
+        lognormal = rng.lognormvariate
+        bits = rng.getrandbits
+        total = self.args.historial
+        pacientes = len(self.cips)
+        cips, cifrados, hashes = self.cips, self.cifrados, self.hashes
+        posta_paciente, postas = self.posta_paciente, self.postas
+        medicos = self.medicos or ['Médico']
+        tens_por_posta = [tens or ['TENS'] for tens in self.tens_por_posta]
+        segundos_por_consulta = self.args.dias * 86400 / (total + 1)
+        jornada = HORA_FIN_UTC - HORA_INICIO_UTC
+        # Los pacientes frecuentes (crónicos) vuelven muchas veces: distribución sesgada
+        sesgo = self.args.sesgo_pacientes
+        for consulta_id in range(1, total + 1):
+            paciente = min(pacientes - 1, int(pacientes * aleatorio() ** sesgo))
+            posta = posta_paciente[paciente]
+            cip = cips[paciente]
+            # Historial en orden cronológico, como al archivar en producción
+            dia = int(self.desde + consulta_id * segundos_por_consulta)
+            inicio = dia - dia % 86400 + HORA_INICIO_UTC + int(aleatorio() * jornada)
+            atencion = inicio + int(lognormal(6.2, 0.8))     # espera ~8 min
+            fin = atencion + int(lognormal(6.6, 0.5))        # atención ~12 min
+            tens = tens_por_posta[posta]
+            yield (consulta_id, f"{cip}-{consulta_id:06d}", f"{bits(64):016x}", cip,
+                   cifrados[paciente], hashes[paciente], medicos[int(aleatorio() * len(medicos))],
+                   tens[int(aleatorio() * len(tens))], postas[posta], inicio, atencion, fin)
+
+    def historial(self):
+        inicio = time.perf_counter()
+        filas = self.insertar_por_lotes(_SQL_HISTORIAL, self._filas_historial())
+        self.etapa('historial_consultas', filas, inicio)
+
+    def consultas_en_espera(self):
+        """Sala de espera actual; los id siguen al historial (AUTOINCREMENT no los reutiliza)."""
+        inicio = time.perf_counter()
+        rng = self.rng
+        filas = []
+        for i in range(self.args.en_espera):
+            paciente = rng.randrange(len(self.cips))
+            posta = self.posta_paciente[paciente]
+            tens = self.tens_por_posta[posta]
+            filas.append((self.args.historial + i + 1, self.cips[paciente], self.hashes[paciente],
+                          self.lugar_ids[posta], rng.choice(tens) if tens else 'TENS',
+                          self.ahora - rng.randrange(60, 1800)))
+        self.conn.executemany(
+            "INSERT INTO consultas (id, cip, rut_paciente_hash, lugar_id, tens_nombre, fecha) "
+            "VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'))", filas
+        )
+        if not filas and self.args.historial:
+            # Sin consultas activas igual se reserva el rango de id del historial
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sqlite_sequence (name, seq) VALUES ('consultas', ?)",
+                (self.args.historial,)
+            )
+        self.conn.commit()
+        self.etapa('consultas (en espera)', len(filas), inicio)
+
+    def _filas_auditoria(self):
+        """
+        Filas de auditoría con el mismo checksum que registrar_auditoria().
+
+        Entre registros de la misma acción y usuario solo cambia la fecha: el
+        JSON del checksum (generar_checksum_registro) se arma una vez por
+        combinación y por fila solo se inserta la fecha antes del SHA-256.
+        La primera fila de cada combinación se compara con _fila_auditoria().
+        """
+        rng = self.rng
+        aleatorio = rng.random
+        sha256 = hashlib.sha256
+        total = self.args.auditoria
+        # Acciones repetidas según su peso: elegir una es un solo índice aleatorio
+        acciones = [accion for accion in ACCIONES_AUDITORIA for _ in range(accion[3])]
+        usuarios = [(i, n, 'tens') for i, n in zip(self.tens_ids, self.tens)] or [(None, 'sistema', 'sistema')]
+        ips = [f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}" for _ in range(500)]
+        segundos_por_registro = self.args.dias * 86400 / max(total, 1)
+        plantillas = {}
+        dias = {}
+        for i in range(total):
+            accion, categoria, resultado, _ = acciones[int(aleatorio() * len(acciones))]
+            indice_usuario = int(aleatorio() * len(usuarios))
+            usuario_id, usuario_nombre, usuario_rol = usuarios[indice_usuario]
+            mensaje = f"Registro sintético: {accion}"
+            # Fechas en hora de Chile (obtener_timestamp_chile); el checksum incluye la fecha
+            segundo = int(self.desde + i * segundos_por_registro)
+            dia = segundo - segundo % 86400
+            if dia not in dias:
+                dias[dia] = time.strftime('%Y-%m-%d', time.gmtime(dia))
+            s = segundo - dia
+            fecha = f"{dias[dia]} {s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}"
+            ip = ips[int(aleatorio() * len(ips))]
+
+            plantilla = plantillas.get((accion, indice_usuario))
+            if plantilla is None:
+                contenido = json.dumps({
+                    'usuario_id': usuario_id, 'usuario_nombre': usuario_nombre,
+                    'usuario_rol': usuario_rol, 'accion': accion, 'categoria': categoria,
+                    'resultado': resultado, 'fecha': _MARCA_FECHA, 'mensaje': mensaje,
+                    'entidad_tipo': None, 'entidad_id': None,
+                }, sort_keys=True, default=str)
+                plantilla = plantillas[(accion, indice_usuario)] = contenido.split(_MARCA_FECHA)
+                fila = _fila_auditoria(fecha, usuario_id, usuario_nombre, usuario_rol, accion,
+                                       categoria, resultado, mensaje=mensaje, ip_origen=ip)
+                if sha256(fecha.join(plantilla).encode()).hexdigest()[:32] != fila[-1]:
+                    raise RuntimeError('El checksum de auditoría cambió: actualice _filas_auditoria()')
+                yield fila
+                continue
+
+            yield (usuario_id, usuario_nombre, usuario_rol, accion, categoria, None, None, None, None,
+                   ip, None, resultado, mensaje, fecha,
+                   sha256(fecha.join(plantilla).encode()).hexdigest()[:32])
+
+    def auditoria(self):
+        inicio = time.perf_counter()
+        filas = self.insertar_por_lotes(_SQL_INSERTAR_AUDITORIA, self._filas_auditoria())
+        self.etapa('auditoria', filas, inicio)
+
+
+def eliminar_indices_secundarios(conn, tablas):
+    """Inserciones masivas sin mantener índices; init_db() los vuelve a crear."""
+    marcadores = ','.join('?' * len(tablas))
+    indices = [f[0] for f in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({marcadores})", tablas
+    )]
+    for indice in indices:
+        conn.execute(f'DROP INDEX "{indice}"')
+    conn.commit()
+    return indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generador de base de datos sintetica')
+    parser.add_argument('--db', required=True, help='Archivo de base a crear (no debe existir)')
+    parser.add_argument('--reemplazar', action='store_true', help='Eliminar --db si ya existe')
+    parser.add_argument('--escala', type=float, default=1.0,
+                        help='Multiplica pacientes, historial, auditoria y usuarios')
+    parser.add_argument('--postas', type=int, default=30)
+    parser.add_argument('--medicos', type=int, default=80)
+    parser.add_argument('--tens', type=int, default=150)
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--pacientes', type=int, default=200_000)
+    parser.add_argument('--historial', type=int, default=1_000_000)
+    parser.add_argument('--auditoria', type=int, default=2_000_000)
+    parser.add_argument('--en-espera', type=int, default=20, help='Consultas en la sala de espera')
+    parser.add_argument('--dias', type=int, default=365, help='Antigüedad del historial')
+    parser.add_argument('--hasta', default=time.strftime('%Y-%m-%d', time.gmtime()),
+                        help='Fin del historial, AAAA-MM-DD (defecto: hoy)')
+    parser.add_argument('--sesgo-pacientes', type=float, default=2.0,
+                        help='>1 concentra las consultas en menos pacientes (1 = uniforme)')
+    parser.add_argument('--semilla', type=int, default=2026)
+    parser.add_argument('--password', default='Sintetico2026!', help='Contraseña de todos los usuarios')
+    parser.add_argument('--lote', type=int, default=50_000, help='Filas por transacción')
+    parser.add_argument('--trabajadores', type=int, default=TRABAJADORES_CIFRADO,
+                        help=f'Hilos de cifrado (defecto: {TRABAJADORES_CIFRADO})')
+    parser.add_argument('--sin-agregados', action='store_true',
+                        help='No reconstruir estadisticas_diarias ni la analítica')
+    args = parser.parse_args()
+
+    for campo in ('medicos', 'tens', 'admins', 'pacientes', 'historial', 'auditoria'):
+        setattr(args, campo, max(0, math.ceil(getattr(args, campo) * args.escala)))
+    if args.historial and not args.pacientes:
+        parser.error('--historial requiere al menos un paciente')
+    if os.path.exists(args.db):
+        if not args.reemplazar:
+            parser.error(f"{args.db} ya existe (use --reemplazar para sobrescribirlo)")
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + sufijo):
+                os.remove(args.db + sufijo)
+
+    print("=" * 60)
+    print("GENERADOR DE DATOS SINTETICOS")
+    print("=" * 60)
+    print(f"  Base: {args.db} (semilla {args.semilla})")
+    print()
+
+    inicio_total = time.perf_counter()
+    init_db(args.db)
+    conn = get_db_connection(args.db)
+    # Base nueva y descartable: sin fsync por transacción durante la carga
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    eliminar_indices_secundarios(conn, ['historial_consultas', 'auditoria', 'mapeo_pacientes'])
+
+    generador = Generador(conn, args)
+    generador.lugares()
+    numeros = generador.ruts()
+    usuarios = args.admins + args.medicos + args.tens
+    generador.usuarios(numeros[:usuarios])
+    generador.pacientes(numeros[usuarios:])
+    del numeros
+    generador.historial()
+    generador.consultas_en_espera()
+    generador.auditoria()
+    filas_insertadas = sum(filas for _, filas, _ in generador.etapas)
+    segundos_insercion = sum(duracion for _, _, duracion in generador.etapas)
+    conn.close()
+
+    inicio = time.perf_counter()
+    init_db(args.db)
+    generador.etapa('indices (init_db)', 0, inicio)
+
+    conn = get_db_connection(args.db)
+    if not args.sin_agregados:
+        inicio = time.perf_counter()
+        generador.etapa('estadisticas_diarias', reconstruir_estadisticas_diarias(conn), inicio)
+        inicio = time.perf_counter()
+        generador.etapa('analitica', refrescar_analitica(conn), inicio)
+    conn.execute('PRAGMA optimize')
+    conn.close()
+
+    duracion = time.perf_counter() - inicio_total
+    print(f"\n[OK] {filas_insertadas:,} filas en {segundos_insercion:.1f} s de inserción "
+          f"({filas_insertadas / segundos_insercion:,.0f} filas/s); total {duracion:.1f} s")
+    print(f"     Usuarios: <rol><n>@sintetico.cl (p. ej. medico{args.admins + 1}@sintetico.cl) "
+          f"con la contraseña indicada en --password")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+TELEMEDICINA - Configuración de gunicorn (producción, Linux)
+Uso: gunicorn -c gunicorn.conf.py   (o python servidor.py)
+
+- El proceso maestro ejecuta init_db() (tablas, columnas e
+  índices faltantes) antes de crear los workers; con preload
+  además importa app.py una sola vez y los workers lo heredan
+- Respaldos y mantenimiento corren en un solo worker
+  (utils/procesos.py)
+- Al reiniciar (SIGTERM / SIGHUP) cada worker deja de aceptar
+  conexiones y termina los requests en curso durante
+  WEB_DRENAJE_SEGUNDOS
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+wsgi_app = 'app:create_app()'
+bind = f"{os.environ.get('WEB_HOST', '0.0.0.0')}:{os.environ.get('WEB_PUERTO', 5000)}"
+
+# SQLite admite un solo escritor: pocos procesos con varios hilos cada uno
+workers = int(os.environ.get('WEB_WORKERS', min(4, multiprocessing.cpu_count())))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+graceful_timeout = int(os.environ.get('WEB_DRENAJE_SEGUNDOS', 30))
+# La exportación del historial completo puede tardar más que un request normal
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# Reciclar workers acota el crecimiento de memoria (0 = nunca)
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    from utils.database import asegurar_db
+    asegurar_db()
+
+
+def post_worker_init(worker):
+    from utils.procesos import iniciar_tareas_segundo_plano
+    iniciar_tareas_segundo_plano()
+
+
+def worker_exit(server, worker):
+    from utils.procesos import detener_tareas_segundo_plano
+    detener_tareas_segundo_plano(timeout=graceful_timeout)
@@ -0,0 +1,73 @@
+"""
+TELEMEDICINA - Pre-registro masivo de pacientes desde CSV
+
+Uso:
+    python importar_pacientes.py pacientes.csv --lugar-id 1
+    python importar_pacientes.py pacientes.csv --lugar-id 1 --reporte errores.csv
+
+El CSV debe tener una columna 'rut' (opcionalmente 'lugar_id' por fila).
+Sin encabezado, se usa la primera columna como RUT.
+"""
+import argparse
+import sys
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from utils.database import get_db_connection, init_db
+from utils.importacion import (
+    leer_csv_pacientes, importar_pacientes, escribir_reporte_errores,
+    TAMANO_LOTE_IMPORTACION, TRABAJADORES_CIFRADO
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-registro masivo de pacientes desde CSV')
+    parser.add_argument('archivo', help='Ruta del archivo CSV')
+    parser.add_argument('--lugar-id', help='Posta por defecto para filas sin lugar_id')
+    parser.add_argument('--reporte', help='Ruta donde escribir el reporte de errores (CSV)')
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE_IMPORTACION,
+                        help=f'Filas por transaccion (defecto: {TAMANO_LOTE_IMPORTACION})')
+    parser.add_argument('--trabajadores', type=int, default=TRABAJADORES_CIFRADO,
+                        help=f'Hilos de cifrado (defecto: {TRABAJADORES_CIFRADO})')
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db_connection()
+
+    inicio = time.perf_counter()
+    with open(args.archivo, 'r', encoding='utf-8-sig', newline='') as f:
+        resumen = importar_pacientes(
+            conn, leer_csv_pacientes(f),
+            lugar_id_defecto=args.lugar_id,
+            tamano_lote=args.lote,
+            trabajadores=args.trabajadores
+        )
+    duracion = time.perf_counter() - inicio
+    conn.close()
+
+    print("=" * 60)
+    print("IMPORTACION DE PACIENTES")
+    print("=" * 60)
+    print(f"  Filas procesadas:       {resumen['procesadas']}")
+    print(f"  Pacientes registrados:  {resumen['registradas']}")
+    print(f"  Ya registrados:         {resumen['existentes']}")
+    print(f"  Repetidos en archivo:   {resumen['duplicadas']}")
+    print(f"  Filas con error:        {len(resumen['errores'])}")
+    print(f"  Duracion:               {duracion:.2f} s "
+          f"({resumen['procesadas'] / duracion if duracion else 0:,.0f} filas/s)")
+
+    if resumen['errores']:
+        if args.reporte:
+            with open(args.reporte, 'w', encoding='utf-8-sig', newline='') as f:
+                escribir_reporte_errores(resumen['errores'], f)
+            print(f"  Reporte de errores:     {args.reporte}")
+        else:
+            escribir_reporte_errores(resumen['errores'], sys.stdout)
+
+    return 0 if not resumen['errores'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# ==========================================
+# SCRIPT DE MIGRACIÓN - ESTADÍSTICAS DIARIAS
+# ==========================================
+# Ejecutar UNA VEZ al actualizar (o cuando se requiera
+# reconstruir los contadores) para:
+# 1. Crear la tabla estadisticas_diarias y sus índices
+# 2. Recalcularla desde todo historial_consultas
+#
+# Desde esta versión la tabla se mantiene al finalizar cada
+# consulta; este script solo completa el historial previo.
+# ==========================================
+
+import sqlite3
+import os
+import sys
+import shutil
+from datetime import datetime
+
+# Agregar el directorio padre al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import DB_PATH, init_db
+from utils.estadisticas import reconstruir_estadisticas_diarias
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+
+
+def crear_backup_pre_migracion():
+    """Crea backup de seguridad antes de la migración"""
+    if not os.path.exists(DB_PATH):
+        print("[ERROR] No se encontro la base de datos")
+        return False
+
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    backup_name = f"backup_pre_migracion_estadisticas_{timestamp}.db"
+    backup_path = os.path.join(BACKUP_DIR, backup_name)
+
+    if not os.path.exists(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR)
+
+    shutil.copy2(DB_PATH, backup_path)
+    print(f"[OK] Backup creado: {backup_name}")
+    return True
+
+
+def ejecutar_migracion():
+    """Ejecuta el backfill de estadisticas_diarias"""
+
+    print("")
+    print("=" * 60)
+    print("   MIGRACION - ESTADISTICAS DIARIAS")
+    print("=" * 60)
+    print("")
+
+    # 1. Crear backup
+    print("[1] Creando backup de seguridad...")
+    if not crear_backup_pre_migracion():
+        return False
+
+    # 2. Tabla e índices (idempotente)
+    print("")
+    print("[2] Creando tabla estadisticas_diarias...")
+    init_db()
+    print("   [OK] Tabla e indices disponibles")
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+
+    try:
+        # 3. Recalcular desde el historial
+        print("")
+        print("[3] Recalculando desde historial_consultas...")
+        consultas = conn.execute("SELECT COUNT(*) FROM historial_consultas").fetchone()[0]
+        filas = reconstruir_estadisticas_diarias(conn)
+        print(f"   [OK] {consultas} consultas resumidas en {filas} filas (medico, dia, posta)")
+
+        print("")
+        print("=" * 60)
+        print("   [OK] MIGRACION COMPLETADA EXITOSAMENTE")
+        print("=" * 60)
+        print("")
+
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Error en migracion: {e}")
+        print("   Los cambios han sido revertidos.")
+        return False
+
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print("")
+    print("TELEMEDICINA - Backfill de estadisticas diarias")
+    print("")
+
+    respuesta = input("Desea recalcular estadisticas_diarias? (s/n): ").strip().lower()
+
+    if respuesta == 's':
+        ejecutar_migracion()
+    else:
+        print("Migracion cancelada.")
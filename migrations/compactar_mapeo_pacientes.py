@@ -0,0 +1,176 @@
+# ==========================================
+# SCRIPT DE COMPACTACIÓN - MAPEO DE PACIENTES
+# ==========================================
+# Ejecutar UNA SOLA VEZ para:
+# 1. Fusionar filas duplicadas de mapeo_pacientes (mismo rut_hash)
+# 2. Conservar el CIP más antiguo de cada paciente
+# 3. Crear el índice único de rut_hash (si no quedan duplicados)
+# 4. Informar cuánto se redujo la tabla
+#
+# Antes de la reutilización de CIP, cada visita creaba un mapeo nuevo.
+# Los CIP en uso por consultas activas (esperando/atendiendo) no se
+# tocan, porque identifican una sala de video en curso.
+# ==========================================
+
+import sqlite3
+import os
+import sys
+import shutil
+from datetime import datetime
+
+# Agregar el directorio padre al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import DB_PATH, crear_indice_rut_hash_unico
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+
+
+def crear_backup_pre_migracion():
+    """Crea backup de seguridad antes de la compactación"""
+    if not os.path.exists(DB_PATH):
+        print("[ERROR] No se encontro la base de datos")
+        return False
+
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    backup_name = f"backup_pre_migracion_compactar_mapeo_{timestamp}.db"
+    backup_path = os.path.join(BACKUP_DIR, backup_name)
+
+    if not os.path.exists(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR)
+
+    shutil.copy2(DB_PATH, backup_path)
+    print(f"[OK] Backup creado: {backup_name}")
+    return True
+
+
+def compactar_mapeo(conn):
+    """
+    Elimina los mapeos duplicados de cada paciente, conservando el de menor id.
+
+    Returns:
+        dict: filas_antes, filas_despues, eliminadas, pacientes_duplicados, reduccion_pct
+    """
+    filas_antes = conn.execute("SELECT COUNT(*) FROM mapeo_pacientes").fetchone()[0]
+
+    # CIP sobrantes: todo mapeo que no es el más antiguo de su rut_hash
+    # y que no está siendo usado por una consulta activa
+    conn.execute("DROP TABLE IF EXISTS temp.cip_sobrantes")
+    conn.execute('''
+        CREATE TEMP TABLE cip_sobrantes AS
+        SELECT m.id, m.rut_hash
+        FROM mapeo_pacientes m
+        JOIN (
+            SELECT rut_hash, MIN(id) AS id_canonico
+            FROM mapeo_pacientes
+            GROUP BY rut_hash
+            HAVING COUNT(*) > 1
+        ) d ON d.rut_hash = m.rut_hash
+        WHERE m.id <> d.id_canonico
+          AND NOT EXISTS (
+              SELECT 1 FROM consultas c
+              WHERE c.cip = m.cip AND c.estado IN ('esperando', 'activa', 'atendiendo')
+          )
+    ''')
+
+    pacientes_duplicados = conn.execute(
+        "SELECT COUNT(DISTINCT rut_hash) FROM temp.cip_sobrantes"
+    ).fetchone()[0]
+
+    conn.execute("DELETE FROM mapeo_pacientes WHERE id IN (SELECT id FROM temp.cip_sobrantes)")
+    conn.execute("DROP TABLE temp.cip_sobrantes")
+
+    filas_despues = conn.execute("SELECT COUNT(*) FROM mapeo_pacientes").fetchone()[0]
+    eliminadas = filas_antes - filas_despues
+
+    return {
+        'filas_antes': filas_antes,
+        'filas_despues': filas_despues,
+        'eliminadas': eliminadas,
+        'pacientes_duplicados': pacientes_duplicados,
+        'reduccion_pct': (eliminadas * 100.0 / filas_antes) if filas_antes else 0.0,
+    }
+
+
+def ejecutar_migracion():
+    """Ejecuta la compactación de mapeo_pacientes"""
+
+    print("")
+    print("=" * 60)
+    print("   COMPACTACION - MAPEO DE PACIENTES")
+    print("=" * 60)
+    print("")
+
+    # 1. Crear backup
+    print("[1] Creando backup de seguridad...")
+    if not crear_backup_pre_migracion():
+        return False
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+
+    try:
+        # 2. Fusionar duplicados
+        print("")
+        print("[2] Fusionando mapeos duplicados por rut_hash...")
+        resultado = compactar_mapeo(conn)
+
+        # 3. Asegurar índice de búsqueda
+        print("")
+        print("[3] Verificando indice de busqueda...")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_mapeo_pacientes_rut_hash_cip "
+            "ON mapeo_pacientes (rut_hash, id, cip)"
+        )
+        print("   [OK] Indice 'idx_mapeo_pacientes_rut_hash_cip' disponible")
+        # Impide que dos registros simultáneos vuelvan a duplicar un paciente
+        if crear_indice_rut_hash_unico(conn):
+            print("   [OK] Indice unico 'idx_mapeo_pacientes_rut_hash_unico' disponible")
+        else:
+            print("   [AVISO] Quedan duplicados en uso por consultas activas: vuelva a")
+            print("           ejecutar la compactacion cuando terminen")
+
+        conn.commit()
+
+        # 4. Reporte
+        print("")
+        print("[4] Resultado:")
+        print(f"   - Filas antes:            {resultado['filas_antes']}")
+        print(f"   - Filas despues:          {resultado['filas_despues']}")
+        print(f"   - Filas eliminadas:       {resultado['eliminadas']}")
+        print(f"   - Pacientes con duplicado: {resultado['pacientes_duplicados']}")
+        print(f"   - Reduccion de la tabla:  {resultado['reduccion_pct']:.1f}%")
+
+        print("")
+        print("=" * 60)
+        print("   [OK] COMPACTACION COMPLETADA EXITOSAMENTE")
+        print("=" * 60)
+        print("")
+        print("NOTA: el historial conserva su propio RUT cifrado y codigo")
+        print("      de consulta; no se modifica.")
+        print("")
+
+        return True
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Error en compactacion: {e}")
+        print("   Los cambios han sido revertidos.")
+        return False
+
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print("")
+    print("TELEMEDICINA - Compactacion de mapeo de pacientes")
+    print("")
+
+    respuesta = input("Desea compactar mapeo_pacientes? (s/n): ").strip().lower()
+
+    if respuesta == 's':
+        ejecutar_migracion()
+    else:
+        print("Compactacion cancelada.")
@@ -0,0 +1,316 @@
+# ==========================================
+# SCRIPT DE MIGRACIÓN - FASE 3
+# ==========================================
+# Implementa:
+# 1. Recalcular rut_hash con HMAC-SHA256 (clave RUT_HASH_KEY)
+#    en mapeo_pacientes, consultas e historial_consultas
+# 2. Fusionar el mapeo legado con el CIP que el paciente haya recibido
+#    ya con HMAC (mismo RUT, dos CIP)
+# 3. Índices de búsqueda por hash (cubriente y único en mapeo_pacientes)
+#
+# Se procesa por lotes con commit por lote; si se interrumpe,
+# volver a ejecutarlo continúa donde quedó.
+# Requiere ENCRYPTION_KEY (para descifrar) y RUT_HASH_KEY.
+#
+# Orden recomendado: compactar_mapeo_pacientes.py (si el inicio avisa
+# de RUT con más de un CIP) y luego esta fase. El índice único puede
+# existir antes: las colisiones con filas ya en HMAC se fusionan aquí.
+# ==========================================
+
+import sqlite3
+import os
+import sys
+import shutil
+from datetime import datetime
+
+# Agregar el directorio padre al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from utils.database import DB_PATH, crear_indice_rut_hash_unico
+from utils.seguridad import descifrar_rut, hashear_rut, hashear_rut_legado
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+
+TAMANO_LOTE = 1000
+
+
+def crear_backup_pre_migracion():
+    """Crea backup de seguridad antes de la migración"""
+    if not os.path.exists(DB_PATH):
+        print("[ERROR] No se encontro la base de datos")
+        return False
+
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    backup_name = f"backup_pre_migracion_fase3_{timestamp}.db"
+    backup_path = os.path.join(BACKUP_DIR, backup_name)
+
+    if not os.path.exists(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR)
+
+    shutil.copy2(DB_PATH, backup_path)
+    print(f"[OK] Backup creado: {backup_name}")
+    return True
+
+
+def _nuevo_hash_desde_cifrado(rut_cifrado, hash_actual):
+    """
+    Retorna (hash_legado, hash_nuevo) a partir del RUT cifrado,
+    o None si no hay que cambiar nada (ya migrado o no descifrable).
+    """
+    rut = descifrar_rut(rut_cifrado) if rut_cifrado else None
+    if not rut:
+        return None
+    hash_nuevo = hashear_rut(rut)
+    if hash_actual == hash_nuevo:
+        return None
+    return hashear_rut_legado(rut), hash_nuevo
+
+
+def _cip_en_uso(conn, cip):
+    """Una consulta activa usa el CIP como sala de video: no se puede reasignar."""
+    return conn.execute(
+        "SELECT 1 FROM consultas WHERE cip = ? AND estado IN ('esperando', 'activa', 'atendiendo') LIMIT 1",
+        (cip,)
+    ).fetchone() is not None
+
+
+def _fusionar_mapeo(conn, fila, otra, hash_nuevo):
+    """
+    El paciente ya tiene otro mapeo con el hash nuevo: conserva un solo CIP
+    (el que esté en una consulta activa o, si no, el más antiguo), reasigna
+    consultas e historial al CIP conservado y elimina el otro mapeo.
+
+    Returns:
+        bool: False si ambos CIP están en consultas activas (queda pendiente)
+    """
+    en_uso = [f for f in (fila, otra) if _cip_en_uso(conn, f['cip'])]
+    if len(en_uso) == 2:
+        return False
+    canonica = en_uso[0] if en_uso else min(fila, otra, key=lambda f: f['id'])
+    sobrante = otra if canonica is fila else fila
+
+    conn.execute("UPDATE consultas SET cip = ? WHERE cip = ?", (canonica['cip'], sobrante['cip']))
+    conn.execute("UPDATE historial_consultas SET cip = ? WHERE cip = ?", (canonica['cip'], sobrante['cip']))
+    conn.execute("DELETE FROM mapeo_pacientes WHERE id = ?", (sobrante['id'],))
+    conn.execute("UPDATE mapeo_pacientes SET rut_hash = ? WHERE id = ?", (hash_nuevo, canonica['id']))
+    return True
+
+
+def migrar_mapeo(conn, tamano_lote=TAMANO_LOTE):
+    """
+    Rehashea mapeo_pacientes y registra la equivalencia legado -> nuevo.
+
+    Returns:
+        tuple: (actualizadas, fusionadas, pendientes)
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS migracion_hash_rut (
+            hash_legado TEXT PRIMARY KEY,
+            hash_nuevo TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+    ultimo_id, actualizadas, fusionadas, pendientes = 0, 0, 0, 0
+    while True:
+        filas = conn.execute('''
+            SELECT id, cip, rut_cifrado, rut_hash FROM mapeo_pacientes
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (ultimo_id, tamano_lote)).fetchall()
+        if not filas:
+            break
+
+        equivalencias = []
+        for fila in filas:
+            resultado = _nuevo_hash_desde_cifrado(fila['rut_cifrado'], fila['rut_hash'])
+            if not resultado:
+                continue
+            hash_legado, hash_nuevo = resultado
+            equivalencias.append((hash_legado, hash_nuevo))
+
+            # Fila por fila: una fila del mismo lote ya rehasheada también cuenta
+            otra = conn.execute('''
+                SELECT id, cip FROM mapeo_pacientes
+                WHERE rut_hash = ? AND id <> ?
+                ORDER BY id LIMIT 1
+            ''', (hash_nuevo, fila['id'])).fetchone()
+            if not otra:
+                conn.execute("UPDATE mapeo_pacientes SET rut_hash = ? WHERE id = ?", (hash_nuevo, fila['id']))
+                actualizadas += 1
+            elif _fusionar_mapeo(conn, fila, otra, hash_nuevo):
+                fusionadas += 1
+            else:
+                pendientes += 1
+
+        conn.executemany(
+            "INSERT OR IGNORE INTO migracion_hash_rut (hash_legado, hash_nuevo) VALUES (?, ?)",
+            equivalencias
+        )
+        conn.commit()
+
+        ultimo_id = filas[-1]['id']
+
+    return actualizadas, fusionadas, pendientes
+
+
+def migrar_historial(conn, tamano_lote=TAMANO_LOTE):
+    """Rehashea historial_consultas (descifrando, o por equivalencia si no hay RUT cifrado)."""
+    ultimo_id, actualizadas = 0, 0
+    while True:
+        filas = conn.execute('''
+            SELECT h.id, h.rut_paciente_cifrado, h.rut_paciente_hash, e.hash_nuevo
+            FROM historial_consultas h
+            LEFT JOIN migracion_hash_rut e ON e.hash_legado = h.rut_paciente_hash
+            WHERE h.id > ? ORDER BY h.id LIMIT ?
+        ''', (ultimo_id, tamano_lote)).fetchall()
+        if not filas:
+            break
+
+        cambios = []
+        for fila in filas:
+            if fila['hash_nuevo']:
+                cambios.append((fila['hash_nuevo'], fila['id']))
+                continue
+            resultado = _nuevo_hash_desde_cifrado(fila['rut_paciente_cifrado'], fila['rut_paciente_hash'])
+            if resultado:
+                cambios.append((resultado[1], fila['id']))
+
+        conn.executemany("UPDATE historial_consultas SET rut_paciente_hash = ? WHERE id = ?", cambios)
+        conn.commit()
+
+        actualizadas += len(cambios)
+        ultimo_id = filas[-1]['id']
+
+    return actualizadas
+
+
+def migrar_consultas(conn, tamano_lote=TAMANO_LOTE):
+    """Rehashea consultas usando la equivalencia construida desde mapeo_pacientes."""
+    ultimo_id, actualizadas = 0, 0
+    maximo = conn.execute("SELECT COALESCE(MAX(id), 0) FROM consultas").fetchone()[0]
+    while ultimo_id < maximo:
+        cursor = conn.execute('''
+            UPDATE consultas
+            SET rut_paciente_hash = (
+                SELECT hash_nuevo FROM migracion_hash_rut
+                WHERE hash_legado = consultas.rut_paciente_hash
+            )
+            WHERE id > ? AND id <= ?
+              AND rut_paciente_hash IN (SELECT hash_legado FROM migracion_hash_rut)
+        ''', (ultimo_id, ultimo_id + tamano_lote))
+        conn.commit()
+        actualizadas += cursor.rowcount
+        ultimo_id += tamano_lote
+
+    return actualizadas
+
+
+def crear_indices(conn):
+    """Índices de búsqueda por hash de RUT"""
+    indices = [
+        ("idx_mapeo_pacientes_rut_hash_cip", "mapeo_pacientes", "rut_hash, id, cip"),
+        ("idx_consultas_rut_hash", "consultas", "rut_paciente_hash"),
+        ("idx_historial_rut_hash", "historial_consultas", "rut_paciente_hash"),
+    ]
+    for nombre, tabla, columnas in indices:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla}({columnas})")
+        print(f"   [OK] Indice '{nombre}' creado")
+    conn.execute("DROP INDEX IF EXISTS idx_mapeo_pacientes_rut_hash")
+    # Un paciente = un CIP, ahora que todos los hashes son HMAC
+    if crear_indice_rut_hash_unico(conn):
+        print("   [OK] Indice unico 'idx_mapeo_pacientes_rut_hash_unico' disponible")
+    else:
+        print("   [AVISO] mapeo_pacientes tiene RUT con mas de un CIP: ejecute")
+        print("           migrations/compactar_mapeo_pacientes.py")
+    conn.commit()
+
+
+def ejecutar_migracion():
+    """Ejecuta la migración de Fase 3"""
+
+    print("")
+    print("=" * 60)
+    print("   MIGRACION FASE 3 - HASH DE RUT CON HMAC")
+    print("=" * 60)
+    print("")
+
+    if not os.environ.get('RUT_HASH_KEY') or not os.environ.get('ENCRYPTION_KEY'):
+        print("[ERROR] RUT_HASH_KEY y ENCRYPTION_KEY deben estar configuradas en .env")
+        return False
+
+    # 1. Crear backup
+    print("[1] Creando backup de seguridad...")
+    if not crear_backup_pre_migracion():
+        return False
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+
+    try:
+        print("")
+        print("[2] Recalculando hash en mapeo_pacientes...")
+        actualizadas, fusionadas, pendientes = migrar_mapeo(conn)
+        print(f"   [OK] {actualizadas} filas actualizadas, {fusionadas} fusionadas con su CIP en HMAC")
+
+        print("")
+        print("[3] Recalculando hash en historial_consultas...")
+        print(f"   [OK] {migrar_historial(conn)} filas actualizadas")
+
+        print("")
+        print("[4] Recalculando hash en consultas...")
+        print(f"   [OK] {migrar_consultas(conn)} filas actualizadas")
+
+        print("")
+        print("[5] Creando indices de busqueda...")
+        crear_indices(conn)
+
+        if pendientes:
+            # Se conserva la tabla de equivalencias para la próxima ejecución
+            print("")
+            print(f"[AVISO] {pendientes} pacientes tienen dos CIP en consultas activas:")
+            print("        vuelva a ejecutar la migracion cuando terminen")
+            return False
+
+        # La tabla de equivalencias permite reanudar; ya no se necesita
+        conn.execute("DROP TABLE IF EXISTS migracion_hash_rut")
+        conn.commit()
+
+        print("")
+        print("=" * 60)
+        print("   [OK] MIGRACION FASE 3 COMPLETADA EXITOSAMENTE")
+        print("=" * 60)
+        print("")
+        print("IMPORTANTE:")
+        print("  1. Reinicia el servidor Flask")
+        print("  2. Respalde RUT_HASH_KEY junto a ENCRYPTION_KEY: sin ella")
+        print("     no es posible buscar pacientes por RUT")
+        print("")
+
+        return True
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Error en migracion: {e}")
+        print("   Los lotes ya confirmados se conservan; vuelva a ejecutar")
+        print("   el script para continuar.")
+        return False
+
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print("")
+    print("TELEMEDICINA - Script de Migracion Fase 3")
+    print("")
+
+    respuesta = input("Desea ejecutar la migracion Fase 3? (s/n): ").strip().lower()
+
+    if respuesta == 's':
+        ejecutar_migracion()
+    else:
+        print("Migracion cancelada.")
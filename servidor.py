@@ -0,0 +1,55 @@
+"""
+TELEMEDICINA - Servidor de producción
+Uso: python servidor.py
+
+- Con gunicorn instalado (Linux): varios workers según
+  gunicorn.conf.py
+- Si no (Windows): waitress, un proceso con WEB_THREADS hilos
+No usar app.run() (servidor de desarrollo de Flask) en producción.
+"""
+import importlib.util
+import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def _con_gunicorn():
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ['gunicorn', '-c', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')]
+    run()
+
+
+def _con_waitress():
+    from waitress import serve
+
+    from app import create_app
+    from utils.procesos import detener_tareas_segundo_plano, iniciar_tareas_segundo_plano
+
+    aplicacion = create_app()
+    iniciar_tareas_segundo_plano()
+
+    def apagar(signum, frame):
+        drenaje = int(os.environ.get('WEB_DRENAJE_SEGUNDOS', 30))
+        print(f"[SERVIDOR] Señal {signum}: terminando mantenimiento en curso (máx. {drenaje} s)")
+        detener_tareas_segundo_plano(timeout=drenaje)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, apagar)
+    serve(
+        aplicacion,
+        host=os.environ.get('WEB_HOST', '0.0.0.0'),
+        port=int(os.environ.get('WEB_PUERTO', 5000)),
+        threads=int(os.environ.get('WEB_THREADS', 8)),
+    )
+
+
+if __name__ == '__main__':
+    if sys.platform != 'win32' and importlib.util.find_spec('gunicorn'):
+        _con_gunicorn()
+    elif importlib.util.find_spec('waitress'):
+        _con_waitress()
+    else:
+        sys.exit("Instala gunicorn (Linux) o waitress (Windows): pip install gunicorn waitress")
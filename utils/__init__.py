@@ -16,8 +16,13 @@ from .seguridad import (
     normalizar_rut,
     enmascarar_rut,
     hashear_rut,
+    hashear_rut_legado,
+    RutParseado,
+    parsear_rut,
+    validar_ruts_lote,
     # Cifrado AES-256-GCM (Ley 19.628)
     cifrar_rut,
+    cifrar_ruts_lote,
     descifrar_rut,
     # CIP - Código de Identificación de Paciente
     generar_cip,
@@ -37,10 +42,66 @@ from .aprobaciones import (
     obtener_descripcion_accion,
     # Gestión de solicitudes
     crear_solicitud,
+    crear_solicitudes_lote,
     obtener_solicitudes_pendientes,
     obtener_solicitudes_usuario,
     contar_solicitudes_pendientes,
+    contar_solicitudes_pendientes_por_tipo,
     aprobar_solicitud,
     rechazar_solicitud,
+    resolver_solicitudes_lote,
+    # Vencimiento y archivo
+    vencer_solicitudes_pendientes,
+    archivar_solicitudes_resueltas,
 )
 
+
+from .pacientes import (
+    # Identidad de pacientes (CIP)
+    buscar_cip_por_rut_hash,
+    obtener_o_registrar_paciente,
+)
+
+from .referencias import (
+    # Caché de datos de referencia (lugares, usuarios)
+    obtener_lugares,
+    obtener_lugar,
+    obtener_usuarios,
+    invalidar_referencias,
+    version_referencias,
+    estadisticas_cache_referencias,
+)
+
+from .fragmentos import (
+    # Caché de fragmentos HTML y respuestas JSON condicionales
+    fragmento,
+    json_condicional,
+    estadisticas_fragmentos,
+)
+
+from .consultas import (
+    # Ciclo de vida de consultas
+    archivar_consulta,
+    obtener_pacientes_espera,
+    obtener_estado_consulta,
+)
+
+from .estadisticas import (
+    # Resumen diario de atenciones
+    obtener_resumen_medico_hoy,
+    reconstruir_estadisticas_diarias,
+)
+
+from .analitica import (
+    # Analítica operacional (agregados materializados)
+    refrescar_analitica,
+    reconstruir_analitica,
+    obtener_analitica,
+)
+
+from .sesiones import (
+    # Sesiones en el servidor (revocables)
+    configurar_sesiones,
+    revocar_sesiones_usuarios,
+    purgar_sesiones_vencidas,
+)
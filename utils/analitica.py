@@ -0,0 +1,251 @@
+# ==========================================
+# MÓDULO DE ANALÍTICA - TELEMEDICINA
+# ==========================================
+# Agregados materializados sobre historial_consultas,
+# refrescados de forma incremental (marca de último id):
+# - analitica_posta_hora: consultas por posta y hora local
+# - analitica_cuantiles: histogramas logarítmicos (espera y
+#   duración, en segundos) por posta, para percentiles con
+#   error relativo acotado sin leer el historial
+# Ambas tablas guardan cada período a nivel de día y de mes:
+# un rango usa los meses completos que contiene y los días
+# sueltos de los extremos.
+# La carga por médico sale de estadisticas_diarias.
+# ==========================================
+
+import math
+import os
+from collections import Counter
+from datetime import date, timedelta
+
+ANALITICA_LOTE = int(os.environ.get('ANALITICA_LOTE', 5000))
+# Meses que puede abarcar una consulta (acota el IN (...) de los meses completos)
+ANALITICA_MAX_MESES = int(os.environ.get('ANALITICA_MAX_MESES', 36))
+
+# Error relativo máximo de los percentiles (1%). Fija: cambiarla exige
+# reconstruir_analitica(), porque redefine los cubos ya guardados.
+PRECISION_CUANTILES = 0.01
+
+_GAMMA = (1 + PRECISION_CUANTILES) / (1 - PRECISION_CUANTILES)
+_LOG_GAMMA = math.log(_GAMMA)
+
+METRICAS = ('espera', 'duracion')
+CUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+_MARCA_HISTORIAL = 'ultimo_historial_id'
+
+# Fechas en UTC; día y hora en hora local
+_SQL_NUEVAS = '''
+    SELECT id, nombre_posta,
+           DATE(COALESCE(fecha_inicio, fecha_fin), 'localtime') AS dia,
+           CAST(strftime('%H', COALESCE(fecha_inicio, fecha_fin), 'localtime') AS INTEGER) AS hora,
+           (julianday(fecha_atencion) - julianday(fecha_inicio)) * 86400 AS espera,
+           (julianday(fecha_fin) - julianday(fecha_inicio)) * 86400 AS duracion
+    FROM historial_consultas
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+
+def _cubo(segundos):
+    """Índice del cubo logarítmico; 0 agrupa los valores menores a 1 segundo."""
+    if segundos < 1:
+        return 0
+    return math.ceil(math.log(segundos) / _LOG_GAMMA) + 1
+
+
+def _valor_cubo(cubo):
+    """Valor representativo del cubo (error relativo <= PRECISION_CUANTILES)."""
+    if cubo == 0:
+        return 0.0
+    return 2 * _GAMMA ** (cubo - 1) / (_GAMMA + 1)
+
+
+def _cuantiles(conteos, cuantiles=CUANTILES):
+    """
+    Percentiles a partir de un histograma {cubo: conteo}.
+
+    Returns:
+        dict: n y p50/p90/... en segundos (None si no hay datos)
+    """
+    n = sum(conteos.values())
+    resultado = {'n': n}
+    acumulado, cubos = 0, sorted(conteos.items())
+    indice = 0
+    for q in cuantiles:
+        clave = f"p{round(q * 100):g}"
+        if not n:
+            resultado[clave] = None
+            continue
+        objetivo = q * (n - 1)
+        while acumulado + cubos[indice][1] <= objetivo:
+            acumulado += cubos[indice][1]
+            indice += 1
+        resultado[clave] = round(_valor_cubo(cubos[indice][0]), 1)
+    return resultado
+
+
+def refrescar_analitica(conn, tamano_lote=None):
+    """
+    Incorpora a los agregados las consultas del historial posteriores a la
+    última marca, por lotes de una transacción cada uno.
+
+    Returns:
+        int: consultas incorporadas
+    """
+    tamano_lote = tamano_lote or ANALITICA_LOTE
+    total = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            fila = conn.execute(
+                'SELECT valor FROM analitica_marcas WHERE clave = ?', (_MARCA_HISTORIAL,)
+            ).fetchone()
+            marca = fila[0] if fila else 0
+            filas = conn.execute(_SQL_NUEVAS, (marca, tamano_lote)).fetchall()
+            if not filas:
+                conn.rollback()
+                return total
+
+            por_hora, por_cubo = Counter(), Counter()
+            for f in filas:
+                periodos = (('dia', f['dia']), ('mes', f['dia'][:7]))
+                cubos = [(metrica, _cubo(f[metrica])) for metrica in METRICAS
+                         if f[metrica] is not None and f[metrica] >= 0]
+                for nivel, periodo in periodos:
+                    por_hora[(nivel, periodo, f['nombre_posta'], f['hora'])] += 1
+                    for metrica, cubo in cubos:
+                        por_cubo[(metrica, nivel, periodo, f['nombre_posta'], cubo)] += 1
+
+            conn.executemany('''
+                INSERT INTO analitica_posta_hora (nivel, periodo, nombre_posta, hora, total)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (nivel, periodo, nombre_posta, hora)
+                DO UPDATE SET total = total + excluded.total
+            ''', [clave + (conteo,) for clave, conteo in por_hora.items()])
+            conn.executemany('''
+                INSERT INTO analitica_cuantiles (metrica, nivel, periodo, nombre_posta, cubo, conteo)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (metrica, nivel, periodo, nombre_posta, cubo)
+                DO UPDATE SET conteo = conteo + excluded.conteo
+            ''', [clave + (conteo,) for clave, conteo in por_cubo.items()])
+            conn.execute('''
+                INSERT INTO analitica_marcas (clave, valor) VALUES (?, ?)
+                ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor
+            ''', (_MARCA_HISTORIAL, filas[-1]['id']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += len(filas)
+        if len(filas) < tamano_lote:
+            return total
+
+
+def reconstruir_analitica(conn):
+    """Vacía los agregados y los recalcula desde todo el historial."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM analitica_posta_hora')
+        conn.execute('DELETE FROM analitica_cuantiles')
+        conn.execute('DELETE FROM analitica_marcas WHERE clave = ?', (_MARCA_HISTORIAL,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return refrescar_analitica(conn)
+
+
+def _periodos_rango(desde, hasta):
+    """
+    Separa [desde, hasta] en meses completos y tramos de días sueltos.
+
+    Returns:
+        list: condiciones (sql, parametros) sobre nivel/periodo, una por tramo
+
+    Raises:
+        ValueError: si el rango abarca más de ANALITICA_MAX_MESES meses
+    """
+    inicio, fin = date.fromisoformat(desde), date.fromisoformat(hasta)
+    if (fin.year - inicio.year) * 12 + fin.month - inicio.month >= ANALITICA_MAX_MESES:
+        raise ValueError(f"El rango no puede abarcar mas de {ANALITICA_MAX_MESES} meses")
+    meses, condiciones = [], []
+    dia = inicio
+    while dia <= fin:
+        siguiente_mes = (dia.replace(day=28) + timedelta(days=4)).replace(day=1)
+        fin_mes = siguiente_mes - timedelta(days=1)
+        if dia.day == 1 and fin_mes <= fin:
+            meses.append(dia.strftime('%Y-%m'))
+        else:
+            condiciones.append((
+                "nivel = 'dia' AND periodo BETWEEN ? AND ?",
+                [dia.isoformat(), min(fin_mes, fin).isoformat()]
+            ))
+        dia = siguiente_mes
+    if meses:
+        condiciones.append((f"nivel = 'mes' AND periodo IN ({','.join('?' * len(meses))})", meses))
+    return condiciones
+
+
+def _sumar_por_rango(conn, tabla, columnas, valor, desde, hasta, filtros=()):
+    """
+    SUM(valor) agrupado por `columnas` sobre el rango, con una subconsulta
+    por tramo (cada una usa la clave primaria) unidas con UNION ALL.
+    """
+    extra = ''.join(f' AND {columna} = ?' for columna, _ in filtros)
+    valores_extra = [v for _, v in filtros]
+    partes, parametros = [], []
+    for condicion, valores in _periodos_rango(desde, hasta):
+        partes.append(f'SELECT {columnas}, {valor} AS valor FROM {tabla} WHERE {condicion}{extra}')
+        parametros.extend(valores + valores_extra)
+    if not partes:
+        return []
+    return conn.execute(f'''
+        SELECT {columnas}, SUM(valor) AS total
+        FROM ({' UNION ALL '.join(partes)})
+        GROUP BY {columnas}
+        ORDER BY {columnas}
+    ''', parametros).fetchall()
+
+
+def obtener_analitica(conn, desde, hasta, nombre_posta=None):
+    """
+    Métricas operacionales entre dos días locales (inclusive, 'YYYY-MM-DD'),
+    tal como las dejó el último refresco (ver refrescar_analitica()).
+
+    Returns:
+        dict: por_posta_hora, espera y duracion (percentiles en segundos),
+              carga_medicos
+    """
+    filtro_posta = (('nombre_posta', nombre_posta),) if nombre_posta else ()
+
+    resultado = {
+        'desde': desde,
+        'hasta': hasta,
+        'posta': nombre_posta,
+        'por_posta_hora': [
+            {'posta': f['nombre_posta'], 'hora': f['hora'], 'total': f['total']}
+            for f in _sumar_por_rango(conn, 'analitica_posta_hora', 'nombre_posta, hora', 'total',
+                                      desde, hasta, filtro_posta)
+        ],
+    }
+
+    for metrica in METRICAS:
+        conteos = {f['cubo']: f['total'] for f in _sumar_por_rango(
+            conn, 'analitica_cuantiles', 'cubo', 'conteo', desde, hasta,
+            (('metrica', metrica),) + filtro_posta
+        )}
+        resultado[metrica] = _cuantiles(conteos)
+
+    filtro_medicos = ' AND nombre_posta = ?' if nombre_posta else ''
+    resultado['carga_medicos'] = [dict(f) for f in conn.execute(f'''
+        SELECT nombre_medico AS medico, SUM(total) AS total,
+               ROUND(SUM(duracion_total) * 1.0 / SUM(total), 1) AS duracion_promedio
+        FROM estadisticas_diarias
+        WHERE dia BETWEEN ? AND ?{filtro_medicos}
+        GROUP BY nombre_medico
+        ORDER BY total DESC
+    ''', (desde, hasta) + ((nombre_posta,) if nombre_posta else ()))]
+
+    return resultado
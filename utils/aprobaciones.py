@@ -6,7 +6,11 @@
 # ==========================================
 
 import json
-from .seguridad import obtener_timestamp_chile, enmascarar_rut
+import os
+from datetime import timedelta
+from .seguridad import obtener_fecha_hora_chile, obtener_timestamp_chile, enmascarar_rut
+from .referencias import invalidar_referencias
+from .sesiones import revocar_sesiones_usuarios
 
 # Tipos de acciones que requieren aprobación
 ACCIONES_REQUIEREN_APROBACION = {
@@ -43,6 +47,31 @@ ACCIONES_REQUIEREN_APROBACION = {
 }
 
 
+# Vencimiento de solicitudes pendientes según nivel_riesgo (horas, 0 = nunca):
+# primero se escalan (destacadas en el panel del Admin Maestro) y más tarde
+# expiran (estado 'expirada', la acción no se ejecuta)
+PLAZOS_SOLICITUDES = {
+    'alto': {
+        'escalar': int(os.environ.get('SOLICITUD_ESCALAR_HORAS_ALTO', 24)),
+        'expirar': int(os.environ.get('SOLICITUD_EXPIRAR_HORAS_ALTO', 168)),
+    },
+    'medio': {
+        'escalar': int(os.environ.get('SOLICITUD_ESCALAR_HORAS_MEDIO', 72)),
+        'expirar': int(os.environ.get('SOLICITUD_EXPIRAR_HORAS_MEDIO', 336)),
+    },
+}
+# Días tras su resolución en que una solicitud pasa a historial_solicitudes
+SOLICITUD_ARCHIVO_DIAS = int(os.environ.get('SOLICITUD_ARCHIVO_DIAS', 30))
+SOLICITUD_ARCHIVO_LOTE = int(os.environ.get('SOLICITUD_ARCHIVO_LOTE', 500))
+
+_COLUMNAS_SOLICITUD = '''
+    id, tipo_accion, entidad_tipo, entidad_id, solicitante_id, solicitante_nombre,
+    solicitante_rol, datos_originales, datos_nuevos, justificacion, estado,
+    aprobador_id, aprobador_nombre, motivo_resolucion, fecha_solicitud,
+    fecha_escalada, fecha_resolucion
+'''
+
+
 def requiere_aprobacion(rol_usuario, tipo_accion):
     """
     Determina si una acción requiere aprobación según el rol.
@@ -100,51 +129,221 @@ def crear_solicitud(conn, tipo_accion, entidad_tipo, entidad_id,
         return None
 
 
-def obtener_solicitudes_pendientes(conn, limite=50):
+def crear_solicitudes_lote(conn, tipo_accion, entidad_tipo, entidades,
+                           solicitante_id, solicitante_nombre, solicitante_rol,
+                           justificacion=None):
+    """
+    Crea una solicitud de aprobación por entidad con un solo executemany.
+    La transacción la confirma quien llama.
+
+    Args:
+        entidades: lista de (entidad_id, datos_originales)
+
+    Returns:
+        list: IDs de las solicitudes creadas (mismo orden que entidades),
+              o lista vacía si hay error
     """
-    Obtiene todas las solicitudes pendientes de aprobación.
+    if not entidades:
+        return []
+    try:
+        fecha = obtener_timestamp_chile()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO solicitudes_aprobacion (
+                tipo_accion, entidad_tipo, entidad_id,
+                datos_originales, solicitante_id, solicitante_nombre, solicitante_rol,
+                justificacion, estado, fecha_solicitud
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pendiente', ?)
+        ''', [(
+            tipo_accion, entidad_tipo, str(entidad_id),
+            json.dumps(datos_originales, default=str) if datos_originales else None,
+            solicitante_id, solicitante_nombre, solicitante_rol,
+            justificacion, fecha
+        ) for entidad_id, datos_originales in entidades])
+
+        # Desde la primera fila la transacción tiene el bloqueo de escritura:
+        # los ids (AUTOINCREMENT) asignados son consecutivos hasta el último
+        ultimo_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return list(range(ultimo_id - len(entidades) + 1, ultimo_id + 1))
+
+    except Exception as e:
+        print(f"[APROBACIONES] Error al crear solicitudes: {e}")
+        return []
+
+
+def obtener_solicitudes_pendientes(conn, limite=50, tipo_accion=None):
+    """
+    Obtiene las solicitudes pendientes de aprobación, más recientes primero
+    (índices parciales idx_solicitudes_pendientes*).
+    
+    Args:
+        tipo_accion: Si se indica, solo las de ese tipo
     
     Returns:
         List: Lista de solicitudes pendientes
     """
-    solicitudes = conn.execute('''
+    filtro_tipo = ' AND tipo_accion = ?' if tipo_accion else ''
+    solicitudes = conn.execute(f'''
         SELECT * FROM solicitudes_aprobacion 
-        WHERE estado = 'pendiente'
+        WHERE estado = 'pendiente'{filtro_tipo}
         ORDER BY fecha_solicitud DESC
         LIMIT ?
-    ''', (limite,)).fetchall()
+    ''', ((tipo_accion,) if tipo_accion else ()) + (limite,)).fetchall()
     
     return solicitudes
 
 
 def obtener_solicitudes_usuario(conn, usuario_id, limite=20):
     """
-    Obtiene las solicitudes creadas por un usuario específico.
+    Obtiene las solicitudes creadas por un usuario específico
+    (incluidas las ya archivadas en historial_solicitudes).
     """
-    solicitudes = conn.execute('''
-        SELECT * FROM solicitudes_aprobacion 
-        WHERE solicitante_id = ?
+    solicitudes = conn.execute(f'''
+        SELECT {_COLUMNAS_SOLICITUD} FROM solicitudes_aprobacion WHERE solicitante_id = ?
+        UNION ALL
+        SELECT {_COLUMNAS_SOLICITUD} FROM historial_solicitudes WHERE solicitante_id = ?
         ORDER BY fecha_solicitud DESC
         LIMIT ?
-    ''', (usuario_id, limite)).fetchall()
+    ''', (usuario_id, usuario_id, limite)).fetchall()
     
     return solicitudes
 
 
 def contar_solicitudes_pendientes(conn):
     """
-    Cuenta el número de solicitudes pendientes.
+    Cuenta el número de solicitudes pendientes (contador mantenido por
+    triggers en solicitudes_pendientes_conteo, sin recorrer las solicitudes).
     
     Returns:
         int: Número de solicitudes pendientes
     """
     resultado = conn.execute(
-        "SELECT COUNT(*) as total FROM solicitudes_aprobacion WHERE estado = 'pendiente'"
+        "SELECT COALESCE(SUM(total), 0) as total FROM solicitudes_pendientes_conteo"
     ).fetchone()
     
     return resultado['total'] if resultado else 0
 
 
+def contar_solicitudes_pendientes_por_tipo(conn):
+    """
+    Cuenta las solicitudes pendientes por tipo de acción.
+    
+    Returns:
+        dict: {tipo_accion: cantidad}, de mayor a menor
+    """
+    filas = conn.execute('''
+        SELECT tipo_accion, total FROM solicitudes_pendientes_conteo
+        WHERE total > 0
+        ORDER BY total DESC
+    ''').fetchall()
+    
+    return {f['tipo_accion']: f['total'] for f in filas}
+
+
+def _tipos_por_nivel():
+    """{nivel_riesgo: [tipo_accion, ...]} según ACCIONES_REQUIEREN_APROBACION."""
+    tipos = {}
+    for tipo_accion, accion in ACCIONES_REQUIEREN_APROBACION.items():
+        tipos.setdefault(accion['nivel_riesgo'], []).append(tipo_accion)
+    return tipos
+
+
+def vencer_solicitudes_pendientes(conn):
+    """
+    Escala y expira las solicitudes pendientes que superan los plazos de su
+    nivel de riesgo (PLAZOS_SOLICITUDES), en una transacción.
+    
+    Returns:
+        tuple: (escaladas, expiradas) - listas de (id, tipo_accion)
+    """
+    ahora = obtener_fecha_hora_chile()
+    fecha_actual = ahora.strftime('%Y-%m-%d %H:%M:%S')
+    escaladas, expiradas = [], []
+    
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for nivel, tipos in _tipos_por_nivel().items():
+            plazos = PLAZOS_SOLICITUDES.get(nivel, {})
+            marcadores = ','.join('?' * len(tipos))
+            
+            # Primero expirar, para no escalar lo que ya venció
+            for etapa, resultado in (('expirar', expiradas), ('escalar', escaladas)):
+                if not plazos.get(etapa):
+                    continue
+                limite = (ahora - timedelta(hours=plazos[etapa])).strftime('%Y-%m-%d %H:%M:%S')
+                condicion = f'''
+                    estado = 'pendiente' AND tipo_accion IN ({marcadores}) AND fecha_solicitud < ?
+                    {'AND fecha_escalada IS NULL' if etapa == 'escalar' else ''}
+                '''
+                # Misma condición para leer y actualizar (transacción exclusiva)
+                filas = conn.execute(
+                    f'SELECT id, tipo_accion FROM solicitudes_aprobacion WHERE {condicion}',
+                    tipos + [limite]
+                ).fetchall()
+                if not filas:
+                    continue
+                
+                if etapa == 'expirar':
+                    conn.execute(f'''
+                        UPDATE solicitudes_aprobacion
+                        SET estado = 'expirada', fecha_resolucion = ?, motivo_resolucion = ?
+                        WHERE {condicion}
+                    ''', [fecha_actual, f"Expirada sin resolver en {plazos['expirar']} h"] + tipos + [limite])
+                else:
+                    conn.execute(
+                        f'UPDATE solicitudes_aprobacion SET fecha_escalada = ? WHERE {condicion}',
+                        [fecha_actual] + tipos + [limite]
+                    )
+                resultado.extend((f['id'], f['tipo_accion']) for f in filas)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return escaladas, expiradas
+
+
+def archivar_solicitudes_resueltas(conn, dias=None, tamano_lote=None):
+    """
+    Mueve a historial_solicitudes las solicitudes resueltas hace más de
+    `dias` días, por lotes de una transacción cada uno.
+    
+    Returns:
+        int: solicitudes archivadas
+    """
+    dias = SOLICITUD_ARCHIVO_DIAS if dias is None else dias
+    tamano_lote = tamano_lote or SOLICITUD_ARCHIVO_LOTE
+    limite = (obtener_fecha_hora_chile() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    total = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [f['id'] for f in conn.execute('''
+                SELECT id FROM solicitudes_aprobacion
+                WHERE fecha_resolucion < ? AND estado != 'pendiente'
+                LIMIT ?
+            ''', (limite, tamano_lote)).fetchall()]
+            if not ids:
+                conn.rollback()
+                return total
+            
+            marcadores = ','.join('?' * len(ids))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO historial_solicitudes ({_COLUMNAS_SOLICITUD})
+                SELECT {_COLUMNAS_SOLICITUD} FROM solicitudes_aprobacion WHERE id IN ({marcadores})
+            ''', ids)
+            conn.execute(f'DELETE FROM solicitudes_aprobacion WHERE id IN ({marcadores})', ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += len(ids)
+        if len(ids) < tamano_lote:
+            return total
+
+
 def aprobar_solicitud(conn, solicitud_id, aprobador_id, aprobador_nombre, motivo=None):
     """
     Aprueba una solicitud y ejecuta la acción correspondiente.
@@ -233,6 +432,168 @@ def rechazar_solicitud(conn, solicitud_id, aprobador_id, aprobador_nombre, motiv
         return False, f"Error al rechazar: {str(e)}"
 
 
+def _ejecutar_eliminaciones_usuarios(conn, solicitudes):
+    """
+    eliminar_usuario en bloque: una lectura, las mismas verificaciones que
+    ejecutar_accion_aprobada() (en orden) y un solo DELETE.
+    
+    Returns:
+        dict: {solicitud_id: (exito, mensaje)}
+    """
+    ids = [s['entidad_id'] for s in solicitudes]
+    roles = {str(u['id']): u['rol'] for u in conn.execute(
+        f"SELECT id, rol FROM usuarios WHERE id IN ({','.join('?' * len(ids))})", ids
+    ).fetchall()}
+    total_maestros = conn.execute(
+        "SELECT COUNT(*) as total FROM usuarios WHERE rol = 'admin_maestro'"
+    ).fetchone()['total']
+    
+    resultados, eliminar = {}, []
+    for solicitud in solicitudes:
+        entidad_id = solicitud['entidad_id']
+        if roles.get(entidad_id) == 'admin_maestro':
+            # Verificar que no sea el único admin_maestro
+            if total_maestros <= 1:
+                resultados[solicitud['id']] = (False, "No se puede eliminar al unico Admin Maestro")
+                continue
+            total_maestros -= 1
+        eliminar.append(entidad_id)
+        resultados[solicitud['id']] = (True, "Usuario eliminado exitosamente")
+    
+    if eliminar:
+        conn.execute(f"DELETE FROM usuarios WHERE id IN ({','.join('?' * len(eliminar))})", eliminar)
+        invalidar_referencias(conn, 'usuarios')
+        revocar_sesiones_usuarios(conn, eliminar)
+    return resultados
+
+
+def _ejecutar_eliminaciones_lugares(conn, solicitudes):
+    """
+    eliminar_lugar en bloque: una lectura, sin postas plantilla y un solo DELETE.
+    
+    Returns:
+        dict: {solicitud_id: (exito, mensaje)}
+    """
+    ids = [s['entidad_id'] for s in solicitudes]
+    plantillas = {str(l['id']) for l in conn.execute(
+        f"SELECT id FROM lugares WHERE id IN ({','.join('?' * len(ids))}) AND es_plantilla",
+        ids
+    ).fetchall()}
+    
+    resultados, eliminar = {}, []
+    for solicitud in solicitudes:
+        # Verificar que no sea plantilla
+        if solicitud['entidad_id'] in plantillas:
+            resultados[solicitud['id']] = (False, "No se puede eliminar una posta plantilla")
+            continue
+        eliminar.append(solicitud['entidad_id'])
+        resultados[solicitud['id']] = (True, "Lugar eliminado exitosamente")
+    
+    if eliminar:
+        conn.execute(f"DELETE FROM lugares WHERE id IN ({','.join('?' * len(eliminar))})", eliminar)
+        invalidar_referencias(conn, 'lugares')
+    return resultados
+
+
+def _ejecutar_por_solicitud(conn, solicitudes):
+    """
+    Tipos sin versión en bloque: una acción por solicitud, cada una en su
+    SAVEPOINT para que un error no deshaga las demás.
+    
+    Returns:
+        dict: {solicitud_id: (exito, mensaje)}
+    """
+    resultados = {}
+    for solicitud in solicitudes:
+        conn.execute('SAVEPOINT solicitud')
+        resultado = ejecutar_accion_aprobada(conn, solicitud) or (
+            False, f"Tipo de accion no implementado: {solicitud['tipo_accion']}"
+        )
+        if not resultado[0]:
+            conn.execute('ROLLBACK TO solicitud')
+        conn.execute('RELEASE solicitud')
+        resultados[solicitud['id']] = resultado
+    return resultados
+
+
+# Ejecución en bloque por tipo de acción (clave: tipo_accion, entidad_tipo)
+_EJECUTORES_LOTE = {
+    ('eliminar_usuario', 'usuario'): _ejecutar_eliminaciones_usuarios,
+    ('eliminar_lugar', 'lugar'): _ejecutar_eliminaciones_lugares,
+}
+
+
+def resolver_solicitudes_lote(conn, solicitud_ids, aprobar, aprobador_id, aprobador_nombre,
+                              motivo=None):
+    """
+    Aprueba o rechaza varias solicitudes. Las aprobadas se ejecutan agrupadas
+    por tipo de acción (eliminaciones con un solo DELETE por tipo).
+    
+    Debe llamarse dentro de una transacción (BEGIN IMMEDIATE); la confirma
+    quien llama, junto con su auditoría.
+    
+    Args:
+        solicitud_ids: IDs de las solicitudes (se responde en el mismo orden)
+        aprobar: True para aprobar, False para rechazar
+    
+    Returns:
+        list: dicts {'id', 'exito', 'mensaje', 'tipo_accion'} por solicitud
+    """
+    solicitud_ids = list(dict.fromkeys(solicitud_ids))
+    if not solicitud_ids:
+        return []
+    
+    solicitudes = {s['id']: s for s in conn.execute(
+        f"SELECT * FROM solicitudes_aprobacion WHERE id IN ({','.join('?' * len(solicitud_ids))})",
+        solicitud_ids
+    ).fetchall()}
+    
+    resultados = {}
+    pendientes_por_tipo = {}
+    for solicitud_id in solicitud_ids:
+        solicitud = solicitudes.get(solicitud_id)
+        if not solicitud:
+            resultados[solicitud_id] = (False, "Solicitud no encontrada")
+        elif solicitud['estado'] != 'pendiente':
+            resultados[solicitud_id] = (False, f"La solicitud ya fue {solicitud['estado']}")
+        else:
+            clave = (solicitud['tipo_accion'], solicitud['entidad_tipo'])
+            pendientes_por_tipo.setdefault(clave, []).append(solicitud)
+    
+    if aprobar:
+        for clave, grupo in pendientes_por_tipo.items():
+            ejecutor = _EJECUTORES_LOTE.get(clave, _ejecutar_por_solicitud)
+            resultados.update(ejecutor(conn, grupo))
+    else:
+        for grupo in pendientes_por_tipo.values():
+            resultados.update({s['id']: (True, "Solicitud rechazada") for s in grupo})
+    
+    resueltas = [solicitud_id for solicitud_id, (exito, _) in resultados.items()
+                 if exito and solicitud_id in solicitudes]
+    if resueltas:
+        conn.execute(f'''
+            UPDATE solicitudes_aprobacion 
+            SET estado = ?,
+                aprobador_id = ?,
+                aprobador_nombre = ?,
+                fecha_resolucion = ?,
+                motivo_resolucion = ?
+            WHERE id IN ({','.join('?' * len(resueltas))}) AND estado = 'pendiente'
+        ''', [
+            'aprobada' if aprobar else 'rechazada',
+            aprobador_id, aprobador_nombre,
+            obtener_timestamp_chile(),
+            motivo or ('Aprobada' if aprobar else 'Rechazada sin motivo especificado'),
+        ] + resueltas)
+    
+    return [{
+        'id': solicitud_id,
+        'exito': resultados[solicitud_id][0],
+        'mensaje': resultados[solicitud_id][1],
+        'tipo_accion': solicitudes[solicitud_id]['tipo_accion'] if solicitud_id in solicitudes else None,
+    } for solicitud_id in solicitud_ids]
+
+
 def ejecutar_accion_aprobada(conn, solicitud):
     """
     Ejecuta la acción de una solicitud aprobada.
@@ -261,6 +622,8 @@ def ejecutar_accion_aprobada(conn, solicitud):
                         return False, "No se puede eliminar al unico Admin Maestro"
                 
                 conn.execute("DELETE FROM usuarios WHERE id = ?", (entidad_id,))
+                invalidar_referencias(conn, 'usuarios')
+                revocar_sesiones_usuarios(conn, [entidad_id])
                 return True, "Usuario eliminado exitosamente"
         
         elif tipo_accion == 'eliminar_lugar':
@@ -273,6 +636,7 @@ def ejecutar_accion_aprobada(conn, solicitud):
                 return False, "No se puede eliminar una posta plantilla"
             
             conn.execute("DELETE FROM lugares WHERE id = ?", (entidad_id,))
+            invalidar_referencias(conn, 'lugares')
             return True, "Lugar eliminado exitosamente"
         
         elif tipo_accion == 'eliminar_respaldo':
@@ -306,6 +670,11 @@ def ejecutar_accion_aprobada(conn, solicitud):
                         f"UPDATE usuarios SET {', '.join(campos)} WHERE id = ?",
                         valores
                     )
+                    invalidar_referencias(conn, 'usuarios')
+                    # Las sesiones guardan el rol: un cambio de rol o de estado
+                    # obliga a iniciar sesión de nuevo
+                    if 'rol' in datos_nuevos or 'activo' in datos_nuevos:
+                        revocar_sesiones_usuarios(conn, [entidad_id])
                     return True, "Usuario modificado exitosamente"
             
             return False, "No hay datos para modificar"
@@ -327,6 +696,7 @@ def ejecutar_accion_aprobada(conn, solicitud):
                         f"UPDATE lugares SET {', '.join(campos)} WHERE id = ?",
                         valores
                     )
+                    invalidar_referencias(conn, 'lugares')
                     return True, "Lugar modificado exitosamente"
             
             return False, "No hay datos para modificar"
@@ -2,6 +2,40 @@ import json
 from .seguridad import obtener_timestamp_chile, generar_checksum_registro
 from .database import get_db_connection
 
+_SQL_INSERTAR_AUDITORIA = '''
+    INSERT INTO auditoria (
+        usuario_id, usuario_nombre, usuario_rol, accion, categoria,
+        entidad_tipo, entidad_id, datos_antes, datos_despues,
+        ip_origen, user_agent, resultado, mensaje, fecha, checksum
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _fila_auditoria(fecha, usuario_id, usuario_nombre, usuario_rol, accion, categoria,
+                    resultado, mensaje=None, entidad_tipo=None, entidad_id=None,
+                    datos_antes=None, datos_despues=None, ip_origen=None, user_agent=None):
+    """Parámetros del INSERT de auditoría, con su checksum de integridad."""
+    datos_registro = {
+        'usuario_id': usuario_id,
+        'usuario_nombre': usuario_nombre,
+        'usuario_rol': usuario_rol,
+        'accion': accion,
+        'categoria': categoria,
+        'resultado': resultado,
+        'fecha': fecha,
+        'mensaje': mensaje,
+        'entidad_tipo': entidad_tipo,
+        'entidad_id': entidad_id,
+    }
+    
+    checksum = generar_checksum_registro(datos_registro)
+    
+    return (
+        usuario_id, usuario_nombre, usuario_rol, accion, categoria,
+        entidad_tipo, entidad_id, datos_antes, datos_despues,
+        ip_origen, user_agent, resultado, mensaje, fecha, checksum
+    )
+
 def registrar_auditoria(conn, usuario_id, usuario_nombre, usuario_rol, accion, categoria,
                         resultado, mensaje=None, entidad_tipo=None, entidad_id=None,
                         datos_antes=None, datos_despues=None, ip_origen=None, user_agent=None):
@@ -9,38 +43,39 @@ def registrar_auditoria(conn, usuario_id, usuario_nombre, usuario_rol, accion, c
     Registra una acción en la tabla de auditoría.
     """
     try:
-        fecha = obtener_timestamp_chile()
-        
-        datos_registro = {
-            'usuario_id': usuario_id,
-            'usuario_nombre': usuario_nombre,
-            'usuario_rol': usuario_rol,
-            'accion': accion,
-            'categoria': categoria,
-            'resultado': resultado,
-            'fecha': fecha,
-            'mensaje': mensaje,
-            'entidad_tipo': entidad_tipo,
-            'entidad_id': entidad_id,
-        }
-        
-        checksum = generar_checksum_registro(datos_registro)
-        
-        conn.execute('''
-            INSERT INTO auditoria (
-                usuario_id, usuario_nombre, usuario_rol, accion, categoria,
-                entidad_tipo, entidad_id, datos_antes, datos_despues,
-                ip_origen, user_agent, resultado, mensaje, fecha, checksum
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            usuario_id, usuario_nombre, usuario_rol, accion, categoria,
-            entidad_tipo, entidad_id, datos_antes, datos_despues,
-            ip_origen, user_agent, resultado, mensaje, fecha, checksum
+        conn.execute(_SQL_INSERTAR_AUDITORIA, _fila_auditoria(
+            obtener_timestamp_chile(), usuario_id, usuario_nombre, usuario_rol, accion, categoria,
+            resultado, mensaje, entidad_tipo, entidad_id,
+            datos_antes, datos_despues, ip_origen, user_agent
         ))
         
     except Exception as e:
         print(f"[AUDITORIA] Error al registrar: {e}")
 
+def registrar_auditoria_lote(conn, registros):
+    """
+    Registra varias acciones en la tabla de auditoría con un solo executemany.
+    
+    Args:
+        conn: Conexión (la transacción la confirma quien llama)
+        registros: lista de dicts con los mismos argumentos de registrar_auditoria()
+    
+    Returns:
+        int: registros insertados
+    """
+    if not registros:
+        return 0
+    try:
+        fecha = obtener_timestamp_chile()
+        conn.executemany(_SQL_INSERTAR_AUDITORIA, [
+            _fila_auditoria(fecha, **registro) for registro in registros
+        ])
+        return len(registros)
+        
+    except Exception as e:
+        print(f"[AUDITORIA] Error al registrar lote: {e}")
+        return 0
+
 def obtener_auditoria(limite=100, categoria=None, usuario_id=None):
     """
     Obtiene registros de auditoría con filtros opcionales.
@@ -4,7 +4,7 @@ import glob
 import time
 import threading
 from datetime import datetime
-from .database import DB_PATH
+from .database import ruta_db_actual
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
@@ -12,14 +12,13 @@ BACKUP_HOUR = int(os.environ.get('BACKUP_HOUR', 16))
 BACKUP_MINUTE = int(os.environ.get('BACKUP_MINUTE', 59))
 MAX_BACKUPS = int(os.environ.get('MAX_BACKUPS', 30))
 
-# Asegurar que la carpeta de respaldos existe
-if not os.path.exists(BACKUP_DIR):
-    os.makedirs(BACKUP_DIR)
-
 def crear_respaldo(manual=False):
     """Crea un respaldo de la base de datos"""
-    if not os.path.exists(DB_PATH):
+    ruta_db = ruta_db_actual()
+    if not os.path.exists(ruta_db):
         return None
+    # La carpeta se crea al primer respaldo, no al importar el módulo
+    os.makedirs(BACKUP_DIR, exist_ok=True)
     
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     tipo = 'manual' if manual else 'auto'
@@ -27,7 +26,7 @@ def crear_respaldo(manual=False):
     backup_path = os.path.join(BACKUP_DIR, backup_name)
     
     try:
-        shutil.copy2(DB_PATH, backup_path)
+        shutil.copy2(ruta_db, backup_path)
         limpiar_respaldos_antiguos()
         return backup_name
     except Exception as e:
@@ -67,6 +66,13 @@ def listar_respaldos():
         })
     return result
 
+def version_respaldos():
+    """Versión de la lista de respaldos: cambia al crear, eliminar o renombrar archivos"""
+    try:
+        return os.stat(BACKUP_DIR).st_mtime_ns
+    except OSError:
+        return 0
+
 def respaldo_programado():
     """Hilo para respaldo automático"""
     while True:
@@ -0,0 +1,120 @@
+# ==========================================
+# MÓDULO DE CONSULTAS - TELEMEDICINA
+# ==========================================
+# Ciclo de vida de una consulta:
+# esperando -> atendiendo -> finalizada (historial)
+# ==========================================
+
+import secrets
+
+from .estadisticas import acumular_consulta
+
+
+def _archivar_en_transaccion(conn, consulta_id, nombre_medico=None):
+    """
+    Copia la consulta al historial, la marca finalizada y la suma a
+    estadisticas_diarias.
+    Debe ejecutarse dentro de una transacción de escritura abierta.
+
+    Returns:
+        str: código de la consulta archivada, o None si no estaba activa
+    """
+    # El código usa el id de la consulta (AUTOINCREMENT, nunca se reutiliza),
+    # por lo que no colisiona. Se rellena a 6 dígitos para no coincidir con
+    # los códigos antiguos (CIP + 4 dígitos de timestamp).
+    # LEFT JOIN: la posta pudo eliminarse con la consulta en curso, que igual
+    # debe poder cerrarse (si no, el mantenimiento la reintentaría siempre)
+    cursor = conn.execute('''
+        INSERT INTO historial_consultas
+        (consulta_id, codigo_consulta, token_seguridad, cip, rut_paciente_cifrado,
+         rut_paciente_hash, nombre_medico, tens_nombre, nombre_posta, fecha_inicio,
+         fecha_atencion)
+        SELECT c.id,
+               c.cip || '-' || printf('%06d', c.id),
+               ?,
+               c.cip,
+               COALESCE(m.rut_cifrado, ''),
+               COALESCE(m.rut_hash, c.rut_paciente_hash, ''),
+               COALESCE(?, NULLIF(c.nombre_medico, ''), 'Médico'),
+               c.tens_nombre,
+               COALESCE(l.nombre_posta, 'Posta eliminada'),
+               c.fecha,
+               c.fecha_atencion
+        FROM consultas c
+        LEFT JOIN lugares l ON c.lugar_id = l.id
+        LEFT JOIN mapeo_pacientes m ON m.cip = c.cip
+        WHERE c.id = ? AND c.estado IN ('activa', 'atendiendo')
+    ''', (secrets.token_hex(8), nombre_medico, consulta_id))
+
+    if cursor.rowcount == 0:
+        return None
+
+    conn.execute("UPDATE consultas SET estado = 'finalizada' WHERE id = ?", (consulta_id,))
+    acumular_consulta(conn, cursor.lastrowid)
+
+    return conn.execute(
+        'SELECT codigo_consulta FROM historial_consultas WHERE id = ?', (cursor.lastrowid,)
+    ).fetchone()[0]
+
+
+def archivar_consulta(conn, consulta_id, nombre_medico=None):
+    """
+    Finaliza una consulta y la guarda en historial_consultas en una única
+    transacción BEGIN IMMEDIATE: dos cierres simultáneos de la misma
+    consulta (botón + sendBeacon) producen exactamente una fila de historial.
+
+    Args:
+        nombre_medico: médico que finaliza; si es None se usa el asignado
+
+    Returns:
+        str: código de la consulta archivada, o None si ya estaba finalizada
+             o no existe
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        codigo = _archivar_en_transaccion(conn, consulta_id, nombre_medico)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return codigo
+
+
+def obtener_pacientes_espera(conn):
+    """
+    Pacientes en la sala de espera del médico, del más antiguo al más reciente.
+
+    Returns:
+        list: dicts con id, cip, nombre_posta, tens_nombre y tens_inicial
+    """
+    consultas = conn.execute('''
+        SELECT c.id, c.cip, c.fecha, l.nombre_posta, c.tens_nombre
+        FROM consultas c
+        JOIN lugares l ON c.lugar_id = l.id
+        WHERE c.estado = 'esperando'
+        ORDER BY c.fecha ASC
+    ''').fetchall()
+    return [{
+        'id': c['id'],
+        'cip': c['cip'],
+        'nombre_posta': c['nombre_posta'],
+        'tens_nombre': c['tens_nombre'],
+        'tens_inicial': c['tens_nombre'][0] if c['tens_nombre'] else '?'
+    } for c in consultas]
+
+
+def obtener_estado_consulta(conn, consulta_id):
+    """
+    Estado de una consulta para el TENS que espera su cierre.
+
+    Returns:
+        str: estado, 'finalizada' si ya se retiró al historial, o None si no existe
+    """
+    consulta = conn.execute('SELECT estado FROM consultas WHERE id = ?', (consulta_id,)).fetchone()
+    if consulta:
+        return consulta['estado']
+    # Las finalizadas se retiran de consultas al compactar; quedan en el historial
+    archivada = conn.execute(
+        'SELECT 1 FROM historial_consultas WHERE consulta_id = ?', (consulta_id,)
+    ).fetchone()
+    return 'finalizada' if archivada else None
@@ -1,15 +1,82 @@
 import sqlite3
 import os
+import threading
+
+from flask import current_app, has_app_context
+
+from .metricas import medir_fase
+from .trazas_sql import ConexionTrazada
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('DB_PATH', 'telemedicina.db'))
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Bases ya inicializadas en este proceso (init_db una sola vez por base)
+_inicializadas = set()
+_lock_inicializacion = threading.Lock()
+
+def ruta_db_actual():
+    """Base de la app en curso (app.config['DATABASE']); fuera de un request, DB_PATH."""
+    if has_app_context():
+        return current_app.config.get('DATABASE', DB_PATH)
+    return DB_PATH
+
+def base_en_memoria(nombre):
+    """
+    URI de una base SQLite en memoria compartida por las conexiones del
+    proceso, para pruebas aisladas: create_app({'DATABASE': base_en_memoria('x')}).
+    Existe mientras quede alguna conexión abierta.
+    """
+    return f'file:{nombre}?mode=memory&cache=shared'
+
+def es_base_en_memoria(ruta):
+    return ruta.startswith('file:') and 'mode=memory' in ruta
+
+@medir_fase('db_conexion')
+def get_db_connection(ruta=None):
+    ruta = ruta or ruta_db_actual()
+    conn = sqlite3.connect(ruta, factory=ConexionTrazada, uri=ruta.startswith('file:'))
     conn.row_factory = sqlite3.Row
+    # Las cachés por proceso (utils/referencias.py) distinguen la base por su ruta
+    conn.ruta = ruta
     return conn
 
-def init_db():
-    conn = get_db_connection()
+def asegurar_db(ruta=None):
+    """Ejecuta init_db() la primera vez que el proceso usa la base (idempotente)."""
+    ruta = ruta or ruta_db_actual()
+    if ruta in _inicializadas:
+        return
+    with _lock_inicializacion:
+        if ruta not in _inicializadas:
+            init_db(ruta)
+            _inicializadas.add(ruta)
+
+def crear_indice_rut_hash_unico(conn):
+    """
+    Un paciente = un CIP: crea el índice único sobre mapeo_pacientes.rut_hash
+    si aún no existe y no quedan RUT con más de un CIP (bases anteriores a la
+    reutilización de CIP: ver migrations/compactar_mapeo_pacientes.py).
+
+    Returns:
+        bool: True si el índice existe al terminar
+    """
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_mapeo_pacientes_rut_hash_unico'"
+    ).fetchone():
+        return True
+    if conn.execute(
+        'SELECT 1 FROM mapeo_pacientes GROUP BY rut_hash HAVING COUNT(*) > 1 LIMIT 1'
+    ).fetchone():
+        return False
+    conn.execute('CREATE UNIQUE INDEX idx_mapeo_pacientes_rut_hash_unico ON mapeo_pacientes (rut_hash)')
+    return True
+
+def _asegurar_columna(cursor, tabla, columna, definicion):
+    """Agrega una columna a una tabla existente si aún no la tiene."""
+    columnas = [fila[1] for fila in cursor.execute(f"PRAGMA table_info({tabla})").fetchall()]
+    if columna not in columnas:
+        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+def init_db(ruta=None):
+    conn = get_db_connection(ruta)
     cursor = conn.cursor()
     
     # 1. Tabla de Lugares (Postas/Centros)
@@ -54,6 +121,8 @@ def init_db():
             tens_nombre TEXT NOT NULL,
             estado TEXT DEFAULT 'esperando',
             fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ultimo_latido TIMESTAMP,
+            fecha_atencion TIMESTAMP,
             FOREIGN KEY (lugar_id) REFERENCES lugares (id)
         )
     ''')
@@ -62,6 +131,7 @@ def init_db():
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS historial_consultas (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consulta_id INTEGER,
             codigo_consulta TEXT NOT NULL UNIQUE,
             token_seguridad TEXT NOT NULL,
             cip TEXT NOT NULL,
@@ -71,6 +141,7 @@ def init_db():
             tens_nombre TEXT NOT NULL,
             nombre_posta TEXT NOT NULL,
             fecha_inicio TIMESTAMP,
+            fecha_atencion TIMESTAMP,
             fecha_fin TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -134,6 +205,237 @@ def init_db():
         )
     ''')
 
+    # 8. Resumen diario de atenciones (ver utils/estadisticas.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS estadisticas_diarias (
+            nombre_medico TEXT NOT NULL,
+            dia TEXT NOT NULL,
+            nombre_posta TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            duracion_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (nombre_medico, dia, nombre_posta)
+        ) WITHOUT ROWID
+    ''')
+
+    # 9. Agregados de analítica (ver utils/analitica.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analitica_posta_hora (
+            nivel TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            nombre_posta TEXT NOT NULL,
+            hora INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (nivel, periodo, nombre_posta, hora)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analitica_cuantiles (
+            metrica TEXT NOT NULL,
+            nivel TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            nombre_posta TEXT NOT NULL,
+            cubo INTEGER NOT NULL,
+            conteo INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (metrica, nivel, periodo, nombre_posta, cubo)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analitica_marcas (
+            clave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        )
+    ''')
+
+    # 10. Solicitudes resueltas archivadas (ver utils/aprobaciones.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historial_solicitudes (
+            id INTEGER PRIMARY KEY,
+            tipo_accion TEXT NOT NULL,
+            entidad_tipo TEXT NOT NULL,
+            entidad_id TEXT NOT NULL,
+            solicitante_id INTEGER NOT NULL,
+            solicitante_nombre TEXT NOT NULL,
+            solicitante_rol TEXT NOT NULL,
+            datos_originales TEXT,
+            datos_nuevos TEXT,
+            justificacion TEXT,
+            estado TEXT NOT NULL,
+            aprobador_id INTEGER,
+            aprobador_nombre TEXT,
+            motivo_resolucion TEXT,
+            fecha_solicitud TIMESTAMP,
+            fecha_escalada TIMESTAMP,
+            fecha_resolucion TIMESTAMP,
+            fecha_archivo TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 11. Solicitudes pendientes por tipo, mantenido por triggers
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS solicitudes_pendientes_conteo (
+            tipo_accion TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    # 12. Versión de los datos de referencia cacheados (ver utils/referencias.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versiones_datos (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Al iniciar se invalidan las cachés de los procesos en curso, por si
+    # las tablas se modificaron fuera de la aplicación (migraciones, scripts)
+    cursor.execute('''
+        INSERT INTO versiones_datos (tabla, version)
+        VALUES ('lugares', 1), ('usuarios', 1)
+        ON CONFLICT (tabla) DO UPDATE SET version = version + 1
+    ''')
+
+    # 13. Sesiones de usuario (ver utils/sesiones.py); id = SHA-256 del identificador
+    # de la cookie, creada/ultimo_acceso en segundos Unix
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sesiones (
+            id TEXT PRIMARY KEY,
+            usuario_id INTEGER,
+            datos TEXT NOT NULL,
+            creada INTEGER NOT NULL,
+            ultimo_acceso INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+    # Columnas agregadas después de la creación original de las tablas
+    _asegurar_columna(cursor, 'historial_consultas', 'consulta_id', 'INTEGER')
+    _asegurar_columna(cursor, 'consultas', 'ultimo_latido', 'TIMESTAMP')
+    _asegurar_columna(cursor, 'consultas', 'fecha_atencion', 'TIMESTAMP')
+    _asegurar_columna(cursor, 'historial_consultas', 'fecha_atencion', 'TIMESTAMP')
+    # Motivo de aprobación o rechazo (utils/aprobaciones.py)
+    _asegurar_columna(cursor, 'solicitudes_aprobacion', 'motivo_resolucion', 'TEXT')
+    _asegurar_columna(cursor, 'solicitudes_aprobacion', 'fecha_escalada', 'TIMESTAMP')
+
+    # Índices parciales sobre los estados activos: solo contienen las consultas
+    # en curso, sin importar cuántas finalizadas queden aún por compactar.
+    # (Las consultas deben filtrar con la misma igualdad sobre estado)
+    cursor.execute('DROP INDEX IF EXISTS idx_consultas_estado_medico')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_consultas_esperando
+        ON consultas (fecha) WHERE estado = 'esperando'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_consultas_atendiendo
+        ON consultas (nombre_medico) WHERE estado = 'atendiendo'
+    ''')
+
+    # Una consulta se archiva una sola vez en el historial
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_historial_consulta_id
+        ON historial_consultas (consulta_id) WHERE consulta_id IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_historial_cip
+        ON historial_consultas (cip)
+    ''')
+    # Exportación del historial por rango de fechas
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_historial_fecha_fin
+        ON historial_consultas (fecha_fin)
+    ''')
+    # Atenciones del día por médico (rango sobre fecha_fin, sin DATE())
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_historial_medico_fecha_fin
+        ON historial_consultas (nombre_medico, fecha_fin)
+    ''')
+
+    # Cola de solicitudes pendientes (listado y conteo por tipo)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_solicitudes_pendientes
+        ON solicitudes_aprobacion (fecha_solicitud) WHERE estado = 'pendiente'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_solicitudes_pendientes_tipo
+        ON solicitudes_aprobacion (tipo_accion, fecha_solicitud) WHERE estado = 'pendiente'
+    ''')
+
+    # Solicitudes resueltas a archivar (las pendientes no tienen fecha_resolucion)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_solicitudes_fecha_resolucion
+        ON solicitudes_aprobacion (fecha_resolucion)
+    ''')
+
+    # Conteo de pendientes: los triggers lo ajustan en cada cambio de estado
+    # y se recalcula al iniciar por si la base se modificó sin ellos
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_solicitudes_pendiente_insert
+        AFTER INSERT ON solicitudes_aprobacion WHEN NEW.estado = 'pendiente'
+        BEGIN
+            INSERT INTO solicitudes_pendientes_conteo (tipo_accion, total) VALUES (NEW.tipo_accion, 1)
+            ON CONFLICT (tipo_accion) DO UPDATE SET total = total + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_solicitudes_pendiente_resuelta
+        AFTER UPDATE OF estado ON solicitudes_aprobacion
+        WHEN OLD.estado = 'pendiente' AND NEW.estado != 'pendiente'
+        BEGIN
+            UPDATE solicitudes_pendientes_conteo SET total = total - 1
+            WHERE tipo_accion = OLD.tipo_accion;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_solicitudes_pendiente_reabierta
+        AFTER UPDATE OF estado ON solicitudes_aprobacion
+        WHEN OLD.estado != 'pendiente' AND NEW.estado = 'pendiente'
+        BEGIN
+            INSERT INTO solicitudes_pendientes_conteo (tipo_accion, total) VALUES (NEW.tipo_accion, 1)
+            ON CONFLICT (tipo_accion) DO UPDATE SET total = total + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_solicitudes_pendiente_delete
+        AFTER DELETE ON solicitudes_aprobacion WHEN OLD.estado = 'pendiente'
+        BEGIN
+            UPDATE solicitudes_pendientes_conteo SET total = total - 1
+            WHERE tipo_accion = OLD.tipo_accion;
+        END
+    ''')
+    cursor.execute('DELETE FROM solicitudes_pendientes_conteo')
+    cursor.execute('''
+        INSERT INTO solicitudes_pendientes_conteo (tipo_accion, total)
+        SELECT tipo_accion, COUNT(*) FROM solicitudes_aprobacion
+        WHERE estado = 'pendiente'
+        GROUP BY tipo_accion
+    ''')
+
+    # Índices de búsqueda por hash de RUT
+    # (rut_hash, id, cip) cubre la búsqueda de CIP sin leer la tabla
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_mapeo_pacientes_rut_hash_cip
+        ON mapeo_pacientes (rut_hash, id, cip)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_mapeo_pacientes_rut_hash')
+    if not crear_indice_rut_hash_unico(conn):
+        print("[DB] mapeo_pacientes tiene RUT con más de un CIP: ejecute "
+              "migrations/compactar_mapeo_pacientes.py para crear el índice único de rut_hash")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_consultas_rut_hash
+        ON consultas (rut_paciente_hash)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_historial_rut_hash
+        ON historial_consultas (rut_paciente_hash)
+    ''')
+
+    # Sesiones: revocación por usuario y purga de las inactivas
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sesiones_usuario
+        ON sesiones (usuario_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sesiones_ultimo_acceso
+        ON sesiones (ultimo_acceso)
+    ''')
+
     # Admin maestro inicial
     cursor.execute("SELECT * FROM usuarios WHERE correo='admin@clinica.cl'")
     if not cursor.fetchone():
@@ -0,0 +1,60 @@
+# ==========================================
+# MÓDULO DE BASE DE DATOS ASÍNCRONA - TELEMEDICINA
+# ==========================================
+# Acceso a SQLite desde asyncio (asgi.py) sin bloquear el
+# bucle de eventos:
+# - Un hilo escritor dedicado con su propia conexión: las
+#   escrituras del proceso se serializan y no compiten entre
+#   sí por el bloqueo de SQLite
+# - Un pool de hilos lectores, cada uno con su conexión
+#
+# Se ejecutan las mismas funciones de utils/ que usan las
+# rutas síncronas (reciben la conexión como primer argumento).
+# ==========================================
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .database import asegurar_db, get_db_connection
+
+ASYNC_LECTORES = int(os.environ.get('ASYNC_LECTORES', 4))
+
+
+class BaseAsincrona:
+    """
+    Uso:
+        db = BaseAsincrona(ruta)
+        pacientes = await db.leer(obtener_pacientes_espera)
+        codigo = await db.escribir(archivar_consulta, consulta_id, nombre_medico)
+    """
+
+    def __init__(self, ruta, lectores=None):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._lectores = ThreadPoolExecutor(lectores or ASYNC_LECTORES, thread_name_prefix='sqlite-lector')
+        self._escritor = ThreadPoolExecutor(1, thread_name_prefix='sqlite-escritor')
+
+    def _ejecutar(self, funcion, args):
+        # Una conexión por hilo, abierta en su primer uso y reutilizada
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            asegurar_db(self.ruta)
+            conn = self._local.conn = get_db_connection(self.ruta)
+        return funcion(conn, *args)
+
+    async def leer(self, funcion, *args):
+        """Ejecuta funcion(conn, *args) en el pool de lectores."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._lectores, self._ejecutar, funcion, args)
+
+    async def escribir(self, funcion, *args):
+        """Ejecuta funcion(conn, *args) en el hilo escritor (una escritura a la vez)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._escritor, self._ejecutar, funcion, args)
+
+    def cerrar(self):
+        """Espera las operaciones en curso; las conexiones se cierran con sus hilos."""
+        self._escritor.shutdown(wait=True)
+        self._lectores.shutdown(wait=True)
@@ -0,0 +1,70 @@
+# ==========================================
+# MÓDULO DE ESTADÍSTICAS - TELEMEDICINA
+# ==========================================
+# Tabla resumen estadisticas_diarias: atenciones y
+# duración acumulada por (médico, día local, posta),
+# mantenida al archivar cada consulta.
+# ==========================================
+
+# fecha_fin/fecha_inicio se guardan en UTC; el día se agrupa en hora local
+_SQL_DIA = "DATE(fecha_fin, 'localtime')"
+_SQL_DURACION = (
+    "COALESCE(MAX(0, CAST(ROUND((julianday(fecha_fin) - julianday(fecha_inicio)) * 86400) AS INTEGER)), 0)"
+)
+
+
+def acumular_consulta(conn, historial_id):
+    """
+    Suma una consulta recién archivada a estadisticas_diarias.
+    Debe ejecutarse en la misma transacción que el INSERT en el historial.
+    """
+    conn.execute(f'''
+        INSERT INTO estadisticas_diarias (nombre_medico, dia, nombre_posta, total, duracion_total)
+        SELECT nombre_medico, {_SQL_DIA}, nombre_posta, 1, {_SQL_DURACION}
+        FROM historial_consultas WHERE id = ?
+        ON CONFLICT (nombre_medico, dia, nombre_posta) DO UPDATE SET
+            total = total + excluded.total,
+            duracion_total = duracion_total + excluded.duracion_total
+    ''', (historial_id,))
+
+
+def reconstruir_estadisticas_diarias(conn):
+    """
+    Recalcula estadisticas_diarias desde todo el historial (backfill).
+
+    Returns:
+        int: filas de resumen generadas
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM estadisticas_diarias')
+        conn.execute(f'''
+            INSERT INTO estadisticas_diarias (nombre_medico, dia, nombre_posta, total, duracion_total)
+            SELECT nombre_medico, {_SQL_DIA}, nombre_posta, COUNT(*), SUM({_SQL_DURACION})
+            FROM historial_consultas
+            GROUP BY nombre_medico, {_SQL_DIA}, nombre_posta
+        ''')
+        filas = conn.execute('SELECT COUNT(*) FROM estadisticas_diarias').fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return filas
+
+
+def obtener_resumen_medico_hoy(conn, nombre_medico):
+    """
+    Atenciones del médico en el día local actual (todas las postas).
+
+    Returns:
+        dict: total, duracion_promedio (segundos)
+    """
+    fila = conn.execute('''
+        SELECT COALESCE(SUM(total), 0) AS total, COALESCE(SUM(duracion_total), 0) AS duracion_total
+        FROM estadisticas_diarias
+        WHERE nombre_medico = ? AND dia = DATE('now', 'localtime')
+    ''', (nombre_medico,)).fetchone()
+    return {
+        'total': fila['total'],
+        'duracion_promedio': fila['duracion_total'] / fila['total'] if fila['total'] else 0,
+    }
@@ -0,0 +1,156 @@
+# ==========================================
+# MÓDULO DE EXPORTACIÓN - TELEMEDICINA
+# ==========================================
+# Exportación del historial de consultas (sin RUT):
+# - CSV UTF-8 (planillas)
+# - Parquet comprimido, particionado por mes de fecha_fin
+#   y empaquetado en un ZIP (herramientas de análisis)
+# Ambos formatos leen el cursor por lotes.
+# pyarrow es opcional: solo se importa al exportar Parquet.
+# ==========================================
+
+import csv
+import importlib.util
+import os
+import tempfile
+import zipfile
+from datetime import date, timedelta
+
+EXPORTACION_LOTE = int(os.environ.get('EXPORTACION_LOTE', 50000))
+
+# Columnas exportables (Privacy by Design: sin RUT cifrado ni hash)
+COLUMNAS_EXPORTACION = [
+    ('codigo_consulta', 'Código'),
+    ('token_seguridad', 'Token Seguridad'),
+    ('cip', 'CIP (Código Atención)'),
+    ('nombre_medico', 'Médico'),
+    ('tens_nombre', 'TENS'),
+    ('nombre_posta', 'Posta'),
+    ('fecha_inicio', 'Fecha Inicio'),
+    ('fecha_fin', 'Fecha Fin'),
+]
+_COLUMNAS_FECHA = ('fecha_inicio', 'fecha_fin')
+_INDICE_CIP = [columna for columna, _ in COLUMNAS_EXPORTACION].index('cip')
+_INDICE_FECHA_FIN = [columna for columna, _ in COLUMNAS_EXPORTACION].index('fecha_fin')
+
+
+def parquet_disponible():
+    """True si pyarrow está instalado (exportación Parquet habilitada)."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def consultar_historial_exportable(conn, fecha_desde='', fecha_hasta='', orden='DESC'):
+    """
+    Cursor sobre el historial filtrado por fecha_fin (días inclusive).
+
+    Compara fecha_fin contra el rango como texto en lugar de usar
+    DATE(fecha_fin), para poder usar el índice idx_historial_fecha_fin.
+    """
+    columnas = ', '.join(columna for columna, _ in COLUMNAS_EXPORTACION)
+    query = f'SELECT {columnas} FROM historial_consultas WHERE 1=1'
+    params = []
+
+    if fecha_desde:
+        query += ' AND fecha_fin >= ?'
+        params.append(date.fromisoformat(fecha_desde).isoformat())
+
+    if fecha_hasta:
+        query += ' AND fecha_fin < ?'
+        params.append((date.fromisoformat(fecha_hasta) + timedelta(days=1)).isoformat())
+
+    query += f" ORDER BY fecha_fin {'ASC' if orden == 'ASC' else 'DESC'}"
+    cursor = conn.execute(query, params)
+    # Tuplas en vez de sqlite3.Row: los escritores acceden por posición
+    cursor.row_factory = None
+    return cursor
+
+
+def escribir_csv_historial(cursor, salida, tamano_lote=None):
+    """Escribe el historial en CSV (texto) sobre `salida`, por lotes."""
+    tamano_lote = tamano_lote or EXPORTACION_LOTE
+    writer = csv.writer(salida)
+    writer.writerow([encabezado for _, encabezado in COLUMNAS_EXPORTACION])
+
+    while True:
+        filas = cursor.fetchmany(tamano_lote)
+        if not filas:
+            break
+        for h in filas:
+            fila = list(h)
+            # CIP podría no existir en registros antiguos
+            fila[_INDICE_CIP] = fila[_INDICE_CIP] or '(migración)'
+            writer.writerow(fila)
+
+
+def _tabla_arrow(pa, pc, esquema, filas):
+    """Convierte un lote de filas en una tabla Arrow (fechas UTC como timestamp)."""
+    columnas = []
+    for indice, (columna, _) in enumerate(COLUMNAS_EXPORTACION):
+        valores = pa.array([fila[indice] for fila in filas], type=pa.string())
+        if columna in _COLUMNAS_FECHA:
+            valores = pc.strptime(valores, format='%Y-%m-%d %H:%M:%S', unit='s',
+                                  error_is_null=True).cast(esquema.field(columna).type)
+        columnas.append(valores)
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+
+def escribir_parquet_historial(cursor, archivo_zip, tamano_lote=None, compresion='zstd'):
+    """
+    Escribe el historial como Parquet particionado por mes de fecha_fin
+    (historial/mes=AAAA-MM/part-0.parquet) dentro de un ZIP.
+
+    El cursor debe venir ordenado por fecha_fin ascendente: cada lote se
+    escribe como un row group del archivo de su mes, sin cargar el
+    historial completo en memoria.
+
+    Returns:
+        dict: filas exportadas por mes
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    tamano_lote = tamano_lote or EXPORTACION_LOTE
+    esquema = pa.schema([
+        (columna, pa.timestamp('s', tz='UTC') if columna in _COLUMNAS_FECHA else pa.string())
+        for columna, _ in COLUMNAS_EXPORTACION
+    ])
+
+    filas_por_mes = {}
+    with tempfile.TemporaryDirectory(prefix='exportacion_') as directorio, \
+            zipfile.ZipFile(archivo_zip, 'w', zipfile.ZIP_STORED) as zf:
+        mes_actual, writer, ruta_actual = None, None, None
+
+        def cerrar_particion():
+            if writer:
+                writer.close()
+                zf.write(ruta_actual, f"historial/mes={mes_actual}/part-0.parquet")
+                os.remove(ruta_actual)
+
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+
+            # Un lote puede cruzar el cambio de mes: se separa en tramos contiguos
+            meses = [(fila[_INDICE_FECHA_FIN] or '')[:7] or 'sin_fecha' for fila in filas]
+            inicio = 0
+            while inicio < len(filas):
+                mes = meses[inicio]
+                fin = inicio
+                while fin < len(filas) and meses[fin] == mes:
+                    fin += 1
+
+                if mes != mes_actual:
+                    cerrar_particion()
+                    mes_actual = mes
+                    ruta_actual = os.path.join(directorio, f"{mes}.parquet")
+                    writer = pq.ParquetWriter(ruta_actual, esquema, compression=compresion)
+
+                writer.write_table(_tabla_arrow(pa, pc, esquema, filas[inicio:fin]))
+                filas_por_mes[mes] = filas_por_mes.get(mes, 0) + (fin - inicio)
+                inicio = fin
+
+        cerrar_particion()
+
+    return filas_por_mes
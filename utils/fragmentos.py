@@ -0,0 +1,120 @@
+# ==========================================
+# MÓDULO DE CACHÉ DE FRAGMENTOS - TELEMEDICINA
+# ==========================================
+# - Fragmentos HTML ya renderizados (tablas del dashboard de
+#   administración), en memoria por proceso. La clave incluye
+#   rol, usuario y la versión de los datos que muestran: al
+#   cambiar la versión la entrada simplemente deja de usarse.
+#   FRAGMENTOS_TTL acota cuánto puede vivir una entrada aunque
+#   su versión no cambie (p. ej. tras restaurar un respaldo).
+# - Respuestas JSON condicionales (ETag / If-None-Match) para
+#   las APIs que se consultan periódicamente: si nada cambió
+#   se responde 304 sin cuerpo.
+#
+# Los fragmentos no deben contener tokens CSRF ni nada que
+# dependa de la sesión fuera de lo que va en la clave.
+# ==========================================
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+from markupsafe import Markup
+
+from .metricas import registrar_colector
+
+FRAGMENTOS_MAX = int(os.environ.get('FRAGMENTOS_MAX', 128))
+FRAGMENTOS_TTL = int(os.environ.get('FRAGMENTOS_TTL', 300))
+
+# clave -> (expira, html); el orden es el de uso (LRU)
+_cache = OrderedDict()
+# nombre -> [aciertos, renderizados]
+_estadisticas = {}
+_lock = threading.Lock()
+
+
+def fragmento(nombre, clave, generar):
+    """
+    Devuelve el fragmento desde la caché o lo renderiza con generar().
+
+    Args:
+        nombre: Nombre del fragmento (plantilla o sección)
+        clave: Tupla con rol, usuario y versión de los datos mostrados
+        generar: Función sin argumentos que devuelve el HTML; solo se
+            llama si no hay entrada vigente, así que las consultas que
+            alimentan el fragmento deben hacerse dentro de ella
+
+    Returns:
+        Markup: HTML listo para insertar en la plantilla
+    """
+    clave = (nombre,) + tuple(clave)
+    ahora = time.monotonic()
+    with _lock:
+        estadisticas = _estadisticas.setdefault(nombre, [0, 0])
+        entrada = _cache.get(clave)
+        if entrada and entrada[0] > ahora:
+            _cache.move_to_end(clave)
+            estadisticas[0] += 1
+            return entrada[1]
+        estadisticas[1] += 1
+
+    html = Markup(generar())
+    with _lock:
+        _cache[clave] = (ahora + FRAGMENTOS_TTL, html)
+        _cache.move_to_end(clave)
+        while len(_cache) > FRAGMENTOS_MAX:
+            _cache.popitem(last=False)
+    return html
+
+
+def json_condicional(datos):
+    """
+    jsonify() con ETag: si el cliente envía el mismo ETag en
+    If-None-Match, responde 304 sin cuerpo.
+
+    Cache-Control: no-cache obliga al navegador a revalidar cada
+    sondeo, de modo que fetch() recibe siempre los datos vigentes.
+    """
+    respuesta = jsonify(datos)
+    respuesta.add_etag()
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta.make_conditional(request)
+
+
+def estadisticas_fragmentos():
+    """
+    Returns:
+        dict: {'entradas': int, 'fragmentos': {nombre: {'aciertos', 'renderizados'}}}
+    """
+    with _lock:
+        return {
+            'entradas': len(_cache),
+            'fragmentos': {
+                nombre: {'aciertos': aciertos, 'renderizados': renderizados}
+                for nombre, (aciertos, renderizados) in _estadisticas.items()
+            },
+        }
+
+
+def _metricas_fragmentos():
+    lineas = [
+        '# HELP telemedicina_fragmentos_total Lecturas de la caché de fragmentos por resultado.',
+        '# TYPE telemedicina_fragmentos_total counter',
+    ]
+    with _lock:
+        copia = {nombre: list(valores) for nombre, valores in _estadisticas.items()}
+        entradas = len(_cache)
+    for nombre, (aciertos, renderizados) in sorted(copia.items()):
+        lineas.append(f'telemedicina_fragmentos_total{{fragmento="{nombre}",resultado="acierto"}} {aciertos}')
+        lineas.append(f'telemedicina_fragmentos_total{{fragmento="{nombre}",resultado="renderizado"}} {renderizados}')
+    lineas += [
+        '# HELP telemedicina_fragmentos_entradas Fragmentos guardados en la caché del proceso.',
+        '# TYPE telemedicina_fragmentos_entradas gauge',
+        f'telemedicina_fragmentos_entradas {entradas}',
+    ]
+    return lineas
+
+
+registrar_colector(_metricas_fragmentos)
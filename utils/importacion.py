@@ -0,0 +1,302 @@
+# ==========================================
+# MÓDULO DE IMPORTACIÓN MASIVA - TELEMEDICINA
+# ==========================================
+# Pre-registro de pacientes desde CSV
+# (carga web en /tens/importar-pacientes y
+#  línea de comandos en importar_pacientes.py)
+# ==========================================
+
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .seguridad import (
+    validar_ruts_lote, cifrar_ruts_lote, generar_cip, hashear_rut_legado, enmascarar_rut
+)
+from .pacientes import rehashear_paciente_legado
+
+# Filas por transacción
+TAMANO_LOTE_IMPORTACION = int(os.environ.get('TAMANO_LOTE_IMPORTACION', 2000))
+
+# Hilos para el cifrado AES-256-GCM
+TRABAJADORES_CIFRADO = int(os.environ.get('TRABAJADORES_CIFRADO', min(4, os.cpu_count() or 1)))
+
+# Límite de variables por sentencia (SQLite < 3.32 acepta 999)
+_MAX_VARIABLES_SQL = 900
+
+# Columnas aceptadas en el encabezado del CSV
+_COLUMNAS_RUT = ('rut', 'rut_paciente')
+_COLUMNAS_LUGAR = ('lugar_id', 'posta_id')
+
+
+def leer_csv_pacientes(archivo):
+    """
+    Lee un CSV de pacientes fila a fila (sin cargarlo completo en memoria).
+
+    Acepta un encabezado con columna 'rut' (y opcional 'lugar_id');
+    sin encabezado, la primera columna es el RUT.
+
+    Yields:
+        tuple: (numero_fila, rut, lugar_id o None)
+    """
+    lector = csv.reader(archivo)
+    idx_rut, idx_lugar = 0, None
+
+    for numero_fila, fila in enumerate(lector, start=1):
+        if not fila or not any(campo.strip() for campo in fila):
+            continue
+
+        if numero_fila == 1:
+            encabezado = [campo.strip().lower() for campo in fila]
+            columnas_rut = [i for i, c in enumerate(encabezado) if c in _COLUMNAS_RUT]
+            if columnas_rut:
+                idx_rut = columnas_rut[0]
+                columnas_lugar = [i for i, c in enumerate(encabezado) if c in _COLUMNAS_LUGAR]
+                idx_lugar = columnas_lugar[0] if columnas_lugar else None
+                continue
+
+        rut = fila[idx_rut].strip() if idx_rut < len(fila) else ''
+        lugar_id = None
+        if idx_lugar is not None and idx_lugar < len(fila) and fila[idx_lugar].strip():
+            lugar_id = fila[idx_lugar].strip()
+
+        yield numero_fila, rut, lugar_id
+
+
+def _en_bloques(valores, tamano=_MAX_VARIABLES_SQL):
+    for i in range(0, len(valores), tamano):
+        yield valores[i:i + tamano]
+
+
+def _hashes_existentes(conn, hashes):
+    """Retorna el subconjunto de hashes que ya tienen mapeo (usa idx_mapeo_pacientes_rut_hash_cip)."""
+    existentes = set()
+    for bloque in _en_bloques(list(hashes)):
+        marcadores = ','.join('?' * len(bloque))
+        filas = conn.execute(
+            f"SELECT rut_hash FROM mapeo_pacientes WHERE rut_hash IN ({marcadores})", bloque
+        ).fetchall()
+        existentes.update(f[0] for f in filas)
+    return existentes
+
+
+def _rehashear_legados(conn, ruts):
+    """
+    Busca en bloque los RUTs que solo tienen el hash legado (base sin la
+    fase 3 de migración) y pasa esos pacientes al hash HMAC.
+
+    Returns:
+        set: hashes HMAC de los pacientes encontrados
+    """
+    por_legado = {hashear_rut_legado(rut): rut for rut in ruts}
+    encontrados = set()
+    for bloque in _en_bloques(list(por_legado)):
+        marcadores = ','.join('?' * len(bloque))
+        filas = conn.execute(
+            f"SELECT rut_hash FROM mapeo_pacientes WHERE rut_hash IN ({marcadores})", bloque
+        ).fetchall()
+        encontrados.update(f[0] for f in filas)
+
+    for hash_legado in encontrados:
+        rut = por_legado[hash_legado]
+        rehashear_paciente_legado(conn, rut, rut.hash)
+    return {por_legado[h].hash for h in encontrados}
+
+
+def _asignar_bloque_cip(conn, nombre_posta, cantidad, reservados, max_rondas=20):
+    """
+    Reserva `cantidad` CIP libres para una posta con pocas consultas a la BD.
+
+    Genera candidatos en bloque y descarta los ya usados con un único
+    SELECT ... IN por bloque, en lugar de un SELECT por CIP.
+    `reservados` acumula los CIP ya entregados en la misma transacción
+    (varias postas pueden compartir prefijo).
+
+    Raises:
+        ValueError: si el espacio de CIP de la posta está casi agotado
+    """
+    asignados = []
+    usados = reservados
+
+    for _ in range(max_rondas):
+        faltan = cantidad - len(asignados)
+        if faltan <= 0:
+            break
+
+        candidatos = set()
+        intentos = 0
+        while len(candidatos) < faltan and intentos < faltan * 4:
+            cip = generar_cip(nombre_posta)
+            if cip not in usados:
+                candidatos.add(cip)
+            intentos += 1
+
+        candidatos = list(candidatos)
+        for bloque in _en_bloques(candidatos):
+            marcadores = ','.join('?' * len(bloque))
+            filas = conn.execute(
+                f"SELECT cip FROM mapeo_pacientes WHERE cip IN ({marcadores})", bloque
+            ).fetchall()
+            usados.update(f[0] for f in filas)
+
+        for cip in candidatos:
+            if cip not in usados and len(asignados) < cantidad:
+                asignados.append(cip)
+                usados.add(cip)
+
+    if len(asignados) < cantidad:
+        raise ValueError(f"No quedan CIP disponibles para la posta '{nombre_posta}'")
+
+    return asignados
+
+
+def _cifrar_en_paralelo(ruts, trabajadores):
+    """Cifra una lista de RUTs repartiéndola en tramos entre varios hilos."""
+    if trabajadores <= 1 or len(ruts) < 256:
+        return cifrar_ruts_lote(ruts)
+
+    tramo = -(-len(ruts) // trabajadores)
+    tramos = [ruts[i:i + tramo] for i in range(0, len(ruts), tramo)]
+    with ThreadPoolExecutor(max_workers=trabajadores) as pool:
+        resultados = []
+        for parcial in pool.map(cifrar_ruts_lote, tramos):
+            resultados.extend(parcial)
+    return resultados
+
+
+def _procesar_lote(conn, lote, postas, lugar_id_defecto, creado_por_id,
+                   vistos, resumen, trabajadores):
+    """Valida, cifra e inserta un lote de filas en una sola transacción."""
+    errores = resumen['errores']
+
+    # 1. Validación del lote completo
+    validados = validar_ruts_lote([rut for _, rut, _ in lote])
+
+    candidatos = []  # (numero_fila, RutParseado, lugar_id)
+    for (numero_fila, rut, lugar_id), (rut_parseado, mensaje) in zip(lote, validados):
+        if not rut_parseado:
+            # Nunca el RUT tal como vino: el reporte se descarga y se guarda
+            errores.append({'fila': numero_fila, 'rut': enmascarar_rut(rut), 'error': mensaje})
+            continue
+
+        lugar_id = lugar_id or lugar_id_defecto
+        if str(lugar_id) not in postas:
+            errores.append({'fila': numero_fila, 'rut': rut_parseado.enmascarado, 'error': 'Posta inexistente'})
+            continue
+
+        if rut_parseado.hash in vistos:
+            resumen['duplicadas'] += 1
+            continue
+        vistos.add(rut_parseado.hash)
+        candidatos.append((numero_fila, rut_parseado, str(lugar_id)))
+
+    if not candidatos:
+        return
+
+    # 2. Descartar pacientes ya registrados (antes de pagar el cifrado)
+    existentes = _hashes_existentes(conn, [r.hash for _, r, _ in candidatos])
+    nuevos = [c for c in candidatos if c[1].hash not in existentes]
+    resumen['existentes'] += len(candidatos) - len(nuevos)
+    if not nuevos:
+        return
+
+    # 3. Cifrado fuera de la transacción de escritura
+    cifrados = _cifrar_en_paralelo([r for _, r, _ in nuevos], trabajadores)
+
+    # 4. Inserción en una transacción por lote
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Otro proceso pudo registrar alguno mientras cifrábamos
+        existentes = _hashes_existentes(conn, [r.hash for _, r, _ in nuevos])
+        # Pacientes anteriores a HMAC: conservan su CIP en vez de recibir otro
+        existentes |= _rehashear_legados(conn, [r for _, r, _ in nuevos if r.hash not in existentes])
+
+        por_posta = {}
+        for (numero_fila, rut_parseado, lugar_id), rut_cifrado in zip(nuevos, cifrados):
+            if rut_parseado.hash in existentes:
+                resumen['existentes'] += 1
+                continue
+            if not rut_cifrado:
+                errores.append({'fila': numero_fila, 'rut': rut_parseado.enmascarado,
+                                'error': 'Error de cifrado'})
+                continue
+            por_posta.setdefault(lugar_id, []).append((numero_fila, rut_parseado, rut_cifrado))
+
+        filas_insertar = []
+        reservados = set()
+        for lugar_id, pacientes in por_posta.items():
+            try:
+                cips = _asignar_bloque_cip(conn, postas[lugar_id], len(pacientes), reservados)
+            except ValueError as e:
+                errores.extend({'fila': f, 'rut': r.enmascarado, 'error': str(e)}
+                               for f, r, _ in pacientes)
+                continue
+            filas_insertar.extend(
+                (cip, rut_cifrado, rut_parseado.hash, rut_parseado.enmascarado, creado_por_id)
+                for cip, (_, rut_parseado, rut_cifrado) in zip(cips, pacientes)
+            )
+
+        conn.executemany('''
+            INSERT INTO mapeo_pacientes (cip, rut_cifrado, rut_hash, rut_enmascarado, creado_por_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', filas_insertar)
+        conn.commit()
+        resumen['registradas'] += len(filas_insertar)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def importar_pacientes(conn, filas, lugar_id_defecto=None, creado_por_id=None,
+                       tamano_lote=None, trabajadores=None):
+    """
+    Pre-registra pacientes en mapeo_pacientes a partir de filas de un CSV.
+
+    Cada paciente nuevo recibe su CIP y su RUT cifrado; los ya registrados
+    se omiten (su CIP se reutilizará al atenderlos). Cada lote se confirma
+    en su propia transacción, por lo que un error deja los lotes previos.
+
+    Args:
+        filas: iterable de (numero_fila, rut, lugar_id o None), ver leer_csv_pacientes()
+        lugar_id_defecto: posta para filas sin lugar_id
+
+    Returns:
+        dict: procesadas, registradas, existentes, duplicadas y errores
+              ([{'fila', 'rut' (enmascarado), 'error'}, ...])
+    """
+    tamano_lote = tamano_lote or TAMANO_LOTE_IMPORTACION
+    trabajadores = trabajadores or TRABAJADORES_CIFRADO
+
+    postas = {
+        str(l['id']): l['nombre_posta']
+        for l in conn.execute('SELECT id, nombre_posta FROM lugares').fetchall()
+    }
+    # Cerrar cualquier transacción implícita pendiente del llamador
+    conn.commit()
+
+    resumen = {'procesadas': 0, 'registradas': 0, 'existentes': 0,
+               'duplicadas': 0, 'errores': []}
+    vistos = set()
+    lote = []
+
+    for fila in filas:
+        lote.append(fila)
+        resumen['procesadas'] += 1
+        if len(lote) >= tamano_lote:
+            _procesar_lote(conn, lote, postas, lugar_id_defecto, creado_por_id,
+                           vistos, resumen, trabajadores)
+            lote = []
+
+    if lote:
+        _procesar_lote(conn, lote, postas, lugar_id_defecto, creado_por_id,
+                       vistos, resumen, trabajadores)
+
+    return resumen
+
+
+def escribir_reporte_errores(errores, archivo):
+    """Escribe el reporte de errores por fila como CSV (fila, rut, error)."""
+    writer = csv.writer(archivo)
+    writer.writerow(['Fila', 'RUT', 'Error'])
+    for error in errores:
+        writer.writerow([error['fila'], error['rut'], error['error']])
@@ -0,0 +1,84 @@
+# ==========================================
+# MÓDULO JITSI - TELEMEDICINA
+# ==========================================
+# Emisión de tokens JWT para las salas de video
+# con caché por (usuario, sala)
+# PyJWT se importa al emitir el primer token, no al
+# iniciar la aplicación.
+# ==========================================
+
+import os
+import threading
+import time
+
+JITSI_HOST = os.environ.get('JITSI_HOST', '100.102.175.23:8443')
+JITSI_APP_ID = os.environ.get('JITSI_APP_ID', 'telemedicina_utalca')
+JITSI_APP_SECRET = os.environ.get('JITSI_APP_SECRET', 'ClaveSecretaHenry2026')
+
+# Vigencia del token y margen antes de su expiración para renovarlo
+JITSI_TOKEN_TTL = int(os.environ.get('JITSI_TOKEN_TTL', 3600))
+JITSI_TOKEN_MARGEN = int(os.environ.get('JITSI_TOKEN_MARGEN', 300))
+
+# Máximo de tokens en caché (una sala activa = 2 tokens: TENS y médico)
+MAX_TOKENS_CACHE = 2048
+
+
+_tokens = {}
+_lock = threading.Lock()
+
+
+def _emitir_token(nombre_usuario, sala):
+    import jwt
+
+    ahora = int(time.time())
+    exp = ahora + JITSI_TOKEN_TTL
+    payload = {
+        "iss": JITSI_APP_ID,
+        "aud": JITSI_APP_ID,
+        "sub": JITSI_HOST,
+        "room": sala,
+        "iat": ahora,
+        "exp": exp,
+        "context": {"user": {"name": nombre_usuario}}
+    }
+    return jwt.encode(payload, JITSI_APP_SECRET, algorithm="HS256"), exp
+
+
+def _purgar_expirados(ahora):
+    """Elimina tokens vencidos; si la caché sigue llena, la vacía."""
+    for clave in [c for c, (_, exp) in _tokens.items() if exp - JITSI_TOKEN_MARGEN <= ahora]:
+        del _tokens[clave]
+    if len(_tokens) >= MAX_TOKENS_CACHE:
+        _tokens.clear()
+
+
+def obtener_token_jitsi(nombre_usuario, sala):
+    """
+    Retorna un token JWT para la sala, reutilizando el emitido antes al
+    mismo usuario mientras le quede más de JITSI_TOKEN_MARGEN segundos.
+
+    Returns:
+        tuple: (token, exp) con exp en segundos epoch
+    """
+    clave = (nombre_usuario, sala)
+    ahora = time.time()
+
+    with _lock:
+        en_cache = _tokens.get(clave)
+        if en_cache and en_cache[1] - JITSI_TOKEN_MARGEN > ahora:
+            return en_cache
+
+    token, exp = _emitir_token(nombre_usuario, sala)
+
+    with _lock:
+        if len(_tokens) >= MAX_TOKENS_CACHE:
+            _purgar_expirados(ahora)
+        _tokens[clave] = (token, exp)
+
+    return token, exp
+
+
+def generar_token_jitsi(nombre_usuario, sala):
+    """Retorna solo el token JWT (ver obtener_token_jitsi)."""
+    return obtener_token_jitsi(nombre_usuario, sala)[0]
+
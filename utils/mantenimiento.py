@@ -0,0 +1,244 @@
+# ==========================================
+# MÓDULO DE MANTENIMIENTO - TELEMEDICINA
+# ==========================================
+# Tareas periódicas en segundo plano:
+# - Liberar consultas 'atendiendo' abandonadas (el médico
+#   se desconectó sin finalizar y dejó de enviar latidos)
+# - Compactar la tabla consultas: las finalizadas ya copiadas
+#   al historial se eliminan, para que la tabla viva solo
+#   contenga pacientes en curso
+# - Refrescar los agregados de analítica
+# - Escalar/expirar solicitudes de aprobación sin resolver y
+#   archivar las resueltas (utils/aprobaciones.py)
+# - Eliminar las sesiones vencidas (utils/sesiones.py)
+# ==========================================
+
+import os
+import time
+import threading
+
+from .analitica import refrescar_analitica
+from .aprobaciones import (
+    PLAZOS_SOLICITUDES, archivar_solicitudes_resueltas, vencer_solicitudes_pendientes
+)
+from .auditoria import registrar_auditoria_lote
+from .consultas import _archivar_en_transaccion
+from .database import get_db_connection
+from .sesiones import purgar_sesiones_vencidas
+
+# Minutos sin latido tras los cuales una consulta 'atendiendo' se considera abandonada
+CONSULTA_TIMEOUT_MINUTOS = int(os.environ.get('CONSULTA_TIMEOUT_MINUTOS', 10))
+# Intervalo con que consulta.html envía el latido del médico
+LATIDO_INTERVALO_SEGUNDOS = int(os.environ.get('LATIDO_INTERVALO_SEGUNDOS', 20))
+# 'finalizar' (se archiva en el historial) o 'reencolar' (vuelve a 'esperando')
+REAPER_ACCION = os.environ.get('REAPER_ACCION', 'finalizar')
+REAPER_INTERVALO_SEGUNDOS = int(os.environ.get('REAPER_INTERVALO_SEGUNDOS', 60))
+REAPER_LOTE = int(os.environ.get('REAPER_LOTE', 100))
+# Consultas finalizadas eliminadas por transacción al compactar
+COMPACTACION_LOTE = int(os.environ.get('COMPACTACION_LOTE', 500))
+
+# Se activa al apagar el proceso: la pasada en curso termina y no empieza otra
+_detener = threading.Event()
+_hilo = None
+
+# Consultas sin latido: las anteriores a los latidos usan la fecha de creación
+_SQL_ABANDONADAS = '''
+    SELECT id FROM consultas
+    WHERE estado = 'atendiendo'
+      AND COALESCE(ultimo_latido, fecha) < datetime('now', ?)
+    LIMIT ?
+'''
+
+# Finalizadas con su fila en el historial: por consulta_id, o para las
+# archivadas antes de existir esa columna, por CIP y fecha de inicio
+_SQL_FINALIZADAS_ARCHIVADAS = '''
+    SELECT c.id FROM consultas c
+    WHERE c.id > ? AND c.estado = 'finalizada'
+      AND (
+          EXISTS (SELECT 1 FROM historial_consultas h WHERE h.consulta_id = c.id)
+          OR EXISTS (
+              SELECT 1 FROM historial_consultas h
+              WHERE h.cip = c.cip AND h.fecha_inicio = c.fecha AND h.consulta_id IS NULL
+          )
+      )
+    ORDER BY c.id
+    LIMIT ?
+'''
+
+
+def _liberar_lote(conn, accion, limite, tamano_lote):
+    """
+    Procesa un lote de consultas abandonadas en una transacción.
+
+    Returns:
+        tuple: (seleccionadas, liberadas)
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ids = [fila[0] for fila in conn.execute(_SQL_ABANDONADAS, (limite, tamano_lote))]
+        if accion == 'reencolar':
+            conn.executemany('''
+                UPDATE consultas
+                SET estado = 'esperando', nombre_medico = 'Pendiente', ultimo_latido = NULL
+                WHERE id = ?
+            ''', [(consulta_id,) for consulta_id in ids])
+            liberadas = len(ids)
+        else:
+            # Solo cuentan las que realmente se archivaron
+            liberadas = sum(
+                1 for consulta_id in ids if _archivar_en_transaccion(conn, consulta_id) is not None
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(ids), liberadas
+
+
+def liberar_consultas_abandonadas(conn, timeout_minutos=None, accion=None, tamano_lote=None):
+    """
+    Finaliza o reencola las consultas 'atendiendo' sin latido reciente,
+    por lotes de una transacción cada uno.
+
+    Args:
+        timeout_minutos: minutos sin latido (por defecto CONSULTA_TIMEOUT_MINUTOS)
+        accion: 'finalizar' o 'reencolar' (por defecto REAPER_ACCION)
+        tamano_lote: consultas por transacción (por defecto REAPER_LOTE)
+
+    Returns:
+        tuple: (accion, cantidad de consultas liberadas)
+    """
+    timeout_minutos = timeout_minutos or CONSULTA_TIMEOUT_MINUTOS
+    accion = accion or REAPER_ACCION
+    tamano_lote = tamano_lote or REAPER_LOTE
+
+    if accion not in ('finalizar', 'reencolar'):
+        raise ValueError(f"REAPER_ACCION inválida: {accion}")
+
+    limite = f'-{int(timeout_minutos)} minutes'
+    total = 0
+    while True:
+        seleccionadas, liberadas = _liberar_lote(conn, accion, limite, tamano_lote)
+        total += liberadas
+        # Sin avance, el próximo lote seleccionaría las mismas consultas
+        if seleccionadas < tamano_lote or liberadas == 0:
+            break
+    return accion, total
+
+
+def compactar_consultas_finalizadas(conn, tamano_lote=None):
+    """
+    Elimina de consultas las filas finalizadas que ya están en el historial,
+    por lotes de una transacción cada uno. Las finalizadas sin fila en el
+    historial se conservan.
+
+    Returns:
+        int: cantidad de consultas eliminadas
+    """
+    tamano_lote = tamano_lote or COMPACTACION_LOTE
+    ultimo_id, total = 0, 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [fila[0] for fila in conn.execute(
+                _SQL_FINALIZADAS_ARCHIVADAS, (ultimo_id, tamano_lote)
+            )]
+            conn.executemany('DELETE FROM consultas WHERE id = ?', [(i,) for i in ids])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += len(ids)
+        if len(ids) < tamano_lote:
+            return total
+        ultimo_id = ids[-1]
+
+
+def vencer_y_archivar_solicitudes(conn):
+    """
+    Escala/expira las solicitudes vencidas (con su auditoría) y archiva
+    las resueltas antiguas.
+    
+    Returns:
+        tuple: (escaladas, expiradas, archivadas) - cantidades
+    """
+    escaladas, expiradas = vencer_solicitudes_pendientes(conn)
+    registros = [{
+        'usuario_id': None,
+        'usuario_nombre': 'sistema',
+        'usuario_rol': 'sistema',
+        'accion': accion,
+        'categoria': 'sistema',
+        'entidad_tipo': 'solicitud',
+        'entidad_id': str(solicitud_id),
+        'resultado': resultado,
+        'mensaje': f"{tipo_accion}: {mensaje}",
+    } for solicitudes, accion, resultado, mensaje in (
+        (escaladas, 'solicitud_escalada', 'pendiente', 'sin resolver, escalada al Admin Maestro'),
+        (expiradas, 'solicitud_expirada', 'error', 'expirada sin resolver'),
+    ) for solicitud_id, tipo_accion in solicitudes]
+    if registros:
+        registrar_auditoria_lote(conn, registros)
+        conn.commit()
+    
+    archivadas = archivar_solicitudes_resueltas(conn)
+    return len(escaladas), len(expiradas), archivadas
+
+
+def mantenimiento_programado():
+    """Ejecuta las tareas de mantenimiento cada REAPER_INTERVALO_SEGUNDOS"""
+    # Tras un reinicio los latidos enviados mientras el servidor no
+    # respondía se perdieron: antes de liberar consultas se da a los
+    # médicos un plazo completo para volver a enviarlos
+    liberar_desde = time.monotonic() + CONSULTA_TIMEOUT_MINUTOS * 60
+    while not _detener.wait(REAPER_INTERVALO_SEGUNDOS):
+        conn = get_db_connection()
+        try:
+            if time.monotonic() >= liberar_desde:
+                accion, liberadas = liberar_consultas_abandonadas(conn)
+                if liberadas:
+                    print(f"[MANTENIMIENTO] {liberadas} consultas abandonadas ({accion})")
+        except Exception as e:
+            print(f"[MANTENIMIENTO] Error liberando consultas: {e}")
+        try:
+            compactadas = compactar_consultas_finalizadas(conn)
+            if compactadas:
+                print(f"[MANTENIMIENTO] {compactadas} consultas finalizadas retiradas de la tabla activa")
+        except Exception as e:
+            print(f"[MANTENIMIENTO] Error compactando consultas: {e}")
+        try:
+            escaladas, expiradas, archivadas = vencer_y_archivar_solicitudes(conn)
+            if escaladas or expiradas or archivadas:
+                print(f"[MANTENIMIENTO] Solicitudes: {escaladas} escaladas, {expiradas} expiradas, "
+                      f"{archivadas} archivadas")
+        except Exception as e:
+            print(f"[MANTENIMIENTO] Error venciendo solicitudes: {e}")
+        try:
+            purgadas = purgar_sesiones_vencidas(conn)
+            if purgadas:
+                print(f"[MANTENIMIENTO] {purgadas} sesiones vencidas eliminadas")
+        except Exception as e:
+            print(f"[MANTENIMIENTO] Error purgando sesiones: {e}")
+        try:
+            refrescar_analitica(conn)
+        except Exception as e:
+            print(f"[MANTENIMIENTO] Error refrescando analitica: {e}")
+        finally:
+            conn.close()
+
+
+def iniciar_hilo_mantenimiento():
+    global _hilo
+    if not os.environ.get('WERKZEUG_RUN_MAIN'):
+        _hilo = threading.Thread(target=mantenimiento_programado, daemon=True)
+        _hilo.start()
+        print(f"[MANTENIMIENTO] Consultas sin latido por {CONSULTA_TIMEOUT_MINUTOS} min "
+              f"se liberan ({REAPER_ACCION}) cada {REAPER_INTERVALO_SEGUNDOS} s")
+        print(f"[MANTENIMIENTO] Plazos de solicitudes (horas): {PLAZOS_SOLICITUDES}")
+
+
+def detener_hilo_mantenimiento(timeout=None):
+    """Espera a que termine la pasada en curso sin iniciar otra."""
+    _detener.set()
+    if _hilo is not None:
+        _hilo.join(timeout)
@@ -0,0 +1,330 @@
+# ==========================================
+# MÓDULO DE MÉTRICAS - TELEMEDICINA
+# ==========================================
+# Instrumentación por request:
+# - Histograma de latencia por ruta (endpoint, método)
+# - Desglose por fase (SQL, hash de contraseña, cifrado,
+#   plantillas) con el decorador medir_fase()
+# - Endpoint /metrics en formato de texto Prometheus
+# - Perfiles cProfile muestreados de requests lentos
+# - Límite de consultas SQL por request (limite_consultas()),
+#   que en modo test falla con AssertionError
+#
+# Sin request en curso (hilos de fondo, scripts) las fases
+# no se registran y las funciones se llaman sin costo extra.
+# ==========================================
+
+import cProfile
+import glob
+import ipaddress
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+METRICAS_HABILITADAS = os.environ.get('METRICAS_HABILITADAS', '1') == '1'
+# Si se define, /metrics exige "Authorization: Bearer <token>"; si no,
+# solo responde a sesiones de administrador y, fuera de producción, a
+# localhost (detrás de un proxy en el mismo equipo todo llega de localhost)
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+# Cabecera Server-Timing con el desglose por fase: solo con este indicador
+# (depuración) o para administradores. Revela cuánto SQL y hashing hizo el
+# request, así que nunca se envía en las rutas de autenticación
+METRICAS_SERVER_TIMING = os.environ.get('METRICAS_SERVER_TIMING', '0') == '1'
+_ENDPOINTS_AUTENTICACION = frozenset({'principal.index', 'principal.login', 'principal.logout'})
+
+# Perfilado: fracción de requests perfilados (0 = apagado) y umbral
+# sobre el que se guarda el perfil en PERFIL_DIR
+PERFIL_MUESTREO = float(os.environ.get('PERFIL_MUESTREO', 0))
+PERFIL_UMBRAL_MS = int(os.environ.get('PERFIL_UMBRAL_MS', 500))
+PERFIL_MAX_ARCHIVOS = int(os.environ.get('PERFIL_MAX_ARCHIVOS', 50))
+PERFIL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'perfiles')
+
+# Consultas SQL permitidas por request salvo que la ruta declare otro
+# límite con @limite_consultas(n) (0 = sin límite). Al excederse se
+# registra un aviso; con app.testing o SQL_LIMITE_ESTRICTO=1 falla.
+SQL_LIMITE_CONSULTAS = int(os.environ.get('SQL_LIMITE_CONSULTAS', 50))
+SQL_LIMITE_ESTRICTO = os.environ.get('SQL_LIMITE_ESTRICTO', '0') == '1'
+
+# Límites (segundos) de los buckets del histograma de latencia
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (endpoint, método) -> [conteos por bucket..., +Inf, suma]
+_latencias = {}
+# (endpoint, método, estado) -> cantidad
+_requests = {}
+# (endpoint, fase) -> [segundos, llamadas]
+_fases = {}
+# endpoint -> máximo de consultas SQL en un request
+_consultas_max = {}
+# Funciones que agregan sus propias líneas a /metrics (ver registrar_colector)
+_colectores = []
+_lock = threading.Lock()
+_inicio_proceso = time.time()
+
+# Fases del request en curso: {fase: [segundos, llamadas]}
+_fases_request = ContextVar('fases_request', default=None)
+
+
+def medir_fase(fase):
+    """
+    Decorador: acumula el tiempo de la función en la fase `fase`
+    del request en curso.
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            fases = _fases_request.get()
+            if fases is None:
+                return funcion(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                acumulado = fases.setdefault(fase, [0.0, 0])
+                acumulado[0] += time.perf_counter() - inicio
+                acumulado[1] += 1
+        return envoltura
+    return decorador
+
+
+def registrar_fase(fase, segundos, llamadas=1):
+    """Suma tiempo a una fase del request en curso (para mediciones sin decorador)."""
+    fases = _fases_request.get()
+    if fases is not None:
+        acumulado = fases.setdefault(fase, [0.0, 0])
+        acumulado[0] += segundos
+        acumulado[1] += llamadas
+
+
+def registrar_colector(colector):
+    """
+    Agrega a /metrics las líneas (formato Prometheus, con HELP/TYPE)
+    que retorne `colector()` en cada exportación.
+    """
+    if colector not in _colectores:
+        _colectores.append(colector)
+
+
+def limite_consultas(maximo):
+    """
+    Decorador de rutas: cantidad máxima de consultas SQL por request
+    (reemplaza a SQL_LIMITE_CONSULTAS para esa ruta). Se aplica debajo
+    de @app.route.
+    """
+    def decorador(vista):
+        vista.limite_consultas = maximo
+        return vista
+    return decorador
+
+
+def _registrar_request(endpoint, metodo, estado, duracion, fases):
+    with _lock:
+        histograma = _latencias.get((endpoint, metodo))
+        if histograma is None:
+            histograma = _latencias[(endpoint, metodo)] = [0] * (len(BUCKETS_LATENCIA) + 1) + [0.0]
+        for i, limite in enumerate(BUCKETS_LATENCIA):
+            if duracion <= limite:
+                histograma[i] += 1
+                break
+        else:
+            histograma[len(BUCKETS_LATENCIA)] += 1
+        histograma[-1] += duracion
+
+        clave = (endpoint, metodo, estado)
+        _requests[clave] = _requests.get(clave, 0) + 1
+
+        for fase, (segundos, llamadas) in fases.items():
+            acumulado = _fases.setdefault((endpoint, fase), [0.0, 0])
+            acumulado[0] += segundos
+            acumulado[1] += llamadas
+
+        consultas = fases.get('sql', (0, 0))[1]
+        if consultas > _consultas_max.get(endpoint, 0):
+            _consultas_max[endpoint] = consultas
+
+
+def registrar_request(endpoint, metodo, estado, duracion):
+    """Registra un request atendido fuera de Flask (rutas asíncronas de asgi.py)."""
+    _registrar_request(endpoint, metodo, estado, duracion, {})
+
+
+def _etiquetas(**etiquetas):
+    pares = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+def exportar_prometheus():
+    """Métricas acumuladas en formato de texto Prometheus (0.0.4)."""
+    with _lock:
+        latencias = {k: list(v) for k, v in _latencias.items()}
+        requests = dict(_requests)
+        fases = {k: list(v) for k, v in _fases.items()}
+        consultas_max = dict(_consultas_max)
+
+    lineas = [
+        '# HELP telemedicina_http_request_duration_seconds Latencia de requests por ruta.',
+        '# TYPE telemedicina_http_request_duration_seconds histogram',
+    ]
+    for (endpoint, metodo), histograma in sorted(latencias.items()):
+        acumulado = 0
+        for limite, conteo in zip(BUCKETS_LATENCIA + ('+Inf',), histograma):
+            acumulado += conteo
+            lineas.append('telemedicina_http_request_duration_seconds_bucket'
+                          f'{_etiquetas(endpoint=endpoint, method=metodo, le=limite)} {acumulado}')
+        lineas.append('telemedicina_http_request_duration_seconds_sum'
+                      f'{_etiquetas(endpoint=endpoint, method=metodo)} {histograma[-1]:.6f}')
+        lineas.append('telemedicina_http_request_duration_seconds_count'
+                      f'{_etiquetas(endpoint=endpoint, method=metodo)} {acumulado}')
+
+    lineas += [
+        '# HELP telemedicina_http_requests_total Requests por ruta y código de estado.',
+        '# TYPE telemedicina_http_requests_total counter',
+    ]
+    for (endpoint, metodo, estado), conteo in sorted(requests.items()):
+        lineas.append('telemedicina_http_requests_total'
+                      f'{_etiquetas(endpoint=endpoint, method=metodo, status=estado)} {conteo}')
+
+    lineas += [
+        '# HELP telemedicina_fase_segundos_total Tiempo acumulado por fase dentro de cada ruta.',
+        '# TYPE telemedicina_fase_segundos_total counter',
+    ]
+    for (endpoint, fase), (segundos, _) in sorted(fases.items()):
+        lineas.append(f'telemedicina_fase_segundos_total{_etiquetas(endpoint=endpoint, fase=fase)} {segundos:.6f}')
+
+    lineas += [
+        '# HELP telemedicina_fase_llamadas_total Llamadas por fase dentro de cada ruta.',
+        '# TYPE telemedicina_fase_llamadas_total counter',
+    ]
+    for (endpoint, fase), (_, llamadas) in sorted(fases.items()):
+        lineas.append(f'telemedicina_fase_llamadas_total{_etiquetas(endpoint=endpoint, fase=fase)} {llamadas}')
+
+    lineas += [
+        '# HELP telemedicina_sql_consultas_max Máximo de consultas SQL en un request de la ruta.',
+        '# TYPE telemedicina_sql_consultas_max gauge',
+    ]
+    for endpoint, maximo in sorted(consultas_max.items()):
+        lineas.append(f'telemedicina_sql_consultas_max{_etiquetas(endpoint=endpoint)} {maximo}')
+
+    lineas += [
+        '# HELP telemedicina_proceso_inicio_segundos Inicio del proceso (epoch).',
+        '# TYPE telemedicina_proceso_inicio_segundos gauge',
+        f'telemedicina_proceso_inicio_segundos {_inicio_proceso:.0f}',
+    ]
+    for colector in _colectores:
+        lineas += colector()
+    return '\n'.join(lineas) + '\n'
+
+
+def _guardar_perfil(perfil, endpoint, duracion_ms):
+    """Guarda el perfil en PERFIL_DIR y conserva solo los PERFIL_MAX_ARCHIVOS más recientes."""
+    if not os.path.exists(PERFIL_DIR):
+        os.makedirs(PERFIL_DIR)
+    marca = datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
+    perfil.dump_stats(os.path.join(PERFIL_DIR, f"{marca}_{endpoint}_{duracion_ms:.0f}ms.prof"))
+
+    archivos = sorted(glob.glob(os.path.join(PERFIL_DIR, '*.prof')))
+    for antiguo in archivos[:-PERFIL_MAX_ARCHIVOS]:
+        os.remove(antiguo)
+
+
+def _acceso_metricas_permitido(request, session):
+    if METRICAS_TOKEN:
+        return request.headers.get('Authorization', '') == f'Bearer {METRICAS_TOKEN}'
+    if session.get('rol') in ('admin', 'admin_maestro'):
+        return True
+    if os.environ.get('FLASK_ENV') == 'production':
+        return False
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def _verificar_limite_consultas(app, endpoint, fases):
+    """Avisa (o falla en modo test) si el request excedió su límite de consultas."""
+    vista = app.view_functions.get(endpoint)
+    maximo = getattr(vista, 'limite_consultas', SQL_LIMITE_CONSULTAS)
+    consultas = fases.get('sql', (0, 0))[1]
+    if not maximo or consultas <= maximo:
+        return
+    mensaje = f"{endpoint} ejecutó {consultas} consultas SQL (límite {maximo})"
+    if app.testing or SQL_LIMITE_ESTRICTO:
+        raise AssertionError(mensaje)
+    print(f"[SQL] Límite de consultas excedido: {mensaje}")
+
+
+def registrar_metricas(app):
+    """Registra los hooks de instrumentación y la ruta /metrics en la app."""
+    if not METRICAS_HABILITADAS:
+        return
+
+    from flask import Response, g, request, session
+
+    @app.before_request
+    def _iniciar_medicion():
+        g._metricas_token = _fases_request.set({})
+        g._metricas_inicio = time.perf_counter()
+        g._metricas_perfil = None
+        if PERFIL_MUESTREO and random.random() < PERFIL_MUESTREO:
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+                g._metricas_perfil = perfil
+            except ValueError:
+                # Otro perfilador activo en este hilo
+                pass
+
+    @app.after_request
+    def _registrar_medicion(response):
+        inicio = g.pop('_metricas_inicio', None)
+        if inicio is None or request.endpoint == 'metricas':
+            return response
+
+        duracion = time.perf_counter() - inicio
+        endpoint = request.endpoint or 'sin_ruta'
+        fases = _fases_request.get() or {}
+        _registrar_request(endpoint, request.method, response.status_code, duracion, fases)
+
+        perfil = g.pop('_metricas_perfil', None)
+        if perfil is not None:
+            perfil.disable()
+            if duracion * 1000 >= PERFIL_UMBRAL_MS:
+                try:
+                    _guardar_perfil(perfil, endpoint, duracion * 1000)
+                except OSError as e:
+                    print(f"[METRICAS] No se pudo guardar el perfil: {e}")
+
+        # Desglose del request en curso, visible en las herramientas del navegador
+        if endpoint not in _ENDPOINTS_AUTENTICACION and (
+            METRICAS_SERVER_TIMING or session.get('rol') in ('admin', 'admin_maestro')
+        ):
+            response.headers['Server-Timing'] = ', '.join(
+                [f'{fase};desc="{llamadas}";dur={segundos * 1000:.1f}'
+                 for fase, (segundos, llamadas) in fases.items()]
+                + [f'total;dur={duracion * 1000:.1f}']
+            )
+
+        _verificar_limite_consultas(app, endpoint, fases)
+        return response
+
+    @app.teardown_request
+    def _cerrar_medicion(error=None):
+        perfil = g.pop('_metricas_perfil', None)
+        if perfil is not None:
+            perfil.disable()
+        token = g.pop('_metricas_token', None)
+        if token is not None:
+            _fases_request.reset(token)
+
+    @app.route('/metrics')
+    def metricas():
+        if not _acceso_metricas_permitido(request, session):
+            return Response('No autorizado\n', status=403, mimetype='text/plain')
+        return Response(exportar_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,115 @@
+# ==========================================
+# MÓDULO DE PACIENTES - TELEMEDICINA
+# ==========================================
+# Identidad pseudoanónima de pacientes (CIP)
+# Un paciente = un CIP, reutilizado en cada visita
+# ==========================================
+
+from .seguridad import cifrar_rut, parsear_rut, generar_cip, hashear_rut_legado
+
+
+def buscar_cip_por_rut_hash(conn, rut_hash):
+    """
+    Busca el CIP ya asignado a un paciente a partir del hash de su RUT.
+    Usa el índice cubriente idx_mapeo_pacientes_rut_hash_cip (búsqueda puntual).
+
+    Returns:
+        str: CIP existente, o None si el paciente no está registrado
+    """
+    if not rut_hash:
+        return None
+
+    fila = conn.execute('''
+        SELECT cip FROM mapeo_pacientes
+        WHERE rut_hash = ?
+        ORDER BY id
+        LIMIT 1
+    ''', (rut_hash,)).fetchone()
+
+    return fila['cip'] if fila else None
+
+
+def rehashear_paciente_legado(conn, rut, rut_hash):
+    """
+    Busca al paciente por el hash legado (SHA-256 con salt fijo) y, si lo
+    encuentra, pasa su mapeo, consultas e historial al hash HMAC en el acto.
+
+    Mientras migrations/fase3_hash_rut_hmac.py no se haya ejecutado, un
+    paciente registrado antes de HMAC solo tiene el hash legado: sin esta
+    búsqueda recibiría un segundo CIP. Una vez migrada la base no encuentra nada.
+
+    Returns:
+        str: CIP existente, o None si no hay filas con el hash legado
+    """
+    hash_legado = hashear_rut_legado(rut)
+    fila = conn.execute('''
+        SELECT cip FROM mapeo_pacientes
+        WHERE rut_hash = ?
+        ORDER BY id
+        LIMIT 1
+    ''', (hash_legado,)).fetchone()
+    if not fila:
+        return None
+
+    conn.execute('UPDATE mapeo_pacientes SET rut_hash = ? WHERE rut_hash = ?', (rut_hash, hash_legado))
+    conn.execute('UPDATE consultas SET rut_paciente_hash = ? WHERE rut_paciente_hash = ?', (rut_hash, hash_legado))
+    conn.execute(
+        'UPDATE historial_consultas SET rut_paciente_hash = ? WHERE rut_paciente_hash = ?',
+        (rut_hash, hash_legado)
+    )
+    return fila['cip']
+
+
+def obtener_o_registrar_paciente(conn, rut, nombre_posta, creado_por_id=None):
+    """
+    Obtiene el CIP de un paciente, registrándolo solo si es la primera visita.
+
+    Si el RUT ya existe en mapeo_pacientes (con hash HMAC, o con el legado si
+    la base aún no pasó por la fase 3) se reutiliza su CIP y no se vuelve
+    a cifrar el RUT. Solo los pacientes nuevos pagan generación de CIP y
+    cifrado AES-256-GCM.
+
+    No hace commit: la transacción queda en manos del llamador. Si no hay
+    una abierta, inicia una de escritura (BEGIN IMMEDIATE) antes de buscar:
+    dos TENS que registran al mismo paciente nuevo a la vez no crean dos CIP
+    (además, idx_mapeo_pacientes_rut_hash_unico lo impide en la base).
+
+    Args:
+        rut: RutParseado (o RUT en cualquier formato válido)
+
+    Returns:
+        tuple: (cip, rut_hash, es_nuevo) o (None, None, False) si el RUT es inválido
+              o hay error de hash o cifrado (claves ausentes o inválidas)
+    """
+    rut = parsear_rut(rut)
+    if not rut:
+        return None, None, False
+    try:
+        rut_hash = rut.hash
+    except ValueError as e:
+        # RUT_HASH_KEY ausente o inválida: igual que un error de cifrado
+        print(f"[SEGURIDAD] Error calculando hash de RUT: {e}")
+        return None, None, False
+
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    cip = buscar_cip_por_rut_hash(conn, rut_hash) or rehashear_paciente_legado(conn, rut, rut_hash)
+    if cip:
+        return cip, rut_hash, False
+
+    # Paciente nuevo: generar CIP único
+    cip = generar_cip(nombre_posta)
+    while conn.execute('SELECT 1 FROM mapeo_pacientes WHERE cip = ?', (cip,)).fetchone():
+        cip = generar_cip(nombre_posta)
+
+    # Cifrar RUT con AES-256-GCM (Ley 19.628 / Marco Ciberseguridad)
+    rut_cifrado = cifrar_rut(rut)
+    if not rut_cifrado:
+        return None, None, False
+
+    conn.execute('''
+        INSERT INTO mapeo_pacientes (cip, rut_cifrado, rut_hash, rut_enmascarado, creado_por_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (cip, rut_cifrado, rut_hash, rut.enmascarado, creado_por_id))
+
+    return cip, rut_hash, True
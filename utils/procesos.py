@@ -0,0 +1,89 @@
+# ==========================================
+# MÓDULO DE PROCESOS - TELEMEDICINA
+# ==========================================
+# Tareas en segundo plano (respaldos y mantenimiento) con
+# varios procesos de servidor: cada worker llama a
+# iniciar_tareas_segundo_plano() y solo el que obtiene el
+# bloqueo de archivo TAREAS_LOCK las ejecuta. Los demás
+# quedan esperando el bloqueo en un hilo, de modo que si el
+# worker designado termina otro toma su lugar.
+#
+# TAREAS_SEGUNDO_PLANO: 'auto' (bloqueo), '1' (siempre en
+# este proceso) o '0' (nunca, p. ej. si corren aparte).
+# ==========================================
+
+import os
+import threading
+
+from .backups_logic import iniciar_hilo_respaldos
+from .database import DB_PATH, asegurar_db
+from .mantenimiento import detener_hilo_mantenimiento, iniciar_hilo_mantenimiento
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso (waitress)
+    fcntl = None
+
+TAREAS_SEGUNDO_PLANO = os.environ.get('TAREAS_SEGUNDO_PLANO', 'auto')
+TAREAS_LOCK = os.environ.get('TAREAS_LOCK', DB_PATH + '.tareas.lock')
+
+_iniciadas = threading.Event()
+_lock = threading.Lock()
+_archivo_lock = None
+
+
+def _ejecutar_tareas():
+    asegurar_db()
+    iniciar_hilo_respaldos()
+    iniciar_hilo_mantenimiento()
+    _iniciadas.set()
+    print(f"[PROCESOS] Tareas en segundo plano en el proceso {os.getpid()}")
+
+
+def _esperar_bloqueo(archivo):
+    # flock bloquea hasta que el proceso que lo tiene termine
+    fcntl.flock(archivo, fcntl.LOCK_EX)
+    _ejecutar_tareas()
+
+
+def iniciar_tareas_segundo_plano():
+    """
+    Inicia respaldos y mantenimiento en un único proceso del servidor.
+    Idempotente: se puede llamar desde cada worker.
+
+    Returns:
+        bool: True si las tareas corren en este proceso
+    """
+    global _archivo_lock
+    if TAREAS_SEGUNDO_PLANO == '0':
+        return False
+
+    with _lock:
+        if _iniciadas.is_set() or _archivo_lock is not None:
+            return _iniciadas.is_set()
+
+        if TAREAS_SEGUNDO_PLANO == '1' or fcntl is None:
+            _ejecutar_tareas()
+            return True
+
+        # Se abre en cada proceso (no heredado del master): el bloqueo es por proceso
+        _archivo_lock = open(TAREAS_LOCK, 'a')
+        try:
+            fcntl.flock(_archivo_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            threading.Thread(target=_esperar_bloqueo, args=(_archivo_lock,), daemon=True).start()
+            return False
+
+        _ejecutar_tareas()
+        return True
+
+
+def detener_tareas_segundo_plano(timeout=None):
+    """
+    Deja terminar la pasada de mantenimiento en curso (sin iniciar otra)
+    antes de que el proceso salga, y libera el bloqueo para otro worker.
+    """
+    if _iniciadas.is_set():
+        detener_hilo_mantenimiento(timeout)
+        if _archivo_lock is not None:
+            _archivo_lock.close()
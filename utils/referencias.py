@@ -0,0 +1,143 @@
+# ==========================================
+# MÓDULO DE DATOS DE REFERENCIA - TELEMEDICINA
+# ==========================================
+# Caché en memoria (por proceso) de lugares y usuarios,
+# que cambian pocas veces al mes pero se leen en cada
+# dashboard y en cada ingreso de paciente.
+#
+# Cada tabla tiene un número de versión en versiones_datos.
+# Quien modifica la tabla llama a invalidar_referencias()
+# dentro de su transacción; cada lectura compara la versión
+# guardada (una consulta por clave primaria) y recarga solo
+# si cambió, de modo que los demás procesos también ven el
+# cambio.
+# ==========================================
+
+import threading
+
+from .metricas import registrar_colector
+
+# Columnas cacheadas (de usuarios, sin contraseñas)
+_CONSULTAS = {
+    'lugares': '''
+        SELECT id, nombre_posta, direccion, fecha_creacion, activo, es_plantilla
+        FROM lugares ORDER BY id
+    ''',
+    'usuarios': '''
+        SELECT id, nombre, rut, correo, rol, fecha_creacion, activo, es_plantilla
+        FROM usuarios ORDER BY id
+    ''',
+}
+
+# (base, tabla) -> (version, filas, filas por id)
+_cache = {}
+# tabla -> [aciertos, recargas]
+_estadisticas = {tabla: [0, 0] for tabla in _CONSULTAS}
+_lock = threading.Lock()
+
+
+def _version(conn, tabla):
+    fila = conn.execute('SELECT version FROM versiones_datos WHERE tabla = ?', (tabla,)).fetchone()
+    return fila[0] if fila else 0
+
+
+def _clave(conn, tabla):
+    # Varias apps del mismo proceso (pruebas) pueden usar bases distintas
+    return getattr(conn, 'ruta', None), tabla
+
+
+def _obtener(conn, tabla):
+    version = _version(conn, tabla)
+    with _lock:
+        entrada = _cache.get(_clave(conn, tabla))
+        if entrada and entrada[0] == version:
+            _estadisticas[tabla][0] += 1
+            return entrada
+        _estadisticas[tabla][1] += 1
+
+    # La versión se lee antes que los datos: si cambia entre ambas lecturas,
+    # la próxima lectura simplemente vuelve a recargar
+    filas = tuple(dict(f) for f in conn.execute(_CONSULTAS[tabla]).fetchall())
+    entrada = (version, filas, {f['id']: f for f in filas})
+    with _lock:
+        _cache[_clave(conn, tabla)] = entrada
+    return entrada
+
+
+def obtener_lugares(conn):
+    """
+    Lugares (postas) desde la caché.
+
+    Returns:
+        tuple: dicts ordenados por id (compartidos entre requests: no modificar)
+    """
+    return _obtener(conn, 'lugares')[1]
+
+
+def obtener_lugar(conn, lugar_id):
+    """Un lugar por id desde la caché, o None."""
+    try:
+        return _obtener(conn, 'lugares')[2].get(int(lugar_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def obtener_usuarios(conn):
+    """
+    Usuarios (sin contraseñas) desde la caché.
+
+    Returns:
+        tuple: dicts ordenados por id (compartidos entre requests: no modificar)
+    """
+    return _obtener(conn, 'usuarios')[1]
+
+
+def version_referencias(conn, tabla):
+    """Versión actual de una tabla de referencia (para claves de caché)."""
+    return _version(conn, tabla)
+
+
+def invalidar_referencias(conn, *tablas):
+    """
+    Incrementa la versión de las tablas modificadas. Se llama dentro de la
+    transacción que las modifica: si esta se revierte, la versión también.
+    """
+    for tabla in tablas:
+        conn.execute('''
+            INSERT INTO versiones_datos (tabla, version) VALUES (?, 1)
+            ON CONFLICT (tabla) DO UPDATE SET version = version + 1
+        ''', (tabla,))
+    with _lock:
+        for tabla in tablas:
+            _cache.pop(_clave(conn, tabla), None)
+
+
+def estadisticas_cache_referencias():
+    """
+    Returns:
+        dict: {tabla: {'aciertos', 'recargas', 'tasa_aciertos'}}
+    """
+    with _lock:
+        copia = {tabla: list(valores) for tabla, valores in _estadisticas.items()}
+    return {
+        tabla: {
+            'aciertos': aciertos,
+            'recargas': recargas,
+            'tasa_aciertos': round(aciertos / (aciertos + recargas), 3) if aciertos + recargas else None,
+        }
+        for tabla, (aciertos, recargas) in copia.items()
+    }
+
+
+def _metricas_cache():
+    lineas = [
+        '# HELP telemedicina_cache_referencias_total Lecturas de la caché de referencias por resultado.',
+        '# TYPE telemedicina_cache_referencias_total counter',
+    ]
+    for tabla, valores in estadisticas_cache_referencias().items():
+        lineas.append(f'telemedicina_cache_referencias_total{{tabla="{tabla}",resultado="acierto"}} {valores["aciertos"]}')
+        lineas.append(f'telemedicina_cache_referencias_total{{tabla="{tabla}",resultado="recarga"}} {valores["recargas"]}')
+    return lineas
+
+
+registrar_colector(_metricas_cache)
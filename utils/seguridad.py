@@ -7,13 +7,17 @@
 import re
 import os
 import hashlib
+import hmac
 import secrets
 import pytz
 import base64
 from datetime import datetime
+from functools import lru_cache
 from werkzeug.security import generate_password_hash, check_password_hash
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from .metricas import medir_fase
+
 # ==========================================
 # CONFIGURACIÓN DE ZONA HORARIA CHILE
 # ==========================================
@@ -57,6 +61,7 @@ def obtener_timestamp_chile():
 # HASH DE CONTRASEÑAS
 # ==========================================
 
+@medir_fase('password')
 def hashear_password(password):
     """
     Genera hash seguro de contraseña usando PBKDF2-SHA256.
@@ -65,6 +70,7 @@ def hashear_password(password):
     return generate_password_hash(password, method='pbkdf2:sha256:260000')
 
 
+@medir_fase('password')
 def verificar_password(password, hash_guardado):
     """Verifica contraseña contra hash almacenado"""
     if not hash_guardado:
@@ -103,23 +109,37 @@ def validar_politica_password(password):
 # VALIDACIÓN DE RUT CHILENO
 # ==========================================
 
-def validar_rut_chileno(rut):
+# Caracteres que se descartan al limpiar un RUT (puntos, guiones, espacios)
+_TABLA_LIMPIEZA_RUT = str.maketrans('', '', '.- \t\n\r\f\v')
+
+# Pesos del Módulo 11 (de derecha a izquierda) y DV según el resto
+_PESOS_MODULO_11 = (2, 3, 4, 5, 6, 7, 2, 3)
+_DV_POR_RESTO = '0K987654321'
+
+# Tamaño de la caché LRU de RUTs ya validados
+RUT_CACHE_SIZE = int(os.environ.get('RUT_CACHE_SIZE', 4096))
+
+
+def _limpiar_rut(rut):
+    """Remueve puntos, guiones y espacios, y pasa a mayúsculas."""
+    return rut.upper().translate(_TABLA_LIMPIEZA_RUT)
+
+
+def _calcular_dv(numero):
+    """Calcula el dígito verificador (Módulo 11) de la parte numérica del RUT."""
+    suma = 0
+    for digito, peso in zip(reversed(numero), _PESOS_MODULO_11):
+        suma += (ord(digito) - 48) * peso
+    return _DV_POR_RESTO[suma % 11]
+
+
+@lru_cache(maxsize=RUT_CACHE_SIZE)
+def _analizar_rut_limpio(rut_limpio):
     """
-    Valida RUT chileno completo (formato y dígito verificador).
-    
-    Formatos aceptados:
-    - 12.345.678-9
-    - 12345678-9
-    - 123456789
+    Valida un RUT ya limpio. Memoizado: un RUT repetido no recalcula el Módulo 11.
     
     Retorna: (es_valido, numero, digito_verificador, mensaje)
     """
-    if not rut or not isinstance(rut, str):
-        return False, None, None, "RUT no proporcionado"
-    
-    # Limpiar entrada: remover puntos, guiones, espacios
-    rut_limpio = re.sub(r'[.\-\s]', '', rut.upper().strip())
-    
     if len(rut_limpio) < 2:
         return False, None, None, "RUT demasiado corto"
     
@@ -131,34 +151,127 @@ def validar_rut_chileno(rut):
     dv_ingresado = rut_limpio[-1]
     
     # Validar que el número sea numérico
-    if not numero.isdigit():
+    if not numero.isdigit() or not numero.isascii():
         return False, None, None, "El RUT debe contener solo números"
     
     # Validar que el DV sea número o K
     if dv_ingresado not in '0123456789K':
         return False, None, None, "Dígito verificador inválido"
     
-    # Calcular dígito verificador usando algoritmo Módulo 11
-    suma = 0
-    multiplicador = 2
+    # Comparar con el dígito verificador calculado (Módulo 11)
+    dv_calculado = _calcular_dv(numero)
+    if dv_calculado != dv_ingresado:
+        return False, None, None, f"Dígito verificador incorrecto. Debería ser {dv_calculado}"
+    
+    return True, numero, dv_ingresado, "RUT válido"
+
+
+def validar_rut_chileno(rut):
+    """
+    Valida RUT chileno completo (formato y dígito verificador).
     
-    for digito in reversed(numero):
-        suma += int(digito) * multiplicador
-        multiplicador = multiplicador + 1 if multiplicador < 7 else 2
+    Formatos aceptados:
+    - 12.345.678-9
+    - 12345678-9
+    - 123456789
     
-    resto = suma % 11
-    dv_calculado = str(11 - resto)
+    Retorna: (es_valido, numero, digito_verificador, mensaje)
+    """
+    if isinstance(rut, RutParseado):
+        return True, rut.numero, rut.dv, "RUT válido"
     
-    if dv_calculado == '11':
-        dv_calculado = '0'
-    elif dv_calculado == '10':
-        dv_calculado = 'K'
+    if not rut or not isinstance(rut, str):
+        return False, None, None, "RUT no proporcionado"
     
-    # Comparar dígito verificador
-    if dv_calculado != dv_ingresado:
-        return False, None, None, f"Dígito verificador incorrecto. Debería ser {dv_calculado}"
+    return _analizar_rut_limpio(_limpiar_rut(rut))
+
+
+class RutParseado:
+    """
+    RUT validado una sola vez, con todas sus formas derivadas.
     
-    return True, numero, dv_ingresado, "RUT válido"
+    Se obtiene con parsear_rut() y puede pasarse a normalizar_rut(),
+    enmascarar_rut(), hashear_rut() y cifrar_rut() sin volver a validar.
+    El hash se calcula la primera vez que se pide.
+    """
+    __slots__ = ('numero', 'dv', 'normalizado', 'enmascarado', '_hash')
+    
+    def __init__(self, numero, dv):
+        self.numero = numero
+        self.dv = dv
+        self.normalizado = f"{numero}-{dv}"
+        self.enmascarado = f"****{numero[-4:]}-{dv}" if len(numero) > 4 else f"****-{dv}"
+        self._hash = None
+    
+    @property
+    def hash(self):
+        """Hash del RUT para búsquedas (ver hashear_rut)."""
+        if self._hash is None:
+            self._hash = _hash_rut_normalizado(self.normalizado)
+        return self._hash
+    
+    def __str__(self):
+        return self.normalizado
+    
+    def __repr__(self):
+        # Nunca exponer el RUT completo en logs
+        return f"RutParseado({self.enmascarado})"
+
+
+@lru_cache(maxsize=RUT_CACHE_SIZE)
+def _parsear_rut_limpio(rut_limpio):
+    es_valido, numero, dv, _ = _analizar_rut_limpio(rut_limpio)
+    if not es_valido:
+        return None
+    return RutParseado(numero, dv)
+
+
+def parsear_rut(rut):
+    """
+    Valida y descompone un RUT en un único paso (memoizado).
+    
+    Returns:
+        RutParseado: si el RUT es válido
+        None: si es inválido (usar validar_rut_chileno() para el mensaje)
+    """
+    if isinstance(rut, RutParseado):
+        return rut
+    if not rut or not isinstance(rut, str):
+        return None
+    return _parsear_rut_limpio(_limpiar_rut(rut))
+
+
+def validar_ruts_lote(ruts):
+    """
+    Valida muchos RUTs de una vez (importaciones masivas).
+    
+    Los RUTs repetidos dentro del lote se resuelven una sola vez.
+    
+    Args:
+        ruts: iterable de RUTs en cualquier formato
+    
+    Returns:
+        list: [(RutParseado o None, mensaje), ...] en el mismo orden de entrada
+    """
+    analizar = _analizar_rut_limpio
+    construir = _parsear_rut_limpio
+    limpiar = _limpiar_rut
+    vistos = {}
+    resultados = []
+    
+    for rut in ruts:
+        resultado = vistos.get(rut)
+        if resultado is None:
+            if not rut or not isinstance(rut, str):
+                resultado = (None, "RUT no proporcionado")
+            else:
+                rut_limpio = limpiar(rut)
+                es_valido, _, _, mensaje = analizar(rut_limpio)
+                resultado = (construir(rut_limpio) if es_valido else None, mensaje)
+            vistos[rut] = resultado
+        resultados.append(resultado)
+    
+    return resultados
 
 
 def formatear_rut(numero, dv):
@@ -177,10 +290,8 @@ def normalizar_rut(rut):
     Normaliza RUT a formato estándar: 12345678-9
     Sin puntos, con guión.
     """
-    es_valido, numero, dv, _ = validar_rut_chileno(rut)
-    if es_valido:
-        return f"{numero}-{dv}"
-    return None
+    rut_parseado = parsear_rut(rut)
+    return rut_parseado.normalizado if rut_parseado else None
 
 
 def enmascarar_rut(rut):
@@ -188,19 +299,53 @@ def enmascarar_rut(rut):
     Enmascara RUT para display seguro.
     Ej: 12345678-9 → ****5678-9
     """
-    es_valido, numero, dv, _ = validar_rut_chileno(rut)
-    if not es_valido:
-        return "****-*"
+    rut_parseado = parsear_rut(rut)
+    return rut_parseado.enmascarado if rut_parseado else "****-*"
+
+
+@lru_cache(maxsize=1)
+def _obtener_clave_hash_rut():
+    """
+    Obtiene la clave HMAC para el hash de RUT desde variables de entorno.
+    La clave debe ser de al menos 32 bytes codificada en base64.
+    Se decodifica una sola vez por proceso.
+    """
+    clave_b64 = os.environ.get('RUT_HASH_KEY')
+    if not clave_b64:
+        raise ValueError("RUT_HASH_KEY no configurada en variables de entorno")
+    
+    try:
+        clave = base64.b64decode(clave_b64)
+    except Exception as e:
+        raise ValueError(f"Error al decodificar RUT_HASH_KEY: {e}")
+    if len(clave) < 32:
+        raise ValueError("RUT_HASH_KEY debe ser de al menos 32 bytes (256 bits)")
+    return clave
+
+
+def _hash_rut_normalizado(rut_normalizado):
+    return hmac.new(_obtener_clave_hash_rut(), rut_normalizado.encode(), hashlib.sha256).hexdigest()
+
+
+def hashear_rut(rut):
+    """
+    Genera hash HMAC-SHA256 del RUT para búsquedas sin exponer el RUT.
+    Usado en mapeo_pacientes, consultas e historial clínico.
     
-    if len(numero) > 4:
-        return f"****{numero[-4:]}-{dv}"
-    return f"****-{dv}"
+    A diferencia de un SHA256 con salt fijo, sin la clave RUT_HASH_KEY no es
+    posible recorrer los ~25 millones de RUT válidos para revertir el hash.
+    """
+    rut_parseado = parsear_rut(rut)
+    if not rut_parseado:
+        return None
+    return rut_parseado.hash
 
 
-def hashear_rut(rut, salt="telemedicina_utalca_2026"):
+def hashear_rut_legado(rut, salt="telemedicina_utalca_2026"):
     """
-    Genera hash SHA256 del RUT para almacenamiento seguro.
-    Usado en historial clínico para no guardar RUT en texto plano.
+    Hash SHA256 con salt fijo usado antes de HMAC.
+    Solo para migrar datos existentes (migrations/fase3_hash_rut_hmac.py y
+    pacientes registrados antes de HMAC, ver utils/pacientes.py).
     """
     rut_normalizado = normalizar_rut(rut)
     if not rut_normalizado:
@@ -269,12 +414,13 @@ def _obtener_clave_cifrado():
         raise ValueError(f"Error al decodificar ENCRYPTION_KEY: {e}")
 
 
+@medir_fase('cifrado')
 def cifrar_rut(rut):
     """
     Cifra un RUT usando AES-256-GCM.
     
     Args:
-        rut: RUT en cualquier formato válido
+        rut: RUT en cualquier formato válido, o RutParseado
     
     Returns:
         str: RUT cifrado en formato base64 (nonce + ciphertext + tag)
@@ -303,6 +449,37 @@ def cifrar_rut(rut):
         return None
 
 
+@medir_fase('cifrado')
+def cifrar_ruts_lote(ruts):
+    """
+    Cifra varios RUTs con AES-256-GCM reutilizando la misma clave.
+    
+    Evita decodificar ENCRYPTION_KEY y crear el cifrador por cada RUT
+    (importaciones masivas). Cada RUT lleva su propio nonce.
+    
+    Args:
+        ruts: lista de RutParseado o RUTs en cualquier formato válido
+    
+    Returns:
+        list: RUTs cifrados en base64, None en la posición de los inválidos
+    """
+    aesgcm = AESGCM(_obtener_clave_cifrado())
+    token_bytes = secrets.token_bytes
+    resultados = []
+    
+    for rut in ruts:
+        rut_normalizado = normalizar_rut(rut)
+        if not rut_normalizado:
+            resultados.append(None)
+            continue
+        nonce = token_bytes(12)
+        ciphertext = aesgcm.encrypt(nonce, rut_normalizado.encode('utf-8'), None)
+        resultados.append(base64.b64encode(nonce + ciphertext).decode('utf-8'))
+    
+    return resultados
+
+
+@medir_fase('cifrado')
 def descifrar_rut(rut_cifrado):
     """
     Descifra un RUT cifrado con AES-256-GCM.
@@ -392,6 +569,7 @@ def generar_clave_cifrado():
     """
     Genera una nueva clave de cifrado AES-256 segura.
     Usar esta función UNA VEZ para generar la clave inicial.
+    También sirve para generar RUT_HASH_KEY.
     
     Returns:
         str: Clave de 32 bytes codificada en base64
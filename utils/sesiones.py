@@ -0,0 +1,438 @@
+# ==========================================
+# MÓDULO DE SESIONES - TELEMEDICINA
+# ==========================================
+# Sesiones guardadas en el servidor: la cookie solo lleva un
+# identificador aleatorio y los datos (user_id, nombre, rol,
+# token CSRF, mensajes flash) quedan en un almacén, de modo
+# que eliminar un usuario cierra sus sesiones al instante
+# sin rotar SECRET_KEY.
+#
+# SESIONES_BACKEND:
+# - 'sqlite' (por defecto): tabla sesiones, compartida por
+#   todos los workers. Cada proceso guarda las sesiones
+#   leídas por SESIONES_CACHE_SEGUNDOS, para no agregar una
+#   consulta a cada request, y acumula el último acceso para
+#   que un hilo lo escriba en un solo UPDATE cada
+#   SESIONES_ACTIVIDAD_SEGUNDOS (fuera de los requests).
+#   Una sesión revocada desde otro proceso deja de valer
+#   cuando vence su entrada en esa caché.
+# - 'memoria': LRU en el proceso (un solo proceso: waitress
+#   o desarrollo); las sesiones se pierden al reiniciar.
+# - 'cookie': cookie firmada de Flask (sin revocación).
+#
+# En la base se guarda el SHA-256 del identificador, no el
+# identificador: una copia de la base no permite suplantar
+# sesiones. Las sesiones expiran tras SESIONES_INACTIVIDAD_MINUTOS
+# sin requests o SESIONES_DURACION_HORAS desde el login; el
+# mantenimiento (utils/mantenimiento.py) elimina las vencidas.
+# ==========================================
+
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+
+from .database import asegurar_db, get_db_connection
+from .metricas import registrar_colector
+
+SESIONES_BACKEND = os.environ.get('SESIONES_BACKEND', 'sqlite')
+SESIONES_INACTIVIDAD_MINUTOS = int(os.environ.get('SESIONES_INACTIVIDAD_MINUTOS', 120))
+SESIONES_DURACION_HORAS = int(os.environ.get('SESIONES_DURACION_HORAS', 24))
+# Segundos que un proceso reutiliza una sesión leída de la base
+SESIONES_CACHE_SEGUNDOS = int(os.environ.get('SESIONES_CACHE_SEGUNDOS', 5))
+SESIONES_CACHE_MAX = int(os.environ.get('SESIONES_CACHE_MAX', 10000))
+# Cada cuánto se escribe el último acceso acumulado de las sesiones
+SESIONES_ACTIVIDAD_SEGUNDOS = int(os.environ.get('SESIONES_ACTIVIDAD_SEGUNDOS', 60))
+
+# Almacenes de las apps del proceso, para revocar también en sus cachés
+_almacenes = weakref.WeakSet()
+# resultado -> cantidad ('acierto', 'lectura', 'volcado')
+_estadisticas = {'acierto': 0, 'lectura': 0, 'volcado': 0}
+_lock_estadisticas = threading.Lock()
+
+
+def _contar(resultado, cantidad=1):
+    with _lock_estadisticas:
+        _estadisticas[resultado] += cantidad
+
+
+def _clave(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+
+def _vencida(creada, ultimo_acceso, ahora):
+    return (ahora - ultimo_acceso > SESIONES_INACTIVIDAD_MINUTOS * 60
+            or ahora - creada > SESIONES_DURACION_HORAS * 3600)
+
+
+class SesionServidor(SecureCookieSession):
+    """Sesión de Flask cuyos datos viven en un almacén del servidor."""
+
+    def __init__(self, datos=None, sid=None, creada=None):
+        super().__init__(datos or {})
+        self.sid = sid
+        self.creada = creada
+        # Si cambia (login), se emite otro identificador al guardar
+        self.usuario_inicial = self.get('user_id')
+
+
+class AlmacenMemoria:
+    """Sesiones en un LRU del proceso: clave -> [datos, usuario_id, creada, ultimo_acceso]."""
+
+    def __init__(self, maximo=None):
+        self.maximo = maximo or SESIONES_CACHE_MAX
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cargar(self, clave, conn=None):
+        with self._lock:
+            entrada = self._sesiones.get(clave)
+            if entrada is not None:
+                self._sesiones.move_to_end(clave)
+                return tuple(entrada)
+        return None
+
+    def crear(self, clave, datos, usuario_id, ahora):
+        with self._lock:
+            self._sesiones[clave] = [datos, usuario_id, ahora, ahora]
+            while len(self._sesiones) > self.maximo:
+                self._sesiones.popitem(last=False)
+
+    def actualizar(self, clave, datos, usuario_id):
+        with self._lock:
+            entrada = self._sesiones.get(clave)
+            if entrada is None:
+                return False
+            entrada[0], entrada[1] = datos, usuario_id
+            return True
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._sesiones.pop(clave, None)
+
+    def marcar_actividad(self, clave, ahora):
+        with self._lock:
+            entrada = self._sesiones.get(clave)
+            if entrada is not None:
+                entrada[3] = ahora
+
+    def olvidar_usuarios(self, usuario_ids):
+        with self._lock:
+            for clave in [c for c, e in self._sesiones.items() if e[1] in usuario_ids]:
+                del self._sesiones[clave]
+
+
+class AlmacenSQLite:
+    """
+    Sesiones en la tabla sesiones, con una caché local de corta duración
+    y el último acceso escrito por lotes.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        # clave -> ((datos, usuario_id, creada, ultimo_acceso), instante de lectura)
+        self._cache = OrderedDict()
+        # clave -> último acceso aún no escrito
+        self._pendientes = {}
+        self._hilo_volcado = None
+        self._lock = threading.Lock()
+
+    def _guardar_en_cache(self, clave, entrada):
+        with self._lock:
+            self._cache[clave] = (entrada, time.monotonic())
+            self._cache.move_to_end(clave)
+            while len(self._cache) > SESIONES_CACHE_MAX:
+                self._cache.popitem(last=False)
+
+    def cargar(self, clave, conn=None):
+        """
+        Args:
+            conn: conexión a usar en un fallo de caché (p. ej. la de un hilo
+                lector de utils/db_async.py); si es None se abre una
+        """
+        with self._lock:
+            cacheada = self._cache.get(clave)
+            if cacheada and time.monotonic() - cacheada[1] < SESIONES_CACHE_SEGUNDOS:
+                _contar('acierto')
+                return cacheada[0]
+        _contar('lectura')
+
+        propia = conn is None
+        if propia:
+            conn = get_db_connection(self.ruta)
+        try:
+            fila = conn.execute(
+                'SELECT datos, usuario_id, creada, ultimo_acceso FROM sesiones WHERE id = ?', (clave,)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            # Base sin inicializar o bloqueada: el request sigue como anónimo
+            print(f"[SESIONES] Error leyendo sesión: {e}")
+            return None
+        finally:
+            if propia:
+                conn.close()
+        if fila is None:
+            with self._lock:
+                self._cache.pop(clave, None)
+            return None
+        with self._lock:
+            ultimo_acceso = max(fila['ultimo_acceso'], self._pendientes.get(clave, 0))
+        entrada = (fila['datos'], fila['usuario_id'], fila['creada'], ultimo_acceso)
+        self._guardar_en_cache(clave, entrada)
+        return entrada
+
+    def crear(self, clave, datos, usuario_id, ahora):
+        conn = get_db_connection(self.ruta)
+        try:
+            conn.execute('''
+                INSERT INTO sesiones (id, usuario_id, datos, creada, ultimo_acceso)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (clave, usuario_id, datos, ahora, ahora))
+            conn.commit()
+        finally:
+            conn.close()
+        self._guardar_en_cache(clave, (datos, usuario_id, ahora, ahora))
+
+    def actualizar(self, clave, datos, usuario_id):
+        """Retorna False si la sesión ya no existe (revocada o vencida): no se recrea."""
+        conn = get_db_connection(self.ruta)
+        try:
+            actualizadas = conn.execute(
+                'UPDATE sesiones SET datos = ?, usuario_id = ? WHERE id = ?', (datos, usuario_id, clave)
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            cacheada = self._cache.pop(clave, None)
+        if actualizadas and cacheada:
+            _, _, creada, ultimo_acceso = cacheada[0]
+            self._guardar_en_cache(clave, (datos, usuario_id, creada, ultimo_acceso))
+        return bool(actualizadas)
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._cache.pop(clave, None)
+            self._pendientes.pop(clave, None)
+        conn = get_db_connection(self.ruta)
+        try:
+            conn.execute('DELETE FROM sesiones WHERE id = ?', (clave,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def marcar_actividad(self, clave, ahora):
+        with self._lock:
+            cacheada = self._cache.get(clave)
+            if cacheada:
+                datos, usuario_id, creada, _ = cacheada[0]
+                self._cache[clave] = ((datos, usuario_id, creada, ahora), cacheada[1])
+            self._pendientes[clave] = ahora
+            if self._hilo_volcado is None:
+                # Se inicia con la primera actividad: en gunicorn, ya en el worker
+                self._hilo_volcado = threading.Thread(
+                    target=_volcado_periodico, args=(weakref.ref(self),),
+                    daemon=True, name='sesiones-volcado'
+                )
+                self._hilo_volcado.start()
+
+    def volcar(self):
+        """Un UPDATE por lote para el último acceso de todas las sesiones activas."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return
+        conn = get_db_connection(self.ruta)
+        try:
+            conn.executemany(
+                'UPDATE sesiones SET ultimo_acceso = MAX(ultimo_acceso, ?) WHERE id = ?',
+                [(ahora, clave) for clave, ahora in pendientes.items()]
+            )
+            conn.commit()
+            _contar('volcado')
+        except Exception as e:
+            # A lo más la sesión parece inactiva antes de tiempo
+            print(f"[SESIONES] Error guardando último acceso: {e}")
+        finally:
+            conn.close()
+
+    def olvidar_usuarios(self, usuario_ids):
+        with self._lock:
+            for clave in [c for c, (e, _) in self._cache.items() if e[1] in usuario_ids]:
+                del self._cache[clave]
+
+
+def _volcado_periodico(referencia):
+    # Referencia débil: el hilo no mantiene vivo un almacén descartado (pruebas)
+    while True:
+        time.sleep(SESIONES_ACTIVIDAD_SEGUNDOS)
+        almacen = referencia()
+        if almacen is None:
+            return
+        almacen.volcar()
+        del almacen
+
+
+class InterfazSesiones(SessionInterface):
+    """Sesiones de Flask sobre un almacén del servidor (AlmacenSQLite o AlmacenMemoria)."""
+
+    session_class = SesionServidor
+    serializer = session_json_serializer
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        _almacenes.add(almacen)
+
+    def precargar(self, conn, sid):
+        """
+        Deja la sesión en la caché local usando `conn`: asgi.py la lee en un
+        hilo lector antes de abrir el contexto de request en el bucle de eventos.
+        """
+        self.almacen.cargar(_clave(sid), conn)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class()
+
+        clave = _clave(sid)
+        entrada = self.almacen.cargar(clave)
+        ahora = int(time.time())
+        if entrada is None or _vencida(entrada[2], entrada[3], ahora):
+            if entrada is not None:
+                self.almacen.eliminar(clave)
+            # Revocada o vencida: sesión vacía que borra la cookie al responder
+            sesion = self.session_class()
+            sesion.modified = True
+            return sesion
+
+        datos, _, creada, _ = entrada
+        self.almacen.marcar_actividad(clave, ahora)
+        return self.session_class(self.serializer.loads(datos), sid=sid, creada=creada)
+
+    def _borrar_cookie(self, app, response):
+        response.delete_cookie(
+            self.get_cookie_name(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            httponly=self.get_cookie_httponly(app),
+        )
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Logout (session.clear()) o sesión revocada
+            if session.sid:
+                self.almacen.eliminar(_clave(session.sid))
+            if session.modified:
+                self._borrar_cookie(app, response)
+            return
+
+        usuario_id = session.get('user_id')
+        if session.sid and usuario_id != session.usuario_inicial:
+            # Cambió el usuario: identificador nuevo (fijación de sesión)
+            self.almacen.eliminar(_clave(session.sid))
+            session.sid = None
+
+        nueva = session.sid is None
+        if nueva:
+            session.sid = secrets.token_urlsafe(32)
+            self.almacen.crear(_clave(session.sid), self.serializer.dumps(dict(session)),
+                               usuario_id, int(time.time()))
+        elif session.modified:
+            if not self.almacen.actualizar(_clave(session.sid), self.serializer.dumps(dict(session)),
+                                           usuario_id):
+                self._borrar_cookie(app, response)
+                return
+
+        if nueva or self.should_set_cookie(app, session):
+            response.set_cookie(
+                self.get_cookie_name(app),
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=self.get_cookie_domain(app),
+                path=self.get_cookie_path(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def configurar_sesiones(app):
+    """
+    Instala el almacén de sesiones en la app según
+    app.config['SESIONES_BACKEND'] (por defecto SESIONES_BACKEND).
+    """
+    backend = app.config.get('SESIONES_BACKEND', SESIONES_BACKEND)
+    if backend == 'cookie':
+        return
+    if backend == 'sqlite':
+        # La tabla sesiones debe existir antes del primer request
+        asegurar_db(app.config['DATABASE'])
+        almacen = AlmacenSQLite(app.config['DATABASE'])
+    elif backend == 'memoria':
+        almacen = AlmacenMemoria()
+    else:
+        raise ValueError(f"SESIONES_BACKEND inválido: {backend}")
+    app.session_interface = InterfazSesiones(almacen)
+
+
+def revocar_sesiones_usuarios(conn, usuario_ids):
+    """
+    Cierra todas las sesiones de los usuarios indicados. Se llama dentro
+    de la transacción que los elimina: si esta se revierte, las sesiones
+    siguen en la base (la caché local solo se vacía).
+
+    Returns:
+        int: sesiones eliminadas de la base
+    """
+    ids = {int(i) for i in usuario_ids}
+    if not ids:
+        return 0
+    eliminadas = conn.execute(
+        f"DELETE FROM sesiones WHERE usuario_id IN ({','.join('?' * len(ids))})", list(ids)
+    ).rowcount
+    for almacen in list(_almacenes):
+        almacen.olvidar_usuarios(ids)
+    return eliminadas
+
+
+def purgar_sesiones_vencidas(conn):
+    """
+    Elimina de la base las sesiones inactivas o demasiado antiguas.
+
+    Returns:
+        int: cantidad de sesiones eliminadas
+    """
+    ahora = int(time.time())
+    eliminadas = conn.execute(
+        'DELETE FROM sesiones WHERE ultimo_acceso < ? OR creada < ?',
+        (ahora - SESIONES_INACTIVIDAD_MINUTOS * 60, ahora - SESIONES_DURACION_HORAS * 3600)
+    ).rowcount
+    conn.commit()
+    return eliminadas
+
+
+def _metricas_sesiones():
+    with _lock_estadisticas:
+        copia = dict(_estadisticas)
+    lineas = [
+        '# HELP telemedicina_sesiones_total Sesiones servidas desde la caché local, leídas de la base y volcados de último acceso.',
+        '# TYPE telemedicina_sesiones_total counter',
+    ]
+    for resultado, cantidad in copia.items():
+        lineas.append(f'telemedicina_sesiones_total{{resultado="{resultado}"}} {cantidad}')
+    return lineas
+
+
+registrar_colector(_metricas_sesiones)
@@ -0,0 +1,82 @@
+# ==========================================
+# MÓDULO DE TRAZAS SQL - TELEMEDICINA
+# ==========================================
+# Conexión SQLite instrumentada (get_db_connection):
+# - Tiempo y cantidad de consultas por request, como fase
+#   'sql' de utils/metricas.py (límite por ruta)
+# - Registro de consultas lentas con su EXPLAIN QUERY PLAN
+# - SQL_TRAZA=1: imprime cada sentencia ejecutada
+#   (set_trace_callback), solo para desarrollo
+#
+# El registro de consultas lentas no incluye los parámetros
+# (pueden contener RUT u otros datos de pacientes).
+# ==========================================
+
+import os
+import sqlite3
+import time
+
+from .metricas import registrar_fase
+
+# Consultas más lentas que esto se registran con su plan (0 = apagado)
+SQL_LENTA_MS = int(os.environ.get('SQL_LENTA_MS', 100))
+SQL_TRAZA = os.environ.get('SQL_TRAZA', '0') == '1'
+
+_PREFIJOS_EXPLICABLES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def _registrar_consulta_lenta(conn, sql, parametros, duracion_ms):
+    """Imprime la consulta lenta y su plan de ejecución."""
+    sql_limpio = ' '.join(sql.split())
+    print(f"[SQL LENTA] {duracion_ms:.1f} ms: {sql_limpio}")
+    if not sql_limpio.upper().startswith(_PREFIJOS_EXPLICABLES):
+        return
+    try:
+        plan = conn.cursor(sqlite3.Cursor).execute(f'EXPLAIN QUERY PLAN {sql}', parametros).fetchall()
+    except sqlite3.Error as e:
+        print(f"   [PLAN] No disponible: {e}")
+        return
+    for fila in plan:
+        print(f"   [PLAN] {fila[3]}")
+
+
+class CursorTrazado(sqlite3.Cursor):
+    """Cursor que mide cada execute/executemany."""
+
+    def _medir(self, metodo, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, parametros)
+        finally:
+            duracion = time.perf_counter() - inicio
+            registrar_fase('sql', duracion)
+            if SQL_LENTA_MS and duracion * 1000 >= SQL_LENTA_MS:
+                # executemany: el plan se obtiene con la primera fila de parámetros
+                if metodo.__name__ == 'executemany':
+                    parametros = next(iter(parametros), ()) if isinstance(parametros, (list, tuple)) else ()
+                _registrar_consulta_lenta(self.connection, sql, parametros, duracion * 1000)
+
+    def execute(self, sql, parametros=()):
+        return self._medir(super().execute, sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self._medir(super().executemany, sql, parametros)
+
+
+class ConexionTrazada(sqlite3.Connection):
+    """Conexión cuyos cursores (y conn.execute) son CursorTrazado."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if SQL_TRAZA:
+            self.set_trace_callback(lambda sentencia: print(f"[SQL] {sentencia}"))
+
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute no pasa por cursor(): se redefinen
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
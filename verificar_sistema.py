@@ -129,6 +129,16 @@ try:
 except ImportError:
     errores.append("Flask-WTF no instalado")
 
+# Dependencias opcionales
+try:
+    import importlib.util
+    if importlib.util.find_spec('pyarrow'):
+        print("  [OK] pyarrow disponible (exportacion Parquet)")
+    else:
+        advertencias.append("pyarrow no instalado: exportacion Parquet deshabilitada")
+except ImportError:
+    pass
+
 # Verificar tokens en templates
 templates_dir = 'templates'
 templates_con_csrf = 0
@@ -188,6 +198,12 @@ if secret_key and len(secret_key) >= 32:
 else:
     errores.append("SECRET_KEY no configurada o muy corta")
 
+rut_hash_key = os.environ.get('RUT_HASH_KEY')
+if rut_hash_key:
+    print("  [OK] RUT_HASH_KEY configurada")
+else:
+    errores.append("RUT_HASH_KEY no configurada (hash HMAC de RUT)")
+
 jitsi_secret = os.environ.get('JITSI_APP_SECRET')
 if jitsi_secret:
     print("  [OK] JITSI_APP_SECRET configurada")
@@ -199,6 +215,52 @@ print(f"  [INFO] FLASK_ENV = {flask_env}")
 
 conn.close()
 
+# ==========================================
+# ARRANQUE: Tiempo de importación
+# ==========================================
+print("\n[ARRANQUE] Tiempo de importacion")
+print("-" * 40)
+
+# Importar app.py no debe abrir la base ni crear archivos, y el código
+# propio (app + utils, sin dependencias) debe caber en el presupuesto
+import subprocess
+import tempfile
+
+IMPORTACION_MAX_MS = float(os.environ.get('IMPORTACION_MAX_MS', 100))
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_prueba = os.path.join(tmp, 'importacion.db')
+    backups_existia = os.path.exists('backups')
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        capture_output=True, text=True,
+        env=dict(os.environ, DB_PATH=db_prueba, PYTHONDONTWRITEBYTECODE='')
+    )
+    if resultado.returncode != 0:
+        errores.append(f"No se pudo importar app.py: {resultado.stderr.strip().splitlines()[-1:]}")
+    else:
+        propio_us = total_us = 0
+        for linea in resultado.stderr.splitlines():
+            if not linea.startswith('import time:') or '|' not in linea:
+                continue
+            propio, acumulado, modulo = [parte.strip() for parte in linea[len('import time:'):].split('|')]
+            if not propio.isdigit():
+                continue
+            if modulo == 'app' or modulo == 'utils' or modulo.startswith('utils.'):
+                propio_us += int(propio)
+            if modulo == 'app':
+                total_us = int(acumulado)
+        print(f"  [INFO] import app: {total_us / 1000:.0f} ms (codigo propio {propio_us / 1000:.1f} ms)")
+        if propio_us / 1000 <= IMPORTACION_MAX_MS:
+            print(f"  [OK] Codigo propio dentro del presupuesto ({IMPORTACION_MAX_MS:.0f} ms)")
+        else:
+            errores.append(f"Importar app.py tarda {propio_us / 1000:.1f} ms en codigo propio "
+                           f"(presupuesto IMPORTACION_MAX_MS={IMPORTACION_MAX_MS:.0f})")
+        if os.path.exists(db_prueba):
+            errores.append("Importar app.py crea la base de datos (debe inicializarse en create_app())")
+        if not backups_existia and os.path.exists('backups'):
+            errores.append("Importar app.py crea la carpeta backups/")
+
 # ==========================================
 # RESUMEN
 # ==========================================